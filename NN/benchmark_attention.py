@@ -0,0 +1,167 @@
+"""
+step time (forward + backward) and peak memory of the attention of attnlstm, before and after
+old: the repeat expansion of Bahdanau and the float bmm masks, new: models.Attention
+the peak on the cpu is the rss high water mark (linux /proc/self) above the rss before the step
+then the two directions of forward([emb,emb])[0] against self_attend(emb), the path of attnlstm
+
+python benchmark_attention.py --maxlen 128 --batch_size 32 --embeds_dim 64
+"""
+import argparse
+import math
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from models.Attention import Bahdanau,Luong,MultiHead
+
+
+class OldBahdanau(Bahdanau):
+	def forward(self,querys,lengths,masks):
+		shapes = [querys[0].shape,querys[1].shape]
+
+		query_expand = torch.cat([
+			querys[0].repeat(1,shapes[1][1],1),
+			querys[1].repeat(1,1,shapes[0][1]).view(shapes[1][0],shapes[1][1]*shapes[0][1],shapes[1][2])
+		],dim=-1)
+
+		attn_weight = self.linear2( self.linear1( query_expand ).tanh() ).view(-1,shapes[0][1],shapes[1][1])
+		weight_mask = masks[0].float().unsqueeze(2).bmm( masks[1].float().unsqueeze(1) )
+
+		attn_weight += -1e8*weight_mask.float()
+		attn_weights = [F.softmax(attn_weight,dim=-2), F.softmax(attn_weight,dim=-1)]
+		return [
+			attn_weights[1].bmm(querys[1]),
+			attn_weights[0].transpose(1,2).bmm(querys[0])
+		]
+
+class OldLuong(Luong):
+	def forward(self,querys,lengths,masks):
+		query_normals = [query.div( math.sqrt( float(self.hidden_dim) ) ) for query in querys]
+
+		attn_weight = query_normals[0].bmm( query_normals[1].transpose(1,2) )
+		weight_mask = masks[0].float().unsqueeze(2).bmm( masks[1].float().unsqueeze(1) )
+
+		attn_weight += -1e8*weight_mask.float()
+		attn_weights = [F.softmax(attn_weight,dim=-2), F.softmax(attn_weight, dim=-1)]
+		return [
+			attn_weights[1].bmm(query_normals[1]),
+			attn_weights[0].transpose(1,2).bmm(query_normals[0])
+		]
+
+MODULES = {
+	'bahdanau old':OldBahdanau,
+	'bahdanau':Bahdanau,
+	'luong old':OldLuong,
+	'luong':Luong,
+	'multihead':MultiHead,
+}
+
+def inputs(args,device,batch_size=None,maxlen=None):
+	#the self attention of attnlstm: the same embedded batch on both sides
+	torch.manual_seed(0)
+	batch_size,maxlen = batch_size or args.batch_size,maxlen or args.maxlen
+	lengths = torch.randint(1,maxlen+1,(batch_size,))
+	lengths[0] = maxlen
+	mask = torch.arange(maxlen).view(1,-1) >= lengths.view(-1,1)
+	emb = torch.randn(batch_size,maxlen,args.embeds_dim).masked_fill(mask.unsqueeze(2),0)
+	emb = emb.to(device).requires_grad_()
+	lengths,mask = lengths.to(device),mask.to(device)
+	return [emb,emb],[lengths,lengths],[mask,mask]
+
+def build(name,args,device):
+	torch.manual_seed(0)
+	in_dim = 2*args.embeds_dim if name.startswith('bahdanau') else args.embeds_dim
+	return MODULES[name](in_dim,args.embeds_dim).to(device)
+
+def step(module,querys,lengths,masks,self_attend=False,backward=True):
+	if(self_attend):
+		out = module.self_attend(querys[0],lengths[0],masks[0])
+	else:
+		out = module(querys,lengths,masks)[0]
+	if(backward):
+		out.sum().backward()
+
+def check(args):
+	#new against old on a small batch, Bahdanau against the pairs [q0_i,q1_j] written out
+	#and self_attend against the first direction of forward
+	querys,lengths,masks = inputs(args,'cpu',batch_size=4,maxlen=7)
+	old,new = build('luong old',args,'cpu'),build('luong',args,'cpu')
+	for a,b in zip(old(querys,lengths,masks),new(querys,lengths,masks)):
+		assert torch.allclose(a,b,atol=1e-5),'luong'
+
+	new = build('bahdanau',args,'cpu')
+	pairs = torch.cat([
+		querys[0].unsqueeze(2).expand(-1,-1,7,-1),
+		querys[1].unsqueeze(1).expand(-1,7,-1,-1)
+	],dim=-1)
+	attn_weight = new.linear2( new.linear1( pairs ).tanh() ).squeeze(-1)
+	attn_weight = attn_weight.masked_fill(masks[0].unsqueeze(2) & masks[1].unsqueeze(1),-1e8)
+	expected = F.softmax(attn_weight,dim=-1).bmm(querys[1])
+	assert torch.allclose(new(querys,lengths,masks)[0],expected,atol=1e-5),'bahdanau'
+
+	for name in ['luong','bahdanau','multihead']:
+		module = build(name,args,'cpu')
+		assert torch.allclose(module(querys,lengths,masks)[0],module.self_attend(querys[0],lengths[0],masks[0]),atol=1e-5),name
+
+def step_time(name,args,device,**kwargs):
+	module = build(name,args,device)
+	querys,lengths,masks = inputs(args,device)
+	step(module,querys,lengths,masks,**kwargs)
+	start = time.time()
+	for _ in range(args.repeat):
+		step(module,querys,lengths,masks,**kwargs)
+	if(device.type=='cuda'):
+		torch.cuda.synchronize()
+	return (time.time()-start)/args.repeat*1000
+
+def status(name):
+	with open('/proc/self/status') as f:
+		for line in f:
+			if(line.startswith(name+':')):
+				return int(line.split()[1])
+
+def peak_memory(name,args,device):
+	#MB above the inputs
+	module = build(name,args,device)
+	querys,lengths,masks = inputs(args,device)
+	if(device.type=='cuda'):
+		torch.cuda.synchronize()
+		before = torch.cuda.memory_allocated()
+		torch.cuda.reset_peak_memory_stats()
+		step(module,querys,lengths,masks)
+		return (torch.cuda.max_memory_allocated()-before)/2**20
+	#resets VmHWM to the current rss
+	with open('/proc/self/clear_refs','w') as f:
+		f.write('5')
+	before = status('VmRSS')
+	step(module,querys,lengths,masks)
+	return (status('VmHWM')-before)/1024
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--batch_size', default=64, type=int)
+	parser.add_argument('--maxlen', default=128, type=int)
+	parser.add_argument('--embeds_dim', default=256, type=int)
+	parser.add_argument('--repeat', default=5, type=int)
+	parser.add_argument('--gpu', default=-1, type=int)
+	args = parser.parse_args()
+
+	device = torch.device('cuda') if torch.cuda.is_available() and args.gpu>=0 else torch.device('cpu')
+	check(args)
+	print('batch {0} maxlen {1} dim {2}, forward + backward'.format(args.batch_size,args.maxlen,args.embeds_dim))
+	print('{0:<16}{1:>12}{2:>14}'.format('attention','step ms','peak MB'))
+	for name in ['bahdanau old','bahdanau','luong old','luong']:
+		print('{0:<16}{1:>12.1f}{2:>14.1f}'.format(name,step_time(name,args,device),peak_memory(name,args,device)))
+
+	print('\nforward([emb,emb])[0] against self_attend(emb), ms')
+	print('{0:<16}{1:>12}{2:>12}{3:>12}{4:>12}'.format('attention','both fwd','self fwd','both step','self step'))
+	for name in ['luong','bahdanau','multihead']:
+		with torch.no_grad():
+			forward = [step_time(name,args,device,self_attend=s,backward=False) for s in [False,True]]
+		steps = [step_time(name,args,device,self_attend=s) for s in [False,True]]
+		print('{0:<16}{1:>12.1f}{2:>12.1f}{3:>12.1f}{4:>12.1f}'.format(name,*(forward+steps)))
+
+if(__name__ == '__main__'):
+	main()
@@ -0,0 +1,71 @@
+"""
+per batch time of the last state feature of feat_extract and of a whole attnlstm forward
+loop: the old per tweet cat + stack, gather: models.base.last_state
+
+python benchmark_feat_extract.py --batch_sizes 128 256 512 1024
+"""
+import argparse
+import time
+
+import torch
+
+from models.base import last_state
+from models import AttnLSTM
+
+
+def loop_last_state(output,lengths,hidden_dim):
+	result = []
+	for i in range(lengths.shape[0]):
+		result.append( torch.cat([ output[i][ lengths[i]-1 ][:hidden_dim],output[i][0][hidden_dim:]], dim=-1) )
+	return torch.stack( result , dim=0 )
+
+def timeit(fn,repeat):
+	fn()
+	start = time.time()
+	for _ in range(repeat):
+		fn()
+	return (time.time()-start)/repeat*1000
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--batch_sizes', default=[128,256,512,1024], type=int, nargs='+')
+	parser.add_argument('--maxlen', default=64, type=int)
+	parser.add_argument('--hidden_dim', default=256, type=int)
+	parser.add_argument('--embeds_dim', default=256, type=int)
+	parser.add_argument('--num_layer', default=2, type=int)
+	parser.add_argument('--vocab_size', default=20000, type=int)
+	parser.add_argument('--repeat', default=5, type=int)
+	parser.add_argument('--gpu', default=-1, type=int)
+	args = parser.parse_args()
+
+	device = torch.device('cuda') if torch.cuda.is_available() and args.gpu>=0 else torch.device('cpu')
+	args.embedding = False
+	args.batch_first = True
+	args.attention = 'luong'
+	model = AttnLSTM.attnlstm(args,{i:i for i in range(args.vocab_size)}).to(device)
+	model.eval()
+
+	print('{0:>6}{1:>14}{2:>14}{3:>16}{4:>16}'.format('batch','loop ms','gather ms','loop fwd ms','gather fwd ms'))
+	for batch_size in args.batch_sizes:
+		lengths = torch.randint(1,args.maxlen+1,(batch_size,))
+		lengths[0] = args.maxlen
+		querys = torch.randint(1,args.vocab_size,(batch_size,args.maxlen))
+		querys[torch.arange(args.maxlen).view(1,-1) >= lengths.view(-1,1)] = 0
+		querys,lengths = querys.to(device),lengths.to(device)
+		output = torch.randn(batch_size,args.maxlen,2*args.hidden_dim,device=device)
+
+		assert torch.equal(loop_last_state(output,lengths,args.hidden_dim),last_state(output,lengths,args.hidden_dim))
+		loop = timeit(lambda: loop_last_state(output,lengths,args.hidden_dim),args.repeat)
+		gather = timeit(lambda: last_state(output,lengths,args.hidden_dim),args.repeat)
+
+		with torch.no_grad():
+			#the model picks the feature function up from its module
+			AttnLSTM.last_state = loop_last_state
+			loop_forward = timeit(lambda: model(querys,lengths),args.repeat)
+			AttnLSTM.last_state = last_state
+			gather_forward = timeit(lambda: model(querys,lengths),args.repeat)
+
+		print('{0:>6}{1:>14.2f}{2:>14.2f}{3:>16.2f}{4:>16.2f}'.format(batch_size,loop,gather,loop_forward,gather_forward))
+
+if(__name__ == '__main__'):
+	main()
@@ -0,0 +1,77 @@
+"""
+normalize.py against remove_emoji(parse(x.lower())) of preprocess.py
+checks that every output is the same string, then reports tweets/s of both and of the process pool
+
+python benchmark_normalize.py --data {tsv with a tweet column} --repeat 10 --num_workers 4
+python benchmark_normalize.py --n_tweets 200000
+"""
+import argparse
+import random
+import time
+
+import pandas as pd
+
+import normalize
+import preprocess
+
+# overlapping misspellings, repeated @user, url inside words, punctuation between keys
+EDGE_CASES = [
+    'didntheatre', 'DIDNT theatre!', 'washingtonss', "wasn't", 'is-nt', 'chinas/russias',
+    '@USER @USER @user text @user', '@user @users @user', '@us#er @user', '@uurlser', 'urlurl',
+    '‘the ‘i “quoted” ’s', "it's i've i'm", '#metoo #MeToo metoo', '   spaces\tand\nnewlines  ', '',
+    '😂😂 emoji 🇺🇸 labour favourite', 'ΑΣ Σ ΟΔΟΣ\u00a0x\u2003y', 'dulless irans marylands', 'x' * 300,
+]
+
+
+def synthetic_tweets(n, seed=0):
+    rng = random.Random(seed)
+    words = ['@USER', 'URL', 'the', 'is', 'You', 'are', 'so', 'good!', 'bad...', '#MAGA', 'didnt',
+             "can't", 'labour', '😂', 'well-known', 'w/', '"quote"', 'it’s', 'liberals', 'gun', 'control,']
+    return [' '.join(rng.choice(words) for _ in range(rng.randint(1, 40))) for _ in range(n)]
+
+
+def reference(tweets):
+    return [preprocess.remove_emoji(preprocess.parse(x.lower())) for x in tweets]
+
+
+def timeit(fn, tweets):
+    start = time.time()
+    out = fn(tweets)
+    return out, len(tweets) / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default=None, type=str)
+    parser.add_argument('--n_tweets', default=100000, type=int, help='synthetic tweets without --data')
+    parser.add_argument('--repeat', default=1, type=int, help='times the tweets of --data are repeated')
+    parser.add_argument('--num_workers', default=4, type=int)
+    parser.add_argument('--chunk_size', default=10000, type=int)
+    args = parser.parse_args()
+
+    if args.data is not None:
+        tweets = pd.read_csv(args.data, sep='\t')['tweet'].astype(str).tolist() * args.repeat
+    else:
+        tweets = synthetic_tweets(args.n_tweets)
+    tweets = EDGE_CASES + tweets
+
+    expected, ref_speed = timeit(reference, tweets)
+    single, single_speed = timeit(
+        lambda x: normalize.normalize_all(x, num_workers=1, chunk_size=args.chunk_size), tweets)
+    pooled, pool_speed = timeit(
+        lambda x: normalize.normalize_all(x, num_workers=args.num_workers, chunk_size=args.chunk_size), tweets)
+
+    for name, out in [('single', single), ('pool', pooled)]:
+        diff = [i for i, (a, b) in enumerate(zip(expected, out)) if a.encode('utf-8') != b.encode('utf-8')]
+        if len(out) != len(expected) or diff:
+            raise AssertionError('{0}: {1} tweets differ, first {2!r}'.format(
+                name, len(diff), tweets[diff[0]] if diff else None))
+    print('{0} tweets, all outputs byte-identical'.format(len(tweets)))
+    print('{0:<28}{1:>12.0f} tweets/s'.format('preprocess.py', ref_speed))
+    print('{0:<28}{1:>12.0f} tweets/s  {2:.1f}x'.format('normalize.py', single_speed, single_speed / ref_speed))
+    print('{0:<28}{1:>12.0f} tweets/s  {2:.1f}x'.format(
+        'normalize.py {0} workers'.format(args.num_workers), pool_speed, pool_speed / ref_speed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+one time conversion of word2vec vectors (text like gensim_glove_vectors.txt or binary like
+GoogleNews-vectors-negative300.bin) to the memory mapped store of data/embedding.py
+
+python convert_embedding.py ./data/embedding/gensim_glove_vectors.txt ./data/embedding/glove
+python convert_embedding.py ./data/embedding/GoogleNews-vectors-negative300.bin ./data/embedding/googlenews --binary --dtype float16
+"""
+import argparse
+import os
+
+import numpy as np
+
+from data.embedding import word_hash
+
+
+def read_text(f,matrix,count,dim):
+	words = []
+	for i in range(count):
+		line = f.readline()
+		if(not line):
+			break
+		parts = line.rstrip(b'\n').rstrip().split(b' ')
+		words.append(parts[0].decode('utf-8',errors='replace'))
+		matrix[i] = np.array(parts[1:dim+1],dtype=np.float32)
+	return words
+
+def read_binary(f,matrix,count,dim):
+	words = []
+	size = dim*4
+	for i in range(count):
+		word = bytearray()
+		while True:
+			c = f.read(1)
+			if(c==b' ' or c==b''):
+				break
+			if(c!=b'\n'):
+				word.extend(c)
+		if(c==b''):
+			break
+		words.append(word.decode('utf-8',errors='replace'))
+		matrix[i] = np.frombuffer(f.read(size),dtype=np.float32)
+	return words
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('input')
+	parser.add_argument('out')
+	parser.add_argument('--binary', action='store_true', help='word2vec binary format')
+	parser.add_argument('--dtype', default='float32', choices=['float16','float32'])
+	args = parser.parse_args()
+
+	with open(args.input,'rb') as f:
+		header = f.readline().split()
+		if(len(header)==2):
+			count,dim = int(header[0]),int(header[1])
+		else:
+			#text file without the word2vec header
+			dim = len(header)-1
+			count = 1 + sum(1 for _ in f)
+			f.seek(0)
+
+		if not os.path.exists(args.out):
+			os.makedirs(args.out)
+		matrix = np.lib.format.open_memmap(os.path.join(args.out,'vectors.npy'),mode='w+',dtype=args.dtype,shape=(count,dim))
+		words = (read_binary if args.binary else read_text)(f,matrix,count,dim)
+		matrix.flush()
+	if(len(words)!=count):
+		raise ValueError('{0} has {1} vectors, the header says {2}'.format(args.input,len(words),count))
+
+	hashes = word_hash(words)
+	#stable, a word given twice keeps its first row
+	order = np.argsort(hashes,kind='stable')
+	np.save(os.path.join(args.out,'hash.npy'),hashes[order])
+	np.save(os.path.join(args.out,'rows.npy'),order.astype(np.int64))
+	print('{0} words of dim {1} in {2}'.format(count,dim,args.out))
+
+if(__name__ == '__main__'):
+	main()
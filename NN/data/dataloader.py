@@ -0,0 +1,138 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import Dataset
+
+PAD,UNK = 0,1
+label_map = [{'NOT':0,'OFF':1},{'UNT':0,'TIN':1},{'OTH':0,'GRP':1,'IND':2}]
+
+
+def load_vocab(file_name):
+	#vocab written by preprocess.py, one word and its count per line, most frequent first
+	#0 and 1 are kept for the padding and the unknown words
+	vocab = {'<pad>':PAD,'<unk>':UNK}
+	binary = file_name + '.bin'
+	if(os.path.exists(binary) and os.path.getmtime(binary) >= os.path.getmtime(file_name)):
+		#the same words written by preprocess.py as one utf-8 blob, no per line parsing
+		with open(binary,'rb') as f:
+			words = f.read().decode('utf-8')
+		if(len(words)>0):
+			vocab.update(zip(words.split('\n'),range(len(vocab),len(vocab)+words.count('\n')+1)))
+		return vocab
+	with open(file_name) as f:
+		for word in f:
+			word = word.strip().split()
+			if(len(word)>0 and word[0] not in vocab):
+				vocab[ word[0] ] = len(vocab)
+	return vocab
+
+def cache_key(file_name,vocab,maxlen):
+	h = hashlib.md5()
+	stat = os.stat(file_name)
+	h.update('{0}|{1}|{2}|{3}'.format(os.path.abspath(file_name),stat.st_size,stat.st_mtime,maxlen).encode('utf-8'))
+	h.update('\n'.join(vocab).encode('utf-8'))
+	h.update(np.fromiter(vocab.values(),dtype=np.int64,count=len(vocab)).tobytes())
+	return h.hexdigest()
+
+def tokenize(file_name,mode,vocab,maxlen):
+	"""
+	all the tweets of the file as one flat int32 array of token ids
+	tweet i is tokens[offsets[i]:offsets[i+1]], at most maxlen tokens and at least one
+	"""
+	data = pd.read_csv(file_name,sep='\t')
+	offsets = np.zeros(len(data)+1,dtype=np.int64)
+	tokens = []
+	for i,text in enumerate(data['tweet'].fillna('').astype(str).tolist()):
+		ids = [vocab.get(word,UNK) for word in text.strip().split()][:maxlen]
+		if(len(ids)==0):
+			ids = [UNK]
+		tokens.extend(ids)
+		offsets[i+1] = offsets[i]+len(ids)
+
+	arrays = {
+		'tokens':np.array(tokens,dtype=np.int32),
+		'offsets':offsets,
+		'id':data['id'].values.astype(np.int64),
+	}
+	if(mode!='test'):
+		labels = np.zeros((len(data),3),dtype=np.int64)
+		for i,(name,labs) in enumerate(zip(['subtask_a','subtask_b','subtask_c'],label_map)):
+			#no b label for the not offensive tweets and no c label for the untargeted ones, their loss is masked
+			labels[:,i] = data[name].map(labs).fillna(0).values
+		arrays['label'] = labels
+	return arrays
+
+class itemDataset(Dataset):
+	"""
+	the tweets of a tsv (id, tweet and in train/eval mode subtask_a/b/c) as token ids
+	the file is tokenized once, the arrays are saved in cached_ids/ next to it and memory mapped afterwards
+	an item is a view into the token array, nothing is copied until collate_fn pads the batch
+	"""
+	def __init__(self,file_name,mode,vocab,maxlen=128):
+		self.mode = mode
+
+		names = ['tokens','offsets','id'] + (['label'] if mode!='test' else [])
+		cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_name)),'cached_ids')
+		cached = os.path.join(cache_dir,'{0}_{1}'.format(os.path.basename(file_name),cache_key(file_name,vocab,maxlen)))
+		if(not os.path.isdir(cached)):
+			arrays = tokenize(file_name,mode,vocab,maxlen)
+			if not os.path.exists(cache_dir):
+				os.makedirs(cache_dir)
+			tempdir = tempfile.mkdtemp(dir=cache_dir)
+			for name in names:
+				np.save(os.path.join(tempdir,name+'.npy'),arrays[name])
+			try:
+				os.rename(tempdir,cached)
+			except OSError:
+				#another process filled the cache first
+				shutil.rmtree(tempdir)
+		arrays = {name:np.load(os.path.join(cached,name+'.npy'),mmap_mode='r') for name in names}
+
+		self.tokens = arrays['tokens']
+		self.offsets = np.array(arrays['offsets'])
+		self.id = arrays['id']
+		self.label = arrays.get('label')
+
+	def __len__(self):
+		return len(self.offsets)-1
+
+	def __getitem__(self,i):
+		item = {
+			'id':int(self.id[i]),
+			'query':self.tokens[self.offsets[i]:self.offsets[i+1]],
+		}
+		if(self.label is not None):
+			item['label'] = self.label[i]
+		return item
+
+
+def collate_fn(batch):
+	"""
+	batch: items of itemDataset, dicts with
+		'id'
+		'query': the token ids of the tweet, at least one
+		'label': the a, b and c labels (not in test mode)
+	the batch is sorted by length, longest first, so the models can pack it as it is (presorted=True)
+	'perm' is the index of every row in the batch as it came in
+	"""
+	lengths = np.array([len(item['query']) for item in batch],dtype=np.int64)
+	perm = np.argsort(-lengths,kind='stable')
+
+	query = np.zeros((len(batch),lengths.max()),dtype=np.int64)
+	for i,j in enumerate(perm):
+		query[i,:lengths[j]] = batch[j]['query']
+
+	out = {
+		'id':[batch[j]['id'] for j in perm],
+		'query':torch.from_numpy(query),
+		'length':torch.from_numpy(lengths[perm]),
+		'perm':torch.from_numpy(perm),
+	}
+	if('label' in batch[0]):
+		out['label'] = torch.from_numpy(np.stack([batch[j]['label'] for j in perm]))
+	return out
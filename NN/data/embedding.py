@@ -0,0 +1,49 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+def word_hash(words):
+	#stable 64 bit hash of every word, the key of the index of convert_embedding.py
+	return np.fromiter((int.from_bytes(hashlib.blake2b(word.encode('utf-8'),digest_size=8).digest(),'little') for word in words),
+						dtype=np.uint64,count=len(words))
+
+class EmbeddingStore(object):
+	"""
+	pretrained vectors converted by convert_embedding.py
+		vectors.npy: (words, dim) float16 or float32 matrix, memory mapped
+		hash.npy: the sorted hashes of the words, rows.npy: the row of every hash
+	a word is found by a binary search of its hash, only the rows that are asked for are read from disk
+	"""
+	def __init__(self,path):
+		self.matrix = np.load(os.path.join(path,'vectors.npy'),mmap_mode='r')
+		self.hashes = np.load(os.path.join(path,'hash.npy'),mmap_mode='r')
+		self.rows = np.load(os.path.join(path,'rows.npy'),mmap_mode='r')
+		self.dim = self.matrix.shape[1]
+
+	def __len__(self):
+		return self.matrix.shape[0]
+
+	def lookup(self,words):
+		#row of every word, -1 if it is not in the store
+		h = word_hash(words)
+		if(len(self.hashes)==0):
+			return np.full(len(words),-1,dtype=np.int64)
+		pos = np.minimum(np.searchsorted(self.hashes,h),len(self.hashes)-1)
+		return np.where(self.hashes[pos]==h,self.rows[pos],-1).astype(np.int64)
+
+	def vectors(self,words,seed=0):
+		"""
+		float32 (len(words), dim) matrix of the vectors of words
+		the words that are not in the store get random vectors of the same scale
+		"""
+		rows = self.lookup(words)
+		found = rows>=0
+		out = np.zeros((len(words),self.dim),dtype=np.float32)
+		#in row order, the reads go through the file once
+		order = np.argsort(rows[found])
+		out[np.flatnonzero(found)[order]] = self.matrix[rows[found][order]]
+		std = out[found].std() if found.any() else 1.0
+		out[~found] = np.random.RandomState(seed).normal(0,std,((~found).sum(),self.dim))
+		return out
@@ -0,0 +1,78 @@
+"""
+torch.jit.script export (frozen) of a train.py checkpoint for serving, run by jit_model.py without the training code
+the vocab and maxlen are saved in the file next to the scripted model
+with --data the scripted model is checked against the checkpoint on the tweets of the tsv,
+then the load time and the latency of one tweet requests are reported for both
+
+python export.py --save ./saved_models/{save dir}/best.pkl --out ./saved_models/{save dir}/model.pt
+python export.py --save ./saved_models/{save dir}/best.pkl --out ./saved_models/{save dir}/model.pt --data ./data/testset-levela.tsv
+"""
+import argparse
+import json
+import time
+
+import torch
+
+from data.dataloader import load_vocab
+from test import load_checkpoint,build_model
+from jit_model import JitModel
+
+def latency(fn,tweets):
+	#ms per call of one tweet, after the first calls that let torch.jit optimize the graph
+	for i in range(min(20,len(tweets))):
+		fn(tweets[i:i+1])
+	start = time.time()
+	for i in range(len(tweets)):
+		fn(tweets[i:i+1])
+	return (time.time()-start)/len(tweets)*1000
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--save', required=True, type=str, help='checkpoint of train.py')
+	parser.add_argument('--out', required=True, type=str)
+	parser.add_argument('--vocab', default='./data/vocab', type=str)
+	parser.add_argument('--data', default=None, type=str, help='tsv with id and tweet to check the export on')
+	parser.add_argument('--requests', default=200, type=int, help='one tweet requests timed with --data')
+	args = parser.parse_args()
+
+	start = time.time()
+	checkpoint = load_checkpoint(args.save)
+	vocab = load_vocab(args.vocab)
+	model = build_model(checkpoint,vocab)
+	model.eval()
+	eager_load = time.time()-start
+
+	#frozen: the weights become constants of the graph, only predict is kept
+	scripted = torch.jit.freeze(torch.jit.script(model),preserved_attrs=['predict'])
+	extra = {
+		'vocab':'\n'.join(sorted(vocab,key=vocab.get)),
+		'config':json.dumps({'model':checkpoint['args'].model,'maxlen':getattr(checkpoint['args'],'maxlen',128)}),
+	}
+	torch.jit.save(scripted,args.out,_extra_files=extra)
+	print('saved {0}'.format(args.out))
+	if(args.data is None):
+		return
+
+	start = time.time()
+	jit = JitModel(args.out)
+	jit_load = time.time()-start
+
+	import pandas as pd
+	tweets = pd.read_csv(args.data,sep='\t')['tweet'].fillna('').astype(str).tolist()
+	def eager(batch):
+		with torch.no_grad():
+			return model.linear.logits(model.encode(*jit.tokenize(batch)))
+
+	diff = 0
+	for i in range(0,len(tweets),128):
+		batch = tweets[i:i+128]
+		diff = max([diff]+[(a-b).abs().max().item() for a,b in zip(eager(batch),jit.logits(batch))])
+	print('{0} tweets, max |logit difference| {1:.2e}'.format(len(tweets),diff))
+
+	requests = tweets[:args.requests]
+	print('{0:<10}{1:>12}{2:>20}'.format('','load ms','ms per 1 tweet'))
+	print('{0:<10}{1:>12.0f}{2:>20.2f}'.format('eager',eager_load*1000,latency(eager,requests)))
+	print('{0:<10}{1:>12.0f}{2:>20.2f}'.format('jit',jit_load*1000,latency(jit.logits,requests)))
+
+if(__name__ == '__main__'):
+	main()
@@ -0,0 +1,116 @@
+"""
+runs a model written by export.py, needs torch only, none of the training code
+the tweets are tokenized like data/dataloader.py: split on spaces, <unk> for the words out of the vocab,
+at most maxlen tokens and at least one
+
+python jit_model.py ./saved_models/{save dir}/model.pt --data ./data/testset-levela.tsv --out pred
+	writes pred.taska, pred.taskb and pred.taskc like test.py --task all: one pass over --data,
+	taskb and taskc only for the ids of ./data/testset-levelb.tsv and testset-levelc.tsv
+"""
+import argparse
+import csv
+import json
+import os
+import time
+
+import torch
+import torch.nn.functional as F
+
+PAD,UNK = 0,1
+TASKS = ['taska','taskb','taskc']
+LABELS = [['NOT','OFF'],['UNT','TIN'],['OTH','GRP','IND']]
+
+def tokenize(tweets,vocab,maxlen):
+	#padded token ids and lengths of a batch of tweets, in their order
+	ids = [[vocab.get(word,UNK) for word in tweet.strip().split()][:maxlen] or [UNK] for tweet in tweets]
+	length = torch.tensor([len(x) for x in ids],dtype=torch.long)
+	querys = torch.full((len(ids),int(length.max())),PAD,dtype=torch.long)
+	for i,x in enumerate(ids):
+		querys[i,:len(x)] = torch.tensor(x,dtype=torch.long)
+	return querys,length
+
+def to_results(probs):
+	#probs: the (tweets, classes) probabilities of the three heads, to the label and probabilities of every tweet
+	out = []
+	for i in range(len(probs[0])):
+		out.append({task:{'label':LABELS[k][int(probs[k][i].argmax())],
+						  'probs':dict(zip(LABELS[k],[float(p) for p in probs[k][i]]))} for k,task in enumerate(TASKS)})
+	return out
+
+def level_file(task):
+	return './data/testset-level{0}.tsv'.format(task[-1])
+
+def task_ids(task,ids,data):
+	"""
+	the ids of the tweets of data written for a task, in the order of its test set
+	the test sets of level b and c are subsets of level a: only their own ids are written, like a run on their own file
+	"""
+	if(task=='taska'):
+		return ids
+	if(not os.path.exists(level_file(task))):
+		print('no {0}, {1} is written for every tweet of {2}'.format(level_file(task),task,data))
+		return ids
+	#the ids of data as they are (int or str), found by their text
+	known = {str(i):i for i in ids}
+	with open(level_file(task),newline='') as f:
+		level_ids = [row['id'] for row in csv.DictReader(f,delimiter='\t')]
+	missing = [i for i in level_ids if i not in known]
+	if(len(missing)>0):
+		raise ValueError('{0} ids of {1} are not in {2}'.format(len(missing),level_file(task),data))
+	return [known[i] for i in level_ids]
+
+class JitModel(object):
+	def __init__(self,path,device='cpu'):
+		#export.py saves the vocab (one word per line, in id order) and the config in the file
+		extra = {'vocab':'','config':''}
+		self.model = torch.jit.load(path,map_location=device,_extra_files=extra)
+		self.model.eval()
+		self.vocab = {word:i for i,word in enumerate(extra['vocab'].decode('utf-8').split('\n'))}
+		self.config = json.loads(extra['config'].decode('utf-8'))
+		self.maxlen = self.config['maxlen']
+		self.device = torch.device(device)
+
+	def tokenize(self,tweets):
+		return tokenize(tweets,self.vocab,self.maxlen)
+
+	def logits(self,tweets):
+		querys,length = self.tokenize(tweets)
+		with torch.no_grad():
+			return self.model.predict(querys.to(self.device),length.to(self.device))
+
+	def predict(self,tweets):
+		#for every tweet, the label of the three subtasks and the probabilities of their classes
+		return to_results([F.softmax(l,dim=-1).cpu().numpy() for l in self.logits(tweets)])
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('model')
+	parser.add_argument('--data', required=True, type=str, help='tsv with id and tweet')
+	parser.add_argument('--out', required=True, type=str, help='prefix of the {out}.taska/b/c files')
+	parser.add_argument('--batch_size', default=128, type=int)
+	args = parser.parse_args()
+
+	start = time.time()
+	model = JitModel(args.model)
+	print('loaded in {0:.0f} ms'.format((time.time()-start)*1000))
+
+	with open(args.data,newline='') as f:
+		rows = [(row['id'],row['tweet'] or '') for row in csv.DictReader(f,delimiter='\t')]
+
+	start = time.time()
+	preds = [[],[],[]]
+	for i in range(0,len(rows),args.batch_size):
+		logits = model.logits([tweet for _,tweet in rows[i:i+args.batch_size]])
+		for k in range(3):
+			preds[k].extend(logits[k].argmax(dim=-1).tolist())
+	print('{0} tweets, {1:.0f} tweets/s'.format(len(rows),len(rows)/(time.time()-start)))
+
+	row = {i:j for j,(i,_) in enumerate(rows)}
+	for k,task in enumerate(TASKS):
+		with open('{0}.{1}'.format(args.out,task),'w') as f:
+			f.write("Id,Category\n")
+			for i in task_ids(task,[i for i,_ in rows],args.data):
+				f.write('{0},{1}\n'.format(i,LABELS[k][preds[k][row[i]]]))
+
+if(__name__ == '__main__'):
+	main()
@@ -0,0 +1,92 @@
+"""
+load test of serve.py: --concurrency clients on keep-alive connections send --requests one tweet requests in total
+reports the requests per second, the p50/p90/p99 latency and the mean batch size of the server (GET /stats)
+the tweets come from the tsv of --data, in turn, or are made up
+
+python serve.py --model ./saved_models/{save dir}/model.pt &
+python load_test.py --url http://127.0.0.1:8000 --data ./data/testset-levela.tsv --concurrency 32 --requests 2000
+"""
+import argparse
+import asyncio
+import csv
+import json
+import random
+import time
+from urllib.parse import urlparse
+
+async def request(reader,writer,host,method,path,body=None):
+	data = b'' if body is None else json.dumps(body).encode('utf-8')
+	writer.write('{0} {1} HTTP/1.1\r\nHost: {2}\r\nContent-Type: application/json\r\nContent-Length: {3}\r\n\r\n'.format(
+		method,path,host,len(data)).encode('latin-1')+data)
+	await writer.drain()
+	status = int((await reader.readline()).split()[1])
+	length = 0
+	while(True):
+		line = await reader.readline()
+		if(line in (b'\r\n',b'\n',b'')):
+			break
+		key,_,value = line.decode('latin-1').partition(':')
+		if(key.strip().lower() == 'content-length'):
+			length = int(value)
+	return status,json.loads((await reader.readexactly(length)).decode('utf-8'))
+
+async def client(url,tweets,counter,latencies,errors):
+	reader,writer = await asyncio.open_connection(url.hostname,url.port)
+	try:
+		while(counter[0] > 0):
+			counter[0] -= 1
+			tweet = tweets[counter[0]%len(tweets)]
+			start = time.perf_counter()
+			status,_ = await request(reader,writer,url.netloc,'POST','/predict',{'tweet':tweet})
+			latencies.append(time.perf_counter()-start)
+			if(status != 200):
+				errors.append(status)
+	finally:
+		writer.close()
+
+async def stats(url):
+	reader,writer = await asyncio.open_connection(url.hostname,url.port)
+	try:
+		return (await request(reader,writer,url.netloc,'GET','/stats'))[1]
+	finally:
+		writer.close()
+
+def percentile(values,p):
+	values = sorted(values)
+	return values[min(len(values)-1,int(round(p/100*(len(values)-1))))]
+
+async def run(args,tweets):
+	url = urlparse(args.url)
+	before = await stats(url)
+	counter,latencies,errors = [args.requests],[],[]
+	start = time.perf_counter()
+	await asyncio.gather(*[client(url,tweets,counter,latencies,errors) for _ in range(args.concurrency)])
+	elapsed = time.perf_counter()-start
+	after = await stats(url)
+
+	batches = after['batches']-before['batches']
+	print('{0} requests, {1} concurrent, {2} errors'.format(len(latencies),args.concurrency,len(errors)))
+	print('qps {0:.1f}'.format(len(latencies)/elapsed))
+	print('latency ms p50 {0:.1f} p90 {1:.1f} p99 {2:.1f}'.format(*[percentile(latencies,p)*1000 for p in [50,90,99]]))
+	print('server: {0} batches, mean batch size {1:.1f} (max {2}, wait {3} ms)'.format(
+		batches,(after['requests']-before['requests'])/max(batches,1),after['max_batch_size'],after['max_wait_ms']))
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--url', default='http://127.0.0.1:8000', type=str)
+	parser.add_argument('--data', default=None, type=str, help='tsv with a tweet column')
+	parser.add_argument('--concurrency', default=32, type=int)
+	parser.add_argument('--requests', default=2000, type=int)
+	args = parser.parse_args()
+
+	if(args.data is not None):
+		with open(args.data,newline='') as f:
+			tweets = [row['tweet'] or '' for row in csv.DictReader(f,delimiter='\t')]
+	else:
+		random.seed(0)
+		words = ['@USER','you','are','the','best','worst','idiot','love','this','so','URL','#MAGA','what','a','joke']
+		tweets = [' '.join(random.choice(words) for _ in range(random.randint(3,40))) for _ in range(1000)]
+	asyncio.run(run(args,tweets))
+
+if(__name__ == '__main__'):
+	main()
@@ -2,6 +2,38 @@ import torch
 import torch.nn as nn
 import math
 import torch.nn.functional as F
+from typing import List
+
+#the fused kernel with a scale argument, torch >= 2.1
+FUSED = hasattr(F,'scaled_dot_product_attention') and tuple(int(v) for v in torch.__version__.split('.')[:2]) >= (2,1)
+
+def padding_bias(masks:List[torch.Tensor],dtype:torch.dtype):
+    """
+    added to the scores: 0 on the pairs to keep, -inf on the pairs where both tokens are padding, masks are true on the padding
+    the larger of a -inf row bias and a -inf column bias, no batch*length1*length2 boolean mask to build,
+    and the add passes the gradient through where masked_fill would mask it again in the backward
+    a row is never fully masked as every tweet has a first real token
+    """
+    rows = torch.zeros(masks[0].shape,dtype=dtype,device=masks[0].device).masked_fill_(masks[0].to(torch.bool),float('-inf'))
+    cols = torch.zeros(masks[1].shape,dtype=dtype,device=masks[1].device).masked_fill_(masks[1].to(torch.bool),float('-inf'))
+    return torch.maximum(rows.unsqueeze(2),cols.unsqueeze(1))		 #batch*length1*length2
+
+def mask_padding(attn_weight,masks:List[torch.Tensor]):
+    return attn_weight + padding_bias(masks,attn_weight.dtype)
+
+def attend(query,key,value,masks:List[torch.Tensor],scale:float,fused:bool):
+    """
+    softmax(query key^T * scale) value over the keys, the pairs of padding of masks (query side, key side) dropped
+    query: (...,length1,dim), key and value: (...,length2,dim), the batch first, the other leading dims (heads) broadcast
+    fused: FUSED, a constant of the calling module so that torch.jit does not compile the other branch
+    """
+    bias = padding_bias(masks,query.dtype)
+    if(query.dim() == 4):
+        bias = bias.unsqueeze(1)
+    if(fused):
+        return F.scaled_dot_product_attention(query,key,value,attn_mask=bias,scale=scale)
+    attn_weight = query.matmul(key.transpose(-1,-2))*scale + bias
+    return F.softmax(attn_weight,dim=-1).matmul(value)
 
 class Bahdanau(nn.Module):
     def __init__(self,in_dim,out_dim):
@@ -12,19 +44,17 @@ class Bahdanau(nn.Module):
         self.linear1 = nn.Linear(self.in_dim,self.out_dim)
         self.linear2 = nn.Linear(self.out_dim,1)
 
-    def forward(self,querys,lengths,masks):
-        shapes = [querys[0].shape,querys[1].shape]
+    def forward(self,querys:List[torch.Tensor],lengths:List[torch.Tensor],masks:List[torch.Tensor]):
+        #linear1 of the pair [q0_i,q1_j] is W0 q0_i + W1 q1_j + b
+        #each side is projected once and the batch*length1*length2*dim sum is a broadcast
+        dim0 = querys[0].shape[-1]
+        proj0 = F.linear(querys[0],self.linear1.weight[:,:dim0],self.linear1.bias)		 #batch*length1*dim
+        proj1 = F.linear(querys[1],self.linear1.weight[:,dim0:])		 #batch*length2*dim
 
-        query_expand = torch.cat([
-            querys[0].repeat(1,shapes[1][1],1),
-            querys[1].repeat(1,1,shapes[0][1]).view(shapes[1][0],shapes[1][1]*shapes[0][1],shapes[1][2])
-        ],dim=-1)
-
-        attn_weight = self.linear2( self.linear1( query_expand ).tanh() ).view(-1,shapes[0][1],shapes[1][1])
-        weight_mask = masks[0].float().unsqueeze(2).bmm( masks[1].float().unsqueeze(1) )		 #batch*length1*length2
+        attn_weight = self.linear2( (proj0.unsqueeze(2)+proj1.unsqueeze(1)).tanh() ).squeeze(-1)		 #batch*length1*length2
 
         #perform mask for the padding data
-        attn_weight += -1e8*weight_mask.float()
+        attn_weight = mask_padding(attn_weight,masks)
         attn_weights = [F.softmax(attn_weight,dim=-2), F.softmax(attn_weight,dim=-1)]
         
         return [
@@ -32,13 +62,26 @@ class Bahdanau(nn.Module):
             attn_weights[0].transpose(1,2).bmm(querys[0])
         ]
 
+    def self_attend(self,query,length,mask):
+        #forward([query,query],...)[0] without the second direction, both halves of linear1 in one matmul
+        dim = self.linear1.weight.shape[0]
+        proj = F.linear(query,self.linear1.weight.view(dim,2,-1).transpose(0,1).reshape(2*dim,-1))
+        proj0,proj1 = proj[...,:dim]+self.linear1.bias,proj[...,dim:]
+
+        attn_weight = self.linear2( (proj0.unsqueeze(2)+proj1.unsqueeze(1)).tanh() ).squeeze(-1)		 #batch*length*length
+        attn_weight = mask_padding(attn_weight,[mask,mask])
+        return F.softmax(attn_weight,dim=-1).bmm(query)
+
 
 class Luong(nn.Module):
+    __constants__ = ['fused']
+
     def __init__(self,in_dim,out_dim):
         super(Luong,self).__init__()
         self.hidden_dim = in_dim
+        self.fused = FUSED
 
-    def forward(self,querys,lengths,masks):
+    def forward(self,querys:List[torch.Tensor],lengths:List[torch.Tensor],masks:List[torch.Tensor]):
         lengths = [lengths[0].float(),lengths[1].float()]
 
         query_normals = []
@@ -47,10 +90,9 @@ class Luong(nn.Module):
 
         #get the attention
         attn_weight = query_normals[0].bmm( query_normals[1].transpose(1,2) )		 #batch*length1*length2
-        weight_mask = masks[0].float().unsqueeze(2).bmm( masks[1].float().unsqueeze(1) )		 #batch*length1*length2
 
         #perform mask for the padding data
-        attn_weight += -1e8*weight_mask.float()
+        attn_weight = mask_padding(attn_weight,masks)
         attn_weights = [F.softmax(attn_weight,dim=-2), F.softmax(attn_weight, dim=-1)]
         
         return [
@@ -58,6 +100,51 @@ class Luong(nn.Module):
             attn_weights[0].transpose(1,2).bmm(query_normals[0])
         ]
 
+    def self_attend(self,query,length,mask):
+        #forward([query,query],...)[0] without the second direction
+        query_normal = query.div( math.sqrt( float(self.hidden_dim) ) )
+        return attend(query_normal,query_normal,query_normal,[mask,mask],1.0,self.fused)
+
+
+class MultiHead(nn.Module):
+    """
+    scaled dot product attention of heads query/key/value projections, out projection of the heads
+    forward keeps the two direction interface of Luong and Bahdanau
+    """
+    __constants__ = ['fused']
+
+    def __init__(self,in_dim,out_dim,heads=4):
+        super(MultiHead,self).__init__()
+        if(in_dim % heads != 0):
+            raise ValueError('the dim {0} is not divisible by {1} heads'.format(in_dim,heads))
+        self.in_dim = in_dim
+        self.heads = heads
+        self.head_dim = in_dim // heads
+        self.fused = FUSED
+
+        self.query = nn.Linear(in_dim,in_dim)
+        self.key = nn.Linear(in_dim,in_dim)
+        self.value = nn.Linear(in_dim,in_dim)
+        self.out = nn.Linear(in_dim,in_dim)
+
+    def split(self,x):
+        #batch*length*dim -> batch*heads*length*head_dim
+        return x.view(x.shape[0],x.shape[1],self.heads,self.head_dim).transpose(1,2)
+
+    def attend(self,query,key,masks:List[torch.Tensor]):
+        out = attend(self.split(self.query(query)),self.split(self.key(key)),self.split(self.value(key)),
+                     masks,1.0/math.sqrt(self.head_dim),self.fused)
+        return self.out( out.transpose(1,2).reshape(query.shape[0],query.shape[1],self.in_dim) )
+
+    def forward(self,querys:List[torch.Tensor],lengths:List[torch.Tensor],masks:List[torch.Tensor]):
+        return [
+            self.attend(querys[0],querys[1],masks),
+            self.attend(querys[1],querys[0],[masks[1],masks[0]])
+        ]
+
+    def self_attend(self,query,length,mask):
+        return self.attend(query,query,[mask,mask])
+
 def main():
     model = Bahdanau(5)
 
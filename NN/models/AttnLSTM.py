@@ -1,9 +1,10 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as f
+from typing import List
 
-from .base import Base
-from .Attention import Luong,Bahdanau
+from .base import Base,last_state,cast_autocast
+from .Attention import Luong,Bahdanau,MultiHead
 
 import math
 
@@ -12,14 +13,14 @@ class attnlstm(Base):
 		if(not hasattr(args,'lin_dim1')):
 			args.lin_dim1 = args.hidden_dim * 2
 			args.lin_dim2 = args.hidden_dim
-			
+
 		super(attnlstm,self).__init__(args,vocab)
 
 		self.embeds_dim = args.embeds_dim
 		self.hidden_dim = args.hidden_dim
 		self.num_layer = args.num_layer
 		self.batch_first = args.batch_first
-		
+
 		self.rnn = nn.GRU(self.embeds_dim, self.hidden_dim, batch_first=self.batch_first , bidirectional=True, num_layers=self.num_layer)
 
 		if(args.attention == 'luong'):
@@ -27,62 +28,41 @@ class attnlstm(Base):
 
 		elif(args.attention == 'bahdanau'):
 			self.attention = Bahdanau(2*args.hidden_dim,args.hidden_dim)
+		elif(args.attention == 'multihead'):
+			self.attention = MultiHead(args.embeds_dim,args.embeds_dim,getattr(args,'heads',4))
 		else:
 			raise ValueError('no this attention')
 
-	def forward(self,querys,length,labels=None):
-		def pack(seq,seq_length):
-			sorted_seq_lengths, indices = torch.sort(seq_length, descending=True)
-			_, desorted_indices = torch.sort(indices, descending=False)
-			if self.batch_first:
-				seq = seq[indices]
-			else:
-				seq = seq[:, indices]
-			packed_inputs = nn.utils.rnn.pack_padded_sequence(seq,
-															sorted_seq_lengths.cpu().numpy(),
-															batch_first=self.batch_first)
-			return packed_inputs,desorted_indices
+	def encode(self,querys,length,presorted:bool=False):
+		"""
+		the feature of every tweet for the linear heads
+		presorted: the batch is already sorted by length, longest first (data.dataloader.collate_fn)
+		otherwise pack_padded_sequence sorts it and the output comes back in the order of the batch
+		"""
+		emb = self.word_emb(querys)
+		if(not torch.jit.is_scripting()):
+			emb = cast_autocast(emb)
+		mask = querys.eq(0)
+		#self attention, only the direction that is used
+		att_emb = self.attention.self_attend(emb,length,mask)
 
-		def unpack(res, state,desorted_indices):
-			padded_res,_ = nn.utils.rnn.pad_packed_sequence(res, batch_first=self.batch_first)
-			state = [ _ for _ in state]
+		packed_inputs = nn.utils.rnn.pack_padded_sequence(att_emb,length.cpu(),batch_first=self.batch_first,enforce_sorted=presorted)
+		res,_ = self.run_rnn(packed_inputs)
+		output,_ = nn.utils.rnn.pad_packed_sequence(res,batch_first=self.batch_first)
+		if( self.batch_first == False ):
+			output = output.transpose(0,1)
 
-			for i in range(len(state)):
-				state[i] = state[i][:,desorted_indices]
-			
-			if(self.batch_first):
-				desorted_res = padded_res[desorted_indices]
-			else:
-				desorted_res = padded_res[:, desorted_indices]
+		return last_state(output,length,self.hidden_dim)
 
-			return desorted_res,state
-		def feat_extract(output,lengths,mask):
-			"""
-			here we check for several output variant
-			1.largest
-			2.last
-			3.mean
-			"""
-			if( self.batch_first == False ):
-				output = output.transpose(0,1) 
-			result = []
-			for i in range(length.shape[0]):
-				result.append( torch.cat([ output[i][ length[i]-1 ][:self.hidden_dim],output[i][0][self.hidden_dim:]], dim=-1) )
-			
+	@torch.jit.export
+	def predict(self,querys,length) -> List[torch.Tensor]:
+		#the logits of the three heads, the inference path that export.py serializes
+		return self.linear.logits(self.encode(querys,length))
 
-			return torch.stack( result , dim=0 ) 
-		
-		emb = self.word_emb(querys)
-		query_embs = [emb,emb]
-		mask = [querys.eq(0),querys.eq(0)]
-		lengths = [length,length]
-		att_emb = self.attention(query_embs,lengths,mask)[0]
+	@torch.jit.unused
+	def forward(self,querys,length,labels=None,teacher_logits=None,presorted=False):
+		query_result = self.encode(querys,length,presorted)
 
-		packed_inputs,desorted_indices = pack(att_emb,length)
-		res, state = self.rnn(packed_inputs)
-		query_res,_ = unpack(res, state,desorted_indices)
-		query_result = feat_extract(query_res,length.int(),mask)
-		
-		out = self.linear(query_result,labels=labels)
+		out = self.linear(query_result,labels=labels,teacher_logits=teacher_logits)
 
 		return out
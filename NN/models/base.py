@@ -1,24 +1,84 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from sklearn.metrics import matthews_corrcoef, f1_score
-from sklearn import metrics
 import numpy as np
+from typing import List,Tuple
+from torch.nn.utils.rnn import PackedSequence
 from .Focal_loss import FocalLoss
+from data.embedding import EmbeddingStore
+try:
+	from torch.func import functional_call
+except ImportError:
+	#torch < 2.0
+	from torch.nn.utils.stateless import functional_call
 
-def count(pred,label):
+def count(pred,label,n_class):
+	#confusion matrix of the batch (rows are the labels), it stays on the device of pred
+	#train.py sums it over the epoch and reads it once at the end, no sync per step
 	total = {}
 	
-	total['num'] = f1_score(y_true=label.cpu().view(-1), y_pred=pred.view(-1).cpu(),average='macro')
-	total['correct'] = (pred == label).sum().item()
+	total['conf'] = torch.bincount(label.view(-1)*n_class+pred.view(-1),minlength=n_class*n_class).view(n_class,n_class)
+	total['correct'] = total['conf'].trace()
 	
 	return total
 
+def confusion_f1(conf):
+	#macro f1 of a confusion matrix, over the classes in the labels or the predictions like sklearn
+	conf = conf.double()
+	tp = conf.diag()
+	support = conf.sum(0)+conf.sum(1)
+	present = support>0
+	return (2*tp[present]/support[present]).mean().item()
+
+@torch.jit.unused
+def cast_autocast(x):
+	#x in the dtype autocast runs its device in, unchanged outside of autocast
+	device = x.device.type
+	if(hasattr(torch,'get_autocast_dtype')):
+		enabled,dtype = torch.is_autocast_enabled(device),torch.get_autocast_dtype(device)
+	elif(device=='cpu'):
+		enabled,dtype = torch.is_autocast_cpu_enabled(),torch.get_autocast_cpu_dtype()
+	else:
+		enabled,dtype = torch.is_autocast_enabled(),torch.get_autocast_gpu_dtype()
+	return x.to(dtype) if enabled else x
+
+@torch.jit.unused
+def run_rnn(rnn,inputs):
+	"""
+	autocast leaves nn.GRU/nn.LSTM in fp32, under autocast the rnn runs on low precision copies
+	of its weights instead, the gradients still flow back to the fp32 weights
+	inputs: a tensor or a PackedSequence
+	"""
+	packed = isinstance(inputs,PackedSequence)
+	data = cast_autocast(inputs.data if packed else inputs)
+	if(data.dtype==torch.float32):
+		return rnn(inputs)
+	inputs = inputs._replace(data=data) if packed else data
+	weights = {name:w.to(data.dtype) for name,w in rnn.named_parameters()}
+	return functional_call(rnn,weights,(inputs,))
+
+def last_state(output,lengths,hidden_dim:int):
+	#output is (batch,seq,2*hidden_dim) of a bidirectional rnn, batch first
+	#the forward half at the last real token and the backward half at the first one
+	#gathered for the whole batch at once
+	index = (lengths.long()-1).to(output.device).view(-1,1,1).expand(-1,1,hidden_dim)
+	forward = output[:,:,:hidden_dim].gather(1,index).squeeze(1)
+	return torch.cat([forward,output[:,0,hidden_dim:]],dim=-1)
+
+def soft_target_loss(logits,teacher_logits,temperature):
+	#KL(teacher || student) of the temperature softened distributions, per sample
+	#scaled by T^2 so the gradients keep the size of the hard loss
+	log_p = F.log_softmax(logits/temperature,dim=-1)
+	q = F.softmax(teacher_logits/temperature,dim=-1)
+	return (q*(torch.log(q+1e-12)-log_p)).sum(dim=-1)*temperature*temperature
+
 class Linear(nn.Module):
-	def __init__(self,lin_dim1,lin_dim2):
+	def __init__(self,lin_dim1,lin_dim2,temperature=2.0,distill_alpha=0.5):
 		super(Linear,self).__init__()
 		self.lin_dim1 = lin_dim1
 		self.lin_dim2 = lin_dim2
+		self.temperature = temperature
+		self.distill_alpha = distill_alpha
 
 		self.linear1 = nn.Linear(self.lin_dim1,self.lin_dim2)
 		
@@ -29,34 +89,53 @@ class Linear(nn.Module):
 
 		self.criterion = nn.CrossEntropyLoss(reduction='none')
 		#self.criterion = nn.CrossEntropyLoss()
-	def forward(self,x,labels=None):
+	def logits(self,x) -> List[torch.Tensor]:
+		#the three heads, the only part of the linear that torch.jit exports
 		out = self.linear1(x)
 		out	= self.dropout(out)
 
 		out = [self.linear2_1(F.relu(out)),self.linear2_2(F.relu(out)),self.linear2_3(F.relu(out))]
+		#the losses and the softmax of the logits in fp32 under autocast
+		return [o.float() for o in out]
+
+	@torch.jit.unused
+	def forward(self,x,labels=None,teacher_logits=None):
+		out = self.logits(x)
 		preds = [out[0].topk(1)[1].view(-1),out[1].topk(1)[1].view(-1),out[2].topk(1)[1].view(-1)]
 		if(labels is None):
 			#return predict output
 			return preds,out
 		else:
 			#return loss and acc
-			total = {'loss':{},'correct':{},'num':{}}
+			total = {'loss':{},'correct':{},'conf':{}}
 			total_loss = 0
 			loss = self.criterion( out[0].view(-1, 2), labels[:,0].view(-1) ).mean()
-			total['loss']['a'] = loss.cpu().detach().item()
+			total['loss']['a'] = loss.detach()
 			#total_loss += loss
 
 			loss = (self.criterion( out[1].view(-1, 2), labels[:,1].view(-1) )* (labels[:,0].float().view(-1)) ).mean()
-			total['loss']['b'] = loss.cpu().detach().item()
+			total['loss']['b'] = loss.detach()
 			#total_loss += loss
 			
 			loss = (self.criterion( out[2].view(-1, 3), labels[:,2].view(-1) )* (labels[:,1].float().view(-1)) ).mean()
-			total['loss']['c'] = loss.cpu().detach().item()
+			total['loss']['c'] = loss.detach()
 			total_loss += loss
+
+			if(teacher_logits is not None):
+				#soft targets for the three heads, teacher_logits is (batch,2+2+3)
+				#b and c are masked by the gold labels like the hard losses
+				teacher_logits = teacher_logits.split([2,2,3],dim=-1)
+				masks = [torch.ones_like(labels[:,0]).float(),labels[:,0].float(),labels[:,1].float()]
+				soft_loss = 0
+				for i,name in enumerate(['a','b','c']):
+					loss = (soft_target_loss(out[i],teacher_logits[i],self.temperature)*masks[i]).mean()
+					total['loss']['soft_'+name] = loss.detach()
+					soft_loss += loss
+				total_loss = self.distill_alpha*soft_loss + (1-self.distill_alpha)*total_loss
 			
 			for i,pred in enumerate(preds):
-				temp = count(pred,labels[:,i])
-				total['num'][i] = temp['num']
+				temp = count(pred,labels[:,i],out[i].shape[-1])
+				total['conf'][i] = temp['conf']
 				total['correct'][i] = temp['correct']
 			
 			return total_loss,total
@@ -65,18 +144,32 @@ class Base(nn.Module):
 	def __init__(self,args,vocab):
 		super(Base, self).__init__()
 		self.args = args
-		if(args.embedding == True):
-			args.word_num = 60001
-			args.embeds_dim = 300
-		else:
-			args.word_num = len(vocab)
+		args.word_num = len(vocab)
+		store = None
+		if(args.embedding == True and getattr(args,'embedding_path',None) is not None):
+			store = EmbeddingStore(args.embedding_path)
+			args.embeds_dim = store.dim
 		self.word_emb =nn.Embedding(args.word_num,args.embeds_dim,padding_idx=0)
 
-		if(args.embedding == True):
-			self.word_emb.load_state_dict({'weight': torch.tensor( vocab.vectors[:args.word_num]) } )
+		if(store is not None):
+			#only the rows of the task vocab are read from the store
+			words = sorted(vocab,key=vocab.get)
+			weight = torch.from_numpy(store.vectors(words))
+			weight[0] = 0
+			self.word_emb.load_state_dict({'weight': weight } )
 			self.word_emb.weight.requires_grad = True
-			print("here",self.word_emb.weight.requires_grad)
 
-		self.linear = Linear(args.lin_dim1,args.lin_dim2)
+		self.linear = Linear(args.lin_dim1,args.lin_dim2,
+							getattr(args,'temperature',2.0),getattr(args,'distill_alpha',0.5))
+
+	def run_rnn(self,inputs:PackedSequence) -> Tuple[PackedSequence,torch.Tensor]:
+		#self.rnn of the model, under autocast through run_rnn, torch.jit calls it directly
+		if(torch.jit.is_scripting()):
+			return self.rnn(inputs)
+		return self.autocast_rnn(inputs)
+
+	@torch.jit.unused
+	def autocast_rnn(self,inputs:PackedSequence) -> Tuple[PackedSequence,torch.Tensor]:
+		return run_rnn(self.rnn,inputs)
 
 		
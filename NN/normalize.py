@@ -0,0 +1,88 @@
+"""
+tweet normalization of preprocess.py, remove_emoji(parse(tweet.lower())), for many tweets at once
+
+a chunk of tweets is joined by SEP and the lower, the punctuation and mispell_dict
+replaces and the @user replaces run once over the whole chunk, in C. no key contains
+SEP and no step removes or adds one, so splitting the result on SEP gives the same
+strings as the functions of preprocess.py tweet by tweet, see benchmark_normalize.py
+"""
+from multiprocessing import Pool
+
+mispell_dict = {'didnt':'did not',
+                'doesnt':'does not',
+                'isnt':'is not',
+                'shouldnt':'should not' ,
+                'wasnt': 'was not' ,
+                'hasnt': 'has not' ,
+                '‘i': 'i' ,
+                'theatre': 'theater' ,
+                'cancelled': 'canceled' ,
+                'organisation': 'organization' ,
+                'labour': 'labor' ,
+                'favourite': 'favorite' ,
+                'travelling': 'traveling' ,
+                'washingtons': 'washington' ,
+                'marylands': 'maryland' ,
+                'chinas': 'china' ,
+                'russias': 'russia' ,
+                '‘the': 'the' ,
+                'irans': 'iran' ,
+                'dulles': 'dulle',
+                'labour': 'labor',
+                'metoo':'me too'
+                }
+
+SEP = '\x00'
+DELETE = "/-'"
+TO_SPACE = '?!.,"#$%()*+:;<=>[\\]^_`{|}~' + '“”’‘'
+
+
+def parse(text):
+    # str.replace scans the whole chunk in C, faster than a translate table or a
+    # regex once the text is not ascii. the misspellings are chained
+    # in the order of mispell_dict like preprocess.py: a single regex pass differs
+    # when the keys overlap, e.g. 'didntheatre'
+    for punct in DELETE:
+        text = text.replace(punct, '')
+    for punct in TO_SPACE:
+        text = text.replace(punct, ' ')
+    for key, data in mispell_dict.items():
+        text = text.replace(key, data)
+    return text
+
+
+def remove_emoji(text):
+    # ' '.join(tweet.split()) of every tweet, with a space on both sides so that
+    # ' @user @user ' only matches whole words
+    text = SEP.join(' ' + ' '.join(tweet.split()) + ' ' for tweet in text.split(SEP))
+    # parse leaves no word starting with '#' and no "'" for "'ve" and "'m"
+    while ' @user @user ' in text:
+        text = text.replace(' @user @user ', ' @user ')
+    text = text.replace('url', '')
+    text = text.replace('@user', 'user')
+    return SEP.join(tweet[1:-1] for tweet in text.split(SEP))
+
+
+def normalize(tweet):
+    return remove_emoji(parse(str(tweet).lower()))
+
+
+def normalize_chunk(tweets):
+    tweets = [str(tweet) for tweet in tweets]
+    if len(tweets) == 0:
+        return []
+    text = SEP.join(tweets)
+    if text.count(SEP) != len(tweets) - 1:
+        # SEP inside a tweet, one at a time
+        return [normalize(tweet) for tweet in tweets]
+    return normalize(text).split(SEP)
+
+
+def normalize_all(tweets, num_workers=1, chunk_size=10000):
+    """normalize a list of tweets, in chunks of chunk_size across num_workers processes"""
+    tweets = list(tweets)
+    chunks = [tweets[i:i + chunk_size] for i in range(0, len(tweets), chunk_size)]
+    if num_workers <= 1 or len(chunks) <= 1:
+        return [tweet for chunk in chunks for tweet in normalize_chunk(chunk)]
+    with Pool(num_workers) as pool:
+        return [tweet for chunk in pool.imap(normalize_chunk, chunks) for tweet in chunk]
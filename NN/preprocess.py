@@ -2,12 +2,16 @@ import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 import re
+import os
 import sys
 import operator
 from tqdm import tqdm
 import operator
+import argparse
+from collections import Counter
+from multiprocessing import Pool
 
-data = pd.read_csv(sys.argv[1], sep='\t')
+from normalize import mispell_dict, normalize_chunk
 
 def remove_emoji(sen):
     sen = str(sen).lower()
@@ -56,30 +60,6 @@ def remove_emoji(sen):
 
     return sen
 
-mispell_dict = {'didnt':'did not',
-                'doesnt':'does not',
-                'isnt':'is not',
-                'shouldnt':'should not' ,
-                'wasnt': 'was not' ,
-                'hasnt': 'has not' ,
-                '‘i': 'i' ,
-                'theatre': 'theater' ,
-                'cancelled': 'canceled' ,
-                'organisation': 'organization' ,
-                'labour': 'labor' ,
-                'favourite': 'favorite' ,
-                'travelling': 'traveling' ,
-                'washingtons': 'washington' ,
-                'marylands': 'maryland' ,
-                'chinas': 'china' ,
-                'russias': 'russia' ,
-                '‘the': 'the' ,
-                'irans': 'iran' ,
-                'dulles': 'dulle',
-                'labour': 'labor',
-                'metoo':'me too'
-                }
-
 def parse(text):
     #build up inverted file
     for punct in "/-'":
@@ -97,19 +77,68 @@ def parse(text):
     for key,data in mispell_dict.items():
         text = text.replace(key,data)
     return text
-data['tweet'] = data['tweet'].apply(lambda x : remove_emoji(parse(x.lower())))
-data.reset_index()
-data.to_csv('./data/train.tsv',sep='\t', index=False)
-
-vocab = {}
-for text in data['tweet'].tolist():
-    for word in text.strip().split():
-        try:
-            vocab[word] += 1
-        except:
-            vocab[word] = 1
-
-vocab = sorted(vocab.items(),key = lambda x: operator.getitem(x,1),reverse=True)
-with open('./data/vocab','w') as f:
-    for key in vocab:
-        f.write("{0}\t{1}\n".format(key[0],key[1]))
\ No newline at end of file
+
+
+def process_chunk(tweets):
+    """normalized tweets of one chunk and the counts of their words, run in the pool"""
+    tweets = normalize_chunk(tweets)
+    return tweets, Counter(' '.join(tweets).split())
+
+
+def write_vocab(counts, file_name, min_freq=1, max_size=None):
+    """
+    the words seen at least min_freq times, at most max_size of them, most frequent first
+    file_name: word and count per line, as read by data.dataloader.load_vocab
+    file_name.bin: the same words in the same order, utf-8 separated by '\n', the fast path of load_vocab
+    """
+    vocab = [(word, count) for word, count in counts.most_common() if count >= min_freq]
+    if max_size is not None:
+        vocab = vocab[:max_size]
+    with open(file_name, 'w') as f:
+        for key in vocab:
+            f.write("{0}\t{1}\n".format(key[0], key[1]))
+    with open(file_name + '.bin', 'wb') as f:
+        f.write('\n'.join(word for word, _ in vocab).encode('utf-8'))
+    return vocab
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data')
+    parser.add_argument('--num_workers', default=1, type=int)
+    parser.add_argument('--chunk_size', default=20000, type=int, help='tweets read at a time')
+    parser.add_argument('--min_freq', default=1, type=int)
+    parser.add_argument('--max_size', default=None, type=int, help='keep the max_size most frequent words')
+    parser.add_argument('--out', default='./data', type=str)
+    args = parser.parse_args()
+
+    # the tsv is read chunk_size rows at a time, num_workers chunks are normalized and
+    # counted in parallel and the counts merged here, only the vocab stays in memory
+    reader = pd.read_csv(args.data, sep='\t', chunksize=args.chunk_size)
+    pool = Pool(args.num_workers) if args.num_workers > 1 else None
+    counts = Counter()
+    header = True
+    try:
+        while True:
+            chunks = [chunk for _, chunk in zip(range(args.num_workers), reader)]
+            if len(chunks) == 0:
+                break
+            tweets = [chunk['tweet'].tolist() for chunk in chunks]
+            results = pool.map(process_chunk, tweets) if pool is not None else map(process_chunk, tweets)
+            for chunk, (tweets, chunk_counts) in zip(chunks, results):
+                # remove_emoji(parse(x.lower())) of every tweet, see normalize.py
+                chunk['tweet'] = tweets
+                chunk.to_csv(os.path.join(args.out, 'train.tsv'), sep='\t', index=False,
+                             header=header, mode='w' if header else 'a')
+                header = False
+                counts.update(chunk_counts)
+    finally:
+        if pool is not None:
+            pool.close()
+
+    vocab = write_vocab(counts, os.path.join(args.out, 'vocab'), args.min_freq, args.max_size)
+    print('{0} words, {1} in the vocab'.format(len(counts), len(vocab)))
+
+
+if __name__ == '__main__':
+    main()
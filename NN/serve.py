@@ -0,0 +1,236 @@
+"""
+http inference server: the model is loaded once, the concurrent requests are gathered into micro batches
+a batch is sent to the model when it holds --max_batch_size tweets or --max_wait_ms after its first tweet,
+and runs on a worker thread so the event loop keeps reading the next requests meanwhile
+the tweets are normalized like the training data: normalize.py (remove_emoji(parse(tweet.lower()))) for the
+nn models, remove_emoji and the WordPiece tokenizer of test_semeval.py for bert
+asyncio and the standard library only, HTTP/1.1 with keep-alive
+
+python serve.py --backend nn --model ./saved_models/{save dir}/model.pt
+python serve.py --backend nn --model ./saved_models/{save dir}/best.pkl --vocab ./data/vocab
+python serve.py --backend bert --model {fine-tuned bert dir} --do_lower_case
+
+POST /predict {"tweet": "..."} or {"tweets": ["...", ...]}
+	-> {"taska": {"label": "OFF", "probs": {"NOT": 0.1, "OFF": 0.9}}, "taskb": ..., "taskc": ...}, a list for "tweets"
+GET /health, GET /stats (requests, batches and mean batch size)
+then python load_test.py --url http://127.0.0.1:8000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from jit_model import to_results
+
+class MicroBatcher(object):
+	def __init__(self,predict_fn,max_batch_size=32,max_wait_ms=5):
+		#predict_fn: a list of tweets to the list of their results, called on the worker thread
+		self.predict_fn = predict_fn
+		self.max_batch_size = max_batch_size
+		self.max_wait = max_wait_ms/1000
+		self.queue = asyncio.Queue()
+		#one thread: torch uses its own threads inside a batch
+		self.executor = ThreadPoolExecutor(max_workers=1)
+		self.requests = 0
+		self.batches = 0
+
+	async def predict(self,tweet):
+		future = asyncio.get_running_loop().create_future()
+		await self.queue.put((tweet,future))
+		return await future
+
+	async def next_batch(self):
+		batch = [await self.queue.get()]
+		deadline = asyncio.get_running_loop().time()+self.max_wait
+		while(len(batch) < self.max_batch_size):
+			timeout = deadline-asyncio.get_running_loop().time()
+			if(timeout <= 0):
+				#what is already waiting still joins the batch
+				while(len(batch) < self.max_batch_size and not self.queue.empty()):
+					batch.append(self.queue.get_nowait())
+				break
+			try:
+				batch.append(await asyncio.wait_for(self.queue.get(),timeout))
+			except asyncio.TimeoutError:
+				break
+		return batch
+
+	async def run(self):
+		loop = asyncio.get_running_loop()
+		while(True):
+			batch = await self.next_batch()
+			#a client that went away does not need its tweet
+			batch = [(tweet,future) for tweet,future in batch if not future.cancelled()]
+			if(len(batch) == 0):
+				continue
+			try:
+				results = await loop.run_in_executor(self.executor,self.predict_fn,[tweet for tweet,_ in batch])
+			except Exception as e:
+				for _,future in batch:
+					if(not future.done()):
+						future.set_exception(e)
+				continue
+			self.requests += len(batch)
+			self.batches += 1
+			for (_,future),result in zip(batch,results):
+				if(not future.done()):
+					future.set_result(result)
+
+	def stats(self):
+		return {
+			'requests':self.requests,
+			'batches':self.batches,
+			'mean_batch_size':self.requests/self.batches if self.batches else 0,
+			'max_batch_size':self.max_batch_size,
+			'max_wait_ms':self.max_wait*1000,
+		}
+
+def nn_predictor(args):
+	import torch
+	import torch.nn.functional as F
+	from normalize import normalize_chunk
+
+	if(args.model.endswith('.pt')):
+		#written by export.py
+		from jit_model import JitModel
+		model = JitModel(args.model)
+		logits = model.logits
+	else:
+		#checkpoint of train.py
+		from data.dataloader import load_vocab
+		from test import load_checkpoint,build_model
+		from jit_model import tokenize
+		checkpoint = load_checkpoint(args.model)
+		vocab = load_vocab(args.vocab)
+		maxlen = getattr(checkpoint['args'],'maxlen',128)
+		model = build_model(checkpoint,vocab)
+		model.eval()
+		def logits(tweets):
+			with torch.no_grad():
+				return model.predict(*tokenize(tweets,vocab,maxlen))
+
+	def predict(tweets):
+		return to_results([F.softmax(l.float(),dim=-1).cpu().numpy() for l in logits(normalize_chunk(tweets))])
+	return predict
+
+def bert_predictor(args):
+	sys.path.insert(0,os.path.abspath(args.bert_code))
+	from predict_semeval import SemevalPredictor
+
+	model_kwargs = {}
+	if(args.fused_qkv):
+		model_kwargs['fused_qkv'] = True
+	model = SemevalPredictor(args.model,args.do_lower_case,args.max_seq_length,args.max_batch_size,
+							 no_cuda=args.no_cuda,int8=args.int8,**model_kwargs)
+	def predict(tweets):
+		return to_results(model.predict(tweets))
+	return predict
+
+class Server(object):
+	def __init__(self,batcher):
+		self.batcher = batcher
+
+	async def predict(self,body):
+		try:
+			request = json.loads(body.decode('utf-8'))
+		except ValueError:
+			return 400,{'error':'the body is not json'}
+		if(isinstance(request,dict) and isinstance(request.get('tweet'),str)):
+			return 200,await self.batcher.predict(request['tweet'])
+		if(isinstance(request,dict) and isinstance(request.get('tweets'),list) and all(isinstance(t,str) for t in request['tweets'])):
+			return 200,list(await asyncio.gather(*[self.batcher.predict(t) for t in request['tweets']]))
+		return 400,{'error':'expected {"tweet": str} or {"tweets": [str, ...]}'}
+
+	async def route(self,method,path,body):
+		routes = {'/predict':'POST','/health':'GET','/stats':'GET'}
+		if(path not in routes):
+			return 404,{'error':'no this path'}
+		if(method != routes[path]):
+			return 405,{'error':'{0} only'.format(routes[path])}
+		if(path == '/health'):
+			return 200,{'status':'ok'}
+		if(path == '/stats'):
+			return 200,self.batcher.stats()
+		try:
+			return await self.predict(body)
+		except Exception as e:
+			return 500,{'error':repr(e)}
+
+	async def handle(self,reader,writer):
+		try:
+			while(True):
+				line = await reader.readline()
+				if(not line):
+					break
+				parts = line.decode('latin-1').split()
+				if(len(parts) != 3):
+					break
+				method,path,version = parts
+				headers = {}
+				while(True):
+					line = await reader.readline()
+					if(line in (b'\r\n',b'\n',b'')):
+						break
+					key,_,value = line.decode('latin-1').partition(':')
+					headers[key.strip().lower()] = value.strip()
+				body = await reader.readexactly(int(headers.get('content-length',0)))
+
+				status,out = await self.route(method,path.split('?')[0],body)
+				data = json.dumps(out).encode('utf-8')
+				keep_alive = headers.get('connection','').lower() != 'close' and version == 'HTTP/1.1'
+				writer.write('HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\nConnection: {3}\r\n\r\n'.format(
+					status,REASONS[status],len(data),'keep-alive' if keep_alive else 'close').encode('latin-1')+data)
+				await writer.drain()
+				if(not keep_alive):
+					break
+		except (asyncio.IncompleteReadError,ConnectionError,ValueError):
+			pass
+		finally:
+			writer.close()
+
+REASONS = {200:'OK',400:'Bad Request',404:'Not Found',405:'Method Not Allowed',500:'Internal Server Error'}
+
+async def serve(args,predict):
+	batcher = MicroBatcher(predict,args.max_batch_size,args.max_wait_ms)
+	worker = asyncio.ensure_future(batcher.run())
+	server = await asyncio.start_server(Server(batcher).handle,args.host,args.port)
+	print('serving on http://{0}:{1}, batches of at most {2} tweets, {3} ms wait'.format(
+		args.host,args.port,args.max_batch_size,args.max_wait_ms),flush=True)
+	try:
+		async with server:
+			await server.serve_forever()
+	finally:
+		worker.cancel()
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--backend', default='nn', choices=['nn','bert'])
+	parser.add_argument('--model', required=True, type=str, help='nn: export.py .pt or train.py checkpoint, bert: fine-tuned model dir')
+	parser.add_argument('--vocab', default='./data/vocab', type=str, help='nn checkpoint of train.py')
+	parser.add_argument('--bert_code', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','pytorch-pretrained-BERT'), type=str)
+	parser.add_argument('--do_lower_case', action='store_true')
+	parser.add_argument('--max_seq_length', default=80, type=int, help='bert: the one of test_semeval.py training')
+	parser.add_argument('--fused_qkv', action='store_true')
+	parser.add_argument('--int8', action='store_true')
+	parser.add_argument('--no_cuda', action='store_true')
+	parser.add_argument('--host', default='127.0.0.1', type=str)
+	parser.add_argument('--port', default=8000, type=int)
+	parser.add_argument('--max_batch_size', default=32, type=int)
+	parser.add_argument('--max_wait_ms', default=5, type=float, help='how long the first tweet of a batch waits for others')
+	args = parser.parse_args()
+
+	start = time.time()
+	predict = nn_predictor(args) if args.backend=='nn' else bert_predictor(args)
+	#the first call builds the kernels, not the first client
+	predict(['warm up'])
+	print('loaded in {0:.1f} s'.format(time.time()-start),flush=True)
+	try:
+		asyncio.run(serve(args,predict))
+	except KeyboardInterrupt:
+		pass
+
+if(__name__ == '__main__'):
+	main()
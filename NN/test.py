@@ -2,22 +2,21 @@ from time import gmtime, strftime
 import os
 import argparse
 
-from data.dataloader import itemDataset,collate_fn
-from gensim.models import KeyedVectors
+from data.dataloader import itemDataset,collate_fn,load_vocab
 import torch
 import torch.optim as optim
 import torch.nn.functional as F
 import torch.nn as nn
 from torch.utils.data import Dataset,DataLoader
-from torchvision import transforms, utils
 
 from models.AttnLSTM import attnlstm
+from jit_model import level_file,task_ids
 
 label = {'taska':['NOT','OFF'],'taskb': ['UNT','TIN'],'taskc':['OTH', 'GRP', 'IND']}
 
-def get_data(test_file,batch_size,vocab,embedding,maxlen):
-	test_dataset = itemDataset( file_name=test_file,mode='test',vocab=vocab,embedding=embedding,maxlen=maxlen)
-	test_dataloader = DataLoader(test_dataset, batch_size=batch_size,shuffle=False, num_workers=16,collate_fn=collate_fn)
+def get_data(test_file,batch_size,vocab,maxlen):
+	test_dataset = itemDataset( file_name=test_file,mode='test',vocab=vocab,maxlen=maxlen)
+	test_dataloader = DataLoader(test_dataset, batch_size=batch_size,shuffle=False, num_workers=0,collate_fn=collate_fn)
 	
 	return test_dataloader
 
@@ -40,49 +39,85 @@ def process(args,checkpoint,vocab):
 
 	print("loading data")
 	try:
-		dataloader = get_data(args.data,args.batch_size,vocab,checkpoint['args'].embedding,checkpoint['args'].maxlen)
+		dataloader = get_data(args.data,args.batch_size,vocab,checkpoint['args'].maxlen)
 	except:
-		dataloader = get_data(args.data,args.batch_size,vocab,checkpoint['args'].embedding,128)
+		dataloader = get_data(args.data,args.batch_size,vocab,128)
 
 	print("setting model and load from pretrain")
-	
-	if(checkpoint['args'].model=='attnlstm'):
-		model = attnlstm(checkpoint['args'],vocab)
-	
-	model.load_state_dict(checkpoint['model'])
+	model = build_model(checkpoint,vocab)
 	model = model.to(device=device)
 
 	print("start testing")
 
 	model.eval()
 	out = test(model,args,dataloader,device)
-	with open(args.out,'w') as f:
-		f.write("Id,Category\n")
-		for i in range(len(out['id'])):
-			f.write('{0},{1}\n'.format(out['id'][i],label[args.task][out['ans'][i]]))
+	tasks = ['taska','taskb','taskc'] if args.task=='all' else [args.task]
+	for task in tasks:
+		ans = out['ans'][['taska','taskb','taskc'].index(task)].tolist()
+		#--task all: taskb and taskc only for the ids of their own test set
+		ids = task_ids(task,out['id'],args.data) if args.task=='all' else out['id']
+		row = {i:k for k,i in enumerate(out['id'])}
+		with open(output_file(args,task),'w') as f:
+			f.write("Id,Category\n")
+			for i in ids:
+				f.write('{0},{1}\n'.format(i,label[task][ans[row[i]]]))
+	if(args.probs):
+		probs = torch.cat(out['prob'],dim=1).tolist()
+		with open(args.out+'.probs','w') as f:
+			f.write('\t'.join(['id']+['p_'+l for task in ['taska','taskb','taskc'] for l in label[task]])+'\n')
+			for i in range(len(out['id'])):
+				f.write('\t'.join([str(out['id'][i])]+['{0:.6f}'.format(p) for p in probs[i]])+'\n')
+
+def load_checkpoint(path):
+	if(not os.path.exists(path)):
+		raise ValueError('no this path')
+	try:
+		#the checkpoint holds the training args, not only tensors
+		checkpoint = torch.load(path,map_location='cpu',weights_only=False)
+	except TypeError:
+		#torch < 1.13 has no weights_only
+		checkpoint = torch.load(path,map_location='cpu')
+	#the embedding rows come with the checkpoint
+	checkpoint['args'].embedding_path = None
+	return checkpoint
+
+def build_model(checkpoint,vocab):
+	if(checkpoint['args'].model=='attnlstm'):
+		model = attnlstm(checkpoint['args'],vocab)
+	else:
+		raise ValueError('no this model {0}'.format(checkpoint['args'].model))
+	model.load_state_dict(checkpoint['model'])
+	return model
+
+def output_file(args,task):
+	#--task all writes the three tasks next to each other
+	return '{0}.{1}'.format(args.out,task) if args.task=='all' else args.out
 
 
 def test(model, args, data_set, device):
-	def append(total,out):
-		if(len(total)==0):
-			total.append(out)
-		else:
-			total.extend(out)
-		
-	total={'id':[],'ans':[]}
+	"""
+	one forward over the data for the three heads
+	ans: the predictions of the three tasks as tensors, prob: their softmax when args.probs
+	"""
+	total={'id':[],'ans':[[],[],[]],'prob':[[],[],[]]}
 	for i,data in enumerate(data_set):
-		with torch.no_grad():
+		with torch.no_grad(), torch.autocast(device.type,dtype=torch.bfloat16,enabled=args.bf16):
 			data = convert(data,device)
-			temp = model(data['query'],data['length'])
-			out = temp[0]
+			preds,logits = model(data['query'],data['length'],presorted='perm' in data)
+			if('perm' in data):
+				#back to the order of the input file
+				inverse = data['perm'].argsort()
+				data['id'] = [data['id'][j] for j in inverse]
+				preds = [p[inverse.to(p.device)] for p in preds]
+				logits = [l[inverse.to(l.device)] for l in logits]
 			total['id'].extend(data['id'])
-			if(args.task=='taska'):
-				total['ans'].extend(out[0])
-			elif(args.task=='taskb'):
-				total['ans'].extend(out[1])
-			elif(args.task=='taskc'):
-				total['ans'].extend(out[2])
-			
+			for k in range(3):
+				total['ans'][k].append(preds[k].cpu())
+				if(args.probs):
+					total['prob'][k].append(F.softmax(logits[k],dim=-1).cpu())
+
+	total['ans'] = [torch.cat(ans) for ans in total['ans']]
+	total['prob'] = [torch.cat(prob) for prob in total['prob']] if args.probs else None
 	return total
 		
 def main():
@@ -96,25 +131,19 @@ def main():
 	
 	parser.add_argument('--save', required=True)
 	parser.add_argument('--out', required=True)
-	parser.add_argument('--task', required=True)
+	parser.add_argument('--task', required=True, choices=['taska','taskb','taskc','all'],
+						help='all: the three tasks from one pass over --data (level a), written to {out}.taska, {out}.taskb and {out}.taskc, '
+						'taskb and taskc only for the ids of testset-levelb/c')
+	parser.add_argument('--probs', action='store_true', help='also write the probabilities of the three heads to {out}.probs')
+	parser.add_argument('--bf16', action='store_true', help='bfloat16 autocast, for a model trained with or without it')
 	
 	args = parser.parse_args()
-	args.data = './data/testset-level{0}.tsv'.format(args.task[-1])
-	if(os.path.exists(args.save)):
-		checkpoint = torch.load(args.save)
-	else:
-		raise ValueError('no this path')
+	if(args.task!='all'):
+		args.data = level_file(args.task)
+	checkpoint = load_checkpoint(args.save)
 	
-	if(checkpoint['args'].embedding==False):
-		vocab = {}
-		with open('./data/vocab') as f:
-			for i,word in enumerate(f):
-				word = word.strip().split()
-				vocab[ word[0] ] = i
-			args.word_num = len(vocab)
-	else:
-		news_path = './data/embedding/GoogleNews-vectors-negative300.bin'
-		vocab = KeyedVectors.load_word2vec_format(news_path, binary=True)
+	vocab = load_vocab('./data/vocab')
+	args.word_num = len(vocab)
 
 	print('testing start!')
 	process(args,checkpoint,vocab)
@@ -1,60 +1,127 @@
-import sys
+"""
+grid search of the two thresholds of the cascade pred = (s0>i) * (1 + (s1>j))
+OffensEval: s0 = P(OFF), s1 = P(TIN), classes NOT / OFF and UNT / OFF and TIN
+the old fake news task: classes unrelated / agreed / disagreed
+
+every (i,j) of the grid is scored from one 2d histogram of the scores and its cumulative sums,
+no loop over the grid
+
+python threshold_search.py {logits file} --labels {tsv/csv with the labels} --grid 1000 --objective f1
+logits file:
+	test_semeval.py --dump_logits tsv (id NOT OFF UNT TIN OTH GRP IND)
+	predict_semeval.py tsv (id ... p_OFF ... p_TIN ...)
+	the old csv of id,[logit0],[logit1]
+"""
+import argparse
+
 import numpy as np
-import math
 import pandas as pd
-from sklearn import metrics
+
+legacy_label = {
+	"unrelated":0,
+	"agreed":1,
+	"disagreed":2
+}
 
 def sigmoid(x):
 	return 1/(1+np.exp(-x))
 
-def count(pred,label):
-	w = [1.0/16,1.0/15,1.0/5]
-	sample_weight = [w[i] for i in pred]
-	total = metrics.accuracy_score(label, pred, normalize=True, sample_weight=sample_weight)
+def softmax_pos(logits):
+	#probability of the second of two classes
+	return sigmoid(logits[:,1]-logits[:,0])
 
-	return total
+def read_scores(file_name):
+	"""ids (or None) and the two scores s0, s1 of every sample"""
+	with open(file_name) as f:
+		first = f.readline()
+	if('\t' not in first):
+		#id,[logit0],[logit1]
+		data = pd.read_csv(file_name,header=None,names=['id','s0','s1'],dtype=str)
+		s0 = data['s0'].str.strip('[]').astype(float).values
+		s1 = data['s1'].str.strip('[]').astype(float).values
+		return None,sigmoid(s0),sigmoid(s1)
+	data = pd.read_csv(file_name,sep='\t')
+	if('p_OFF' in data.columns):
+		return data['id'].values,data['p_OFF'].values,data['p_TIN'].values
+	return data['id'].values,softmax_pos(data[['NOT','OFF']].values),softmax_pos(data[['UNT','TIN']].values)
 
+def read_labels(file_name,ids):
+	"""class 0, 1 or 2 of every sample, in the order of ids"""
+	data = pd.read_csv(file_name,sep='\t' if file_name.endswith('.tsv') else ',')
+	if('label' in data.columns):
+		return data['label'].map(legacy_label).values
+	labels = (data['subtask_a']=='OFF').astype(int) * (1 + (data['subtask_b']=='TIN').astype(int))
+	labels.index = data['id'].values
+	return labels.loc[ids].values if ids is not None else labels.values
 
-datas = [[],[]]
-with open(sys.argv[1]) as f:
-	for line in f:
-		line = line.strip().split(',')
+def grid_confusion(s0,s1,labels,t0,t1,n_classes=3):
+	"""
+	confusion matrices of the cascade for every pair of thresholds, (len(t0), len(t1), true, pred)
+	b0 = number of thresholds t0 below s0, so s0 > t0[i] for every i < b0, same for b1
+	the samples above (t0[i], t1[j]) are a reverse cumulative sum of the (b0, b1) histogram
+	"""
+	t0,t1 = np.sort(t0),np.sort(t1)
+	b0 = np.searchsorted(t0,s0,side='left')
+	b1 = np.searchsorted(t1,s1,side='left')
+	n0,n1 = len(t0),len(t1)
+	conf = np.zeros((n0,n1,n_classes,3),dtype=np.int64)
+	for c in range(n_classes):
+		mask = labels==c
+		hist = np.bincount(b0[mask]*(n1+1)+b1[mask],minlength=(n0+1)*(n1+1)).reshape(n0+1,n1+1)
+		#above[i,j]: samples of class c with b0 > i and b1 > j
+		above = hist[::-1,::-1].cumsum(0).cumsum(1)[::-1,::-1]
+		both = above[1:,1:]
+		pos = above[1:,0]
+		conf[:,:,c,2] = both
+		conf[:,:,c,1] = pos[:,None]-both
+		conf[:,:,c,0] = mask.sum()-pos[:,None]
+	return t0,t1,conf
 
-		datas[0].append(float(line[1][1:-1]))
-		datas[1].append(float(line[2][1:-1]))
+def objective(conf,weights,name,weight_by):
+	"""score of every confusion matrix of the grid"""
+	conf = conf.astype(np.float64)
+	if(name=='accuracy'):
+		#weighted accuracy, a sample weighs weights[its label] or weights[its prediction]
+		w = weights[:,None] if weight_by=='label' else weights[None,:]
+		correct = np.trace(conf*w,axis1=-2,axis2=-1)
+		total = (conf*w).sum(axis=(-2,-1))
+		return correct/np.maximum(total,1e-12)
+	#f1 of every class averaged with the weights
+	tp = np.diagonal(conf,axis1=-2,axis2=-1)
+	fp = conf.sum(axis=-2)-tp
+	fn = conf.sum(axis=-1)-tp
+	f1 = 2*tp/np.maximum(2*tp+fp+fn,1e-12)
+	return (f1*weights).sum(axis=-1)/weights.sum()
 
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('logits')
+	parser.add_argument('--labels', default='./data/all_no_embedding/eval.csv', type=str,
+						help='csv with a label column (fake news) or tsv with id, subtask_a and subtask_b (OffensEval)')
+	parser.add_argument('--grid', default=10, type=int, help='thresholds k/grid for k in 0..grid-1 on both scores')
+	parser.add_argument('--objective', default='accuracy', choices=['accuracy','f1'])
+	parser.add_argument('--class_weights', default=None, type=float, nargs=3,
+						help='weights of the three classes, the old script used 1/16 1/15 1/5 by prediction')
+	parser.add_argument('--weight_by', default='label', choices=['label','pred'],
+						help='accuracy: weigh a sample by the weight of its label or of its prediction')
+	parser.add_argument('--out', default=None, type=str, help='write the score of every pair of thresholds')
+	args = parser.parse_args()
 
-datas[0] = sigmoid(np.array(datas[0]))
-datas[1] = sigmoid(np.array(datas[1]))
+	ids,s0,s1 = read_scores(args.logits)
+	labels = read_labels(args.labels,ids)
+	if(len(labels)!=len(s0)):
+		raise ValueError('{0} scores but {1} labels'.format(len(s0),len(labels)))
+	weights = np.array(args.class_weights if args.class_weights is not None else [1.0,1.0,1.0])
 
+	thresholds = np.arange(args.grid)/args.grid
+	t0,t1,conf = grid_confusion(s0,s1,labels,thresholds,thresholds)
+	score = objective(conf,weights,args.objective,args.weight_by)
 
-labels =pd.read_csv('./data/all_no_embedding/eval.csv')['label'].tolist()
-c = {
-	"unrelated":0,
-	"agreed":1,
-	"disagreed":2
-}
-labels = [ c[_] for _ in labels]
-
-now = [0,0,0]
-outputs = []
-for i in range(10):
-	i = i/10
-	for j in range(10):
-		j = j/10
-		
-		pred = (datas[0]>i).astype(int)* ( 1 + (datas[1]>j).astype(int) )
-		
-
-		acc = count(pred,labels)
-		
-		print(i,j,acc)
-
-		if(acc>now[2]):
-			now = [i,j,acc]
-		outputs.append([i,j,acc])
-
-#for output in outputs:
-#	print(output)
-print(now)
+	i,j = np.unravel_index(np.argmax(score),score.shape)
+	print('best {0}: {1:.6f} at s0 > {2:g}, s1 > {3:g}'.format(args.objective,score[i,j],t0[i],t1[j]))
+	if(args.out is not None):
+		grid0,grid1 = np.meshgrid(t0,t1,indexing='ij')
+		pd.DataFrame({'t0':grid0.ravel(),'t1':grid1.ravel(),args.objective:score.ravel()}).to_csv(args.out,index=False)
 
+if(__name__ == '__main__'):
+	main()
@@ -2,24 +2,27 @@ from time import gmtime, strftime
 import os
 import argparse
 
-from data.dataloader import itemDataset,collate_fn
+from data.dataloader import itemDataset,collate_fn,load_vocab
 
 import torch
 import torch.optim as optim
 import torch.nn.functional as F
 import torch.nn as nn
 from torch.utils.data import Dataset,DataLoader
-from torchvision import transforms, utils
-from gensim.models import KeyedVectors
 from models.AttnLSTM import attnlstm
+from models.base import confusion_f1
 
+import time
+import numpy as np
+from sklearn.metrics import f1_score
 
-def get_data(train_file,eval_file,batch_size,maxlen,vocab,embedding):
-	train_dataset = itemDataset( file_name=train_file,mode='train',vocab=vocab,embedding=embedding,maxlen=maxlen)
-	train_dataloader = DataLoader(train_dataset, batch_size=batch_size,shuffle=True, num_workers=16,collate_fn=collate_fn)
+
+def get_data(train_file,eval_file,batch_size,maxlen,vocab,num_workers=0):
+	train_dataset = itemDataset( file_name=train_file,mode='train',vocab=vocab,maxlen=maxlen)
+	train_dataloader = DataLoader(train_dataset, batch_size=batch_size,shuffle=True, num_workers=num_workers,collate_fn=collate_fn)
 	
-	eval_dataset = itemDataset( file_name=eval_file,mode='eval',vocab=vocab,embedding=embedding,maxlen=maxlen)
-	eval_dataloader = DataLoader(eval_dataset, batch_size=batch_size,shuffle=True, num_workers=16,collate_fn=collate_fn)
+	eval_dataset = itemDataset( file_name=eval_file,mode='eval',vocab=vocab,maxlen=maxlen)
+	eval_dataloader = DataLoader(eval_dataset, batch_size=batch_size,shuffle=True, num_workers=num_workers,collate_fn=collate_fn)
 	
 	return {
 		'train':train_dataloader,
@@ -34,6 +37,56 @@ def convert(data,device):
 			data[name] = data[name].to(device)
 	return data
 
+def load_teacher(file_name):
+	#logits file written by pytorch-pretrained-BERT/test_semeval.py --do_test --dump_logits
+	#id, then the logits of the a(2), b(2) and c(3) heads
+	teacher = {}
+	with open(file_name) as f:
+		next(f)
+		for line in f:
+			line = line.rstrip('\n').split('\t')
+			teacher[line[0]] = np.array(line[1:],dtype=np.float32)
+	return teacher
+
+def teacher_batch(teacher,ids,device):
+	try:
+		logits = np.stack([teacher[str(i)] for i in ids])
+	except KeyError as e:
+		raise KeyError('id {0} is not in the teacher logits'.format(e.args[0]))
+	return torch.from_numpy(logits).to(device)
+
+def subtask_f1(preds,labels):
+	#macro f1 of the three subtasks, b on the offensive tweets and c on the targeted ones
+	masks = [np.ones(len(labels),dtype=bool),labels[:,0]==1,labels[:,1]==1]
+	return [f1_score(labels[mask,i],preds[mask,i],average='macro') for i,mask in enumerate(masks)]
+
+def distill_report(model,data_set,device,teacher,args):
+	total = {'id':[],'pred':[],'label':[]}
+	n = 0
+	start = time.time()
+	for i,data in enumerate(data_set):
+		with torch.no_grad(), torch.autocast(device.type,dtype=torch.bfloat16,enabled=args.bf16):
+			data = convert(data,device)
+			preds,_ = model(data['query'],data['length'],presorted='perm' in data)
+		total['id'].extend(data['id'])
+		total['pred'].append(torch.stack(preds,dim=1).cpu())
+		total['label'].append(data['label'].cpu())
+		n += len(data['id'])
+	throughput = n/(time.time()-start)
+
+	labels = torch.cat(total['label']).numpy()
+	student = subtask_f1(torch.cat(total['pred']).numpy(),labels)
+	teacher_logits = teacher_batch(teacher,total['id'],'cpu').split([2,2,3],dim=-1)
+	teacher = subtask_f1(torch.stack([t.argmax(dim=-1) for t in teacher_logits],dim=1).numpy(),labels)
+
+	for name,s,t in zip(['a','b','c'],student,teacher):
+		print('task {0} student f1:{1:.4f} teacher f1:{2:.4f} kept:{3:.1%}'.format(name,s,t,s/t if t>0 else 0))
+	if(args.teacher_throughput is not None):
+		print('student {0:.1f} tweets/s teacher {1:.1f} tweets/s gain:{2:.1f}x'.format(
+			throughput,args.teacher_throughput,throughput/args.teacher_throughput))
+	else:
+		print('student {0:.1f} tweets/s'.format(throughput))
+
 def process(args,vocab):
 	print("check device")
 	if(torch.cuda.is_available() and args.gpu>=0):
@@ -44,7 +97,13 @@ def process(args,vocab):
 		print('the device is in cpu')
 
 	print("loading data")
-	dataloader = get_data(os.path.join(args.data,'train.tsv'),os.path.join(args.data,'eval.tsv'),args.batch_size,args.maxlen,vocab,args.embedding)
+	dataloader = get_data(os.path.join(args.data,'train.tsv'),os.path.join(args.data,'eval.tsv'),args.batch_size,args.maxlen,vocab,args.num_workers)
+
+	teacher,eval_teacher = None,None
+	if(args.teacher_logits is not None):
+		print("loading teacher logits")
+		teacher = load_teacher(args.teacher_logits)
+		eval_teacher = load_teacher(args.teacher_eval_logits) if args.teacher_eval_logits is not None else None
 
 	print("setting model")
 	if(args.model=='attnlstm'):
@@ -67,59 +126,72 @@ def process(args,vocab):
 	model.zero_grad()
 	for now in range(args.epoch):
 		model.train()
-		train(model,dataloader['train'],optimizer,device)
+		train_time = train(model,dataloader['train'],optimizer,device,teacher,args.bf16)
 		model.eval()
+		start = time.time()
 		acc_best = eval(model,dataloader['eval'],device,acc_best,now,args)
+		print('epoch {0} {1} train:{2:.2f}s eval:{3:.2f}s'.format(now,'bf16' if args.bf16 else 'fp32',train_time,time.time()-start))
+		if(teacher is not None and eval_teacher is not None):
+			distill_report(model,dataloader['eval'],device,eval_teacher,args)
 		scheduler.step()
 
-def train(model,data_set,optimizer,device):
+def accumulate(total,out):
+	for cla in out:
+		if(cla not in total):
+			total[cla]={}
+		for t in out[cla]:
+			try:
+				total[cla][t] += out[cla][t]
+			except:
+				total[cla][t] = out[cla][t]
+
+def summary(total):
+	#the sums stay on the device during the epoch, this is their only sync
+	return {
+		'loss':{t:v.item() for t,v in total['loss'].items()},
+		'correct':{t:v.item() for t,v in total['correct'].items()},
+		'f1':{t:round(confusion_f1(v),4) for t,v in total['conf'].items()},
+	}
+
+def train(model,data_set,optimizer,device,teacher=None,bf16=False):
+	#returns the seconds of the epoch
 	total={}
+	start = time.time()
 	for i,data in enumerate(data_set):
 		data = convert(data,device)
 
 		#deal with the classfication part
-		loss,out = model(data['query'],data['length'],data['label'])
+		with torch.autocast(device.type,dtype=torch.bfloat16,enabled=bf16):
+			if(teacher is not None):
+				teacher_logits = teacher_batch(teacher,data['id'],device)
+				loss,out = model(data['query'],data['length'],data['label'],teacher_logits=teacher_logits,presorted='perm' in data)
+			else:
+				loss,out = model(data['query'],data['length'],data['label'],presorted='perm' in data)
 		loss.backward()
 		
-		for cla in out:
-			if(cla not in total):
-				total[cla]={}
-			for t in out[cla]:
-				try:
-					total[cla][t] += out[cla][t]
-				except:
-					total[cla][t] = out[cla][t]
-		#print(out['num'])
+		accumulate(total,out)
 		if(i%1==0):
 			optimizer.step()
 			model.zero_grad()
 
-	print(i,'train loss:{0}  correct:{1} num:{2}'.format(total['loss'],total['correct'],total['num']))
-	for cla in total:
-		for t in total[cla]:
-			total[cla][t] = 0
-
-	
+	total = summary(total)
+	elapsed = time.time()-start
+	print(i,'train loss:{0}  correct:{1} f1:{2}'.format(total['loss'],total['correct'],total['f1']))
+	return elapsed
 
 def eval(model,data_set,device,acc_best,now,args):
 	total={}
 	
 	for i,data in enumerate(data_set):
-		with torch.no_grad():
+		with torch.no_grad(), torch.autocast(device.type,dtype=torch.bfloat16,enabled=args.bf16):
 			#
 			data = convert(data,device)
-			loss,out = model(data['query'],data['length'],data['label'])
+			loss,out = model(data['query'],data['length'],data['label'],presorted='perm' in data)
 			
-			for cla in out:
-				if(cla not in total):
-					total[cla]={}
-				for t in out[cla]:
-					try:
-						total[cla][t] += out[cla][t]
-					except:
-						total[cla][t] = out[cla][t]
+			accumulate(total,out)
 	
-	print(i,'test loss:{0}  correct:{1} num:{2}'.format(total['loss'],total['correct'],total['num']))
+	total = summary(total)
+	print(i,'test loss:{0}  correct:{1} f1:{2}'.format(total['loss'],total['correct'],total['f1']))
 	print('-'*10)
 	
 	check = {
@@ -147,30 +219,35 @@ def main():
 	parser.add_argument('--learning_rate', default=0.005, type=float)
 	
 	parser.add_argument('--embedding', default=False, type=bool)
+	parser.add_argument('--embedding_path', default='./data/embedding/glove', type=str,
+						help='pretrained vectors converted by convert_embedding.py')
 	parser.add_argument('--batch_first', default=True, type=bool)
 	parser.add_argument('--mode' , default= 'train', type=str)
 	parser.add_argument('--epoch', default= 20, type=int)
 
 	parser.add_argument('--data', default='./data/', type=str)
 	parser.add_argument('--maxlen', default= 128, type=int)
-	parser.add_argument('--attention', default='luong',type=str)
+	parser.add_argument('--num_workers', default= 0, type=int)
+	parser.add_argument('--attention', default='luong',type=str, help='luong, bahdanau or multihead')
+	parser.add_argument('--heads', default=4, type=int, help='heads of --attention multihead, divides embeds_dim')
+	parser.add_argument('--bf16', action='store_true',
+						help='bfloat16 autocast of the embedding, attention, rnn and linear layers, the weights stay fp32')
+
+	parser.add_argument('--teacher_logits', default=None, type=str,
+						help='logits of the train set dumped by test_semeval.py --do_test --dump_logits, turns on distillation')
+	parser.add_argument('--teacher_eval_logits', default=None, type=str,
+						help='the same for the eval set, to report the f1 the student keeps')
+	parser.add_argument('--teacher_throughput', default=None, type=float,
+						help='tweets/s logged by test_semeval.py --do_test, to report the gain')
+	parser.add_argument('--temperature', default=2.0, type=float)
+	parser.add_argument('--distill_alpha', default=0.5, type=float,
+						help='weight of the soft target loss, the hard loss gets 1-alpha')
 
 	parser.add_argument('--model', required=True)
 	parser.add_argument('--save', required=True)
 	
 	args = parser.parse_args()
-	if(args.embedding==False):
-		vocab = {}
-		with open('{0}/vocab'.format(args.data)) as f:
-			for i,word in enumerate(f):
-				word = word.strip().split()
-				vocab[ word[0] ] = i
-	else:
-		#news_path = './data/embedding/GoogleNews-vectors-negative300.bin'
-		#vocab = KeyedVectors.load_word2vec_format(news_path, binary=True)
-
-		news_path = './data/embedding/gensim_glove_vectors.txt'
-		vocab = KeyedVectors.load_word2vec_format(news_path, binary=False)
+	vocab = load_vocab('{0}/vocab'.format(args.data))
 	
 	if not os.path.exists('saved_models'):
 		os.makedirs('saved_models')
@@ -0,0 +1,104 @@
+"""Latency against F1 of an early-exit OffensEval model for a range of thresholds.
+
+The model must have been fine-tuned with `test_semeval.py --early_exit`. For
+every entropy threshold the eval of test_semeval.py is run on valid.tsv and the
+average number of encoder layers per tweet, the eval time and the acc/F1 of
+the three subtasks are reported, next to the full model (no early exit).
+
+python benchmark_early_exit.py --data_dir {folder to data} --bert_model {model dir} --do_lower_case --thresholds 0.1 0.2 0.3 0.4 0.5
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import logging
+import os
+import time
+
+import torch
+from torch.utils.data import TensorDataset
+
+from pytorch_pretrained_bert.modeling import BertForSequenceClassification
+from pytorch_pretrained_bert.tokenization import BertTokenizer
+from test_semeval import (FEATURE_FIELDS, SUBTASK_LABELS, SUBTASKS, SemevalProcessor, average_exit_layer,
+						  compute_metrics, evaluate, get_dataloader, load_features)
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--data_dir", default=None, type=str, required=True,
+						help="The input data dir. Should contain valid.tsv.")
+	parser.add_argument("--bert_model", default=None, type=str, required=True,
+						help="Folder of the model fine-tuned by test_semeval.py --early_exit.")
+	parser.add_argument("--do_lower_case", action='store_true',
+						help="Set this flag if you are using an uncased model.")
+	parser.add_argument("--thresholds", default=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6], type=float, nargs='+',
+						help="Entropy thresholds of the subtask a head to try.")
+	parser.add_argument("--max_seq_length", default=80, type=int,
+						help="The maximum total input sequence length after WordPiece tokenization, as in training.")
+	parser.add_argument("--eval_batch_size", default=8, type=int,
+						help="Total batch size for eval.")
+	parser.add_argument("--no_cuda", action='store_true',
+						help="Whether not to use CUDA when available")
+	parser.add_argument("--int8", action='store_true',
+						help="Dynamically quantize the Linear layers to int8 (CPU only).")
+	parser.add_argument("--features_cache_dir", default=None, type=str,
+						help="See test_semeval.py.")
+	parser.add_argument("--no_features_cache", action='store_true',
+						help="See test_semeval.py.")
+	parser.add_argument("--preprocessing_num_workers", default=1, type=int,
+						help="See test_semeval.py.")
+	parser.add_argument("--no_bucketing", action='store_true',
+						help="See test_semeval.py.")
+	parser.add_argument('--seed', type=int, default=42,
+						help="random seed for initialization")
+	parser.set_defaults(local_rank=-1)
+	args = parser.parse_args()
+
+	logging.basicConfig(format = '%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+						datefmt = '%m/%d/%Y %H:%M:%S',
+						level = logging.INFO)
+	device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda and not args.int8 else "cpu")
+
+	processor = SemevalProcessor()
+	output_mode = "multi_classification"
+	num_labels = [len(labels) for labels in SUBTASK_LABELS]
+	tokenizer = BertTokenizer.from_pretrained(args.bert_model, do_lower_case=args.do_lower_case)
+	features = load_features(os.path.join(args.data_dir, "valid.tsv"), "dev",
+							 lambda: processor.get_dev_examples(args.data_dir),
+							 processor.get_labels(), tokenizer, args, output_mode)
+	all_input_ids, all_input_mask, all_segment_ids, all_label_ids = (
+		torch.from_numpy(features[name]) for name in FEATURE_FIELDS)
+	eval_data = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids)
+	eval_dataloader = get_dataloader(eval_data, all_input_mask, args.eval_batch_size, False, args)
+
+	model = BertForSequenceClassification.from_pretrained(args.bert_model, num_labels=num_labels)
+	if not getattr(model.config, 'early_exit', False):
+		raise ValueError("{} has no exit classifiers, fine-tune it with test_semeval.py --early_exit".format(
+			args.bert_model))
+	if args.int8 and not getattr(model.config, 'quantized', False):
+		model.quantize()
+	model.to(device)
+
+	rows = []
+	for threshold in [None] + args.thresholds:
+		model.exit_threshold = threshold
+		model.exit_counts = [0] * len(model.exit_counts)
+		start = time.perf_counter()
+		_, preds = evaluate(model, eval_dataloader, device, num_labels, output_mode)
+		eval_time = time.perf_counter() - start
+		layers = average_exit_layer(model.exit_counts) if threshold is not None else model.config.num_hidden_layers
+		rows.append((threshold, layers, eval_time, compute_metrics("semeval", preds, all_label_ids.numpy())['total']))
+
+	print("{:>10}{:>8}{:>10}{:>12}".format("threshold", "layers", "eval s", "tweets/s")
+		  + "".join("{:>10} f1".format(task) for task in SUBTASKS))
+	for threshold, layers, eval_time, metrics in rows:
+		print("{:>10}{:>8.2f}{:>10.2f}{:>12.1f}".format(
+			"full" if threshold is None else "{:g}".format(threshold), layers, eval_time, len(eval_data) / eval_time)
+			  + "".join("{:>13.4f}".format(m['f1']) for m in metrics))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,118 @@
+"""Microbenchmark of BertTokenizer on the OLID tweets.
+
+Compares the original WordPiece loop (rebuilding every candidate substring,
+no memo) against the current WordpieceTokenizer (prefix sets + LRU word
+cache) and `BertTokenizer.tokenize_batch`, and checks that all of them
+produce the same wordpieces.
+
+python benchmark_tokenization.py --data {folder to data}/train.tsv --bert_model bert-base-uncased --do_lower_case
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import time
+
+import pandas as pd
+
+from pytorch_pretrained_bert.tokenization import BertTokenizer, whitespace_tokenize
+from test_semeval import remove_emoji
+
+
+def legacy_wordpiece(vocab, text, unk_token="[UNK]", max_input_chars_per_word=100):
+	"""The WordpieceTokenizer.tokenize loop as it was before the prefix sets and cache."""
+	output_tokens = []
+	for token in whitespace_tokenize(text):
+		chars = list(token)
+		if len(chars) > max_input_chars_per_word:
+			output_tokens.append(unk_token)
+			continue
+
+		is_bad = False
+		start = 0
+		sub_tokens = []
+		while start < len(chars):
+			end = len(chars)
+			cur_substr = None
+			while start < end:
+				substr = "".join(chars[start:end])
+				if start > 0:
+					substr = "##" + substr
+				if substr in vocab:
+					cur_substr = substr
+					break
+				end -= 1
+			if cur_substr is None:
+				is_bad = True
+				break
+			sub_tokens.append(cur_substr)
+			start = end
+
+		if is_bad:
+			output_tokens.append(unk_token)
+		else:
+			output_tokens.extend(sub_tokens)
+	return output_tokens
+
+
+def timed(fn, repeat):
+	best = float('inf')
+	for _ in range(repeat):
+		start = time.perf_counter()
+		out = fn()
+		best = min(best, time.perf_counter() - start)
+	return best, out
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--data", required=True, type=str,
+						help="OLID training tsv (id, tweet, subtask_a, ...).")
+	parser.add_argument("--bert_model", required=True, type=str,
+						help="Pre-trained model name or folder holding vocab.txt.")
+	parser.add_argument("--do_lower_case", action='store_true')
+	parser.add_argument("--repeat", default=3, type=int,
+						help="Runs per implementation; the fastest one is reported.")
+	args = parser.parse_args()
+
+	texts = [remove_emoji(t) for t in pd.read_csv(args.data, sep='\t')['tweet'].tolist()]
+	tokenizer = BertTokenizer.from_pretrained(args.bert_model, do_lower_case=args.do_lower_case)
+	basic_tokens = [tokenizer.basic_tokenizer.tokenize(t) for t in texts]
+	wordpiece = tokenizer.wordpiece_tokenizer
+	vocab = tokenizer.vocab
+
+	def run_legacy():
+		return [[p for w in words for p in legacy_wordpiece(vocab, w)] for words in basic_tokens]
+
+	def run_current():
+		wordpiece.cache.clear()
+		return [[p for w in words for p in wordpiece.tokenize(w)] for words in basic_tokens]
+
+	def run_end_to_end():
+		wordpiece.cache.clear()
+		return [tokenizer.tokenize(t) for t in texts]
+
+	def run_batch():
+		wordpiece.cache.clear()
+		return tokenizer.tokenize_batch(texts)
+
+	n_words = sum(len(words) for words in basic_tokens)
+	print("{} tweets, {} words, {} distinct".format(
+		len(texts), n_words, len(set(w for words in basic_tokens for w in words))))
+
+	legacy_time, legacy_out = timed(run_legacy, args.repeat)
+	current_time, current_out = timed(run_current, args.repeat)
+	assert legacy_out == current_out, "wordpiece output changed"
+	print("wordpiece  legacy  {:8.3f}s  {:10.0f} words/s".format(legacy_time, n_words / legacy_time))
+	print("wordpiece  current {:8.3f}s  {:10.0f} words/s  x{:.1f}".format(
+		current_time, n_words / current_time, legacy_time / current_time))
+
+	tokenize_time, tokenize_out = timed(run_end_to_end, args.repeat)
+	batch_time, batch_out = timed(run_batch, args.repeat)
+	assert tokenize_out == batch_out == legacy_out
+	print("BertTokenizer.tokenize       {:8.3f}s  {:8.0f} tweets/s".format(tokenize_time, len(texts) / tokenize_time))
+	print("BertTokenizer.tokenize_batch {:8.3f}s  {:8.0f} tweets/s".format(batch_time, len(texts) / batch_time))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,156 @@
+"""Accuracy/F1 and CPU latency of a fine-tuned OffensEval model, float32 against int8.
+
+Runs the eval of test_semeval.py on valid.tsv twice: once with the model as
+trained and once after `BertForSequenceClassification.quantize()`. For each it
+reports the checkpoint size, the eval throughput, the latency of single tweets
+and the accuracy/F1 of the three subtasks, then how often the two models agree.
+With --int8_output_dir the quantized checkpoint is also saved there, reloaded
+through `from_pretrained` and checked against the in-memory quantized model.
+
+python compare_int8.py --data_dir {folder to data} --bert_model {model dir} --do_lower_case
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import io
+import logging
+import os
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import TensorDataset
+
+from pytorch_pretrained_bert.file_utils import WEIGHTS_NAME, CONFIG_NAME
+from pytorch_pretrained_bert.modeling import BertForSequenceClassification
+from pytorch_pretrained_bert.tokenization import BertTokenizer
+from test_semeval import (FEATURE_FIELDS, SUBTASK_LABELS, SUBTASKS, SemevalProcessor, compute_metrics,
+						  evaluate, get_dataloader, load_features)
+
+logger = logging.getLogger(__name__)
+
+
+def checkpoint_size(model):
+	buffer = io.BytesIO()
+	torch.save(model.state_dict(), buffer)
+	return buffer.tell()
+
+
+def single_latency(model, features, n_samples):
+	"""Milliseconds per forward pass of one tweet, over the first `n_samples` tweets."""
+	times = []
+	for i in range(min(n_samples, len(features['input_ids']))):
+		length = int(features['input_mask'][i].sum())
+		input_ids, input_mask, segment_ids = (
+			torch.from_numpy(features[name][i:i + 1, :length]).long() for name in FEATURE_FIELDS[:3])
+		start = time.perf_counter()
+		with torch.no_grad():
+			model(input_ids, segment_ids, input_mask)
+		times.append((time.perf_counter() - start) * 1000)
+	return np.percentile(times, 50), np.percentile(times, 99)
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--data_dir", default=None, type=str, required=True,
+						help="The input data dir. Should contain valid.tsv.")
+	parser.add_argument("--bert_model", default=None, type=str, required=True,
+						help="Folder of the float32 model fine-tuned by test_semeval.py.")
+	parser.add_argument("--do_lower_case", action='store_true',
+						help="Set this flag if you are using an uncased model.")
+	parser.add_argument("--int8_output_dir", default=None, type=str,
+						help="Where to save the quantized checkpoint (weights, config and vocab).")
+	parser.add_argument("--max_seq_length", default=80, type=int,
+						help="The maximum total input sequence length after WordPiece tokenization, as in training.")
+	parser.add_argument("--eval_batch_size", default=8, type=int,
+						help="Total batch size for eval.")
+	parser.add_argument("--latency_samples", default=200, type=int,
+						help="Number of tweets timed one at a time.")
+	parser.add_argument("--num_threads", default=0, type=int,
+						help="torch.set_num_threads for the comparison, 0 keeps the torch default.")
+	parser.add_argument("--features_cache_dir", default=None, type=str,
+						help="See test_semeval.py.")
+	parser.add_argument("--no_features_cache", action='store_true',
+						help="See test_semeval.py.")
+	parser.add_argument("--preprocessing_num_workers", default=1, type=int,
+						help="See test_semeval.py.")
+	parser.add_argument("--no_bucketing", action='store_true',
+						help="See test_semeval.py.")
+	parser.add_argument('--seed', type=int, default=42,
+						help="random seed for initialization")
+	parser.set_defaults(local_rank=-1)
+	args = parser.parse_args()
+
+	logging.basicConfig(format = '%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+						datefmt = '%m/%d/%Y %H:%M:%S',
+						level = logging.INFO)
+	if args.num_threads > 0:
+		torch.set_num_threads(args.num_threads)
+	device = torch.device("cpu")
+
+	processor = SemevalProcessor()
+	output_mode = "multi_classification"
+	num_labels = [len(labels) for labels in SUBTASK_LABELS]
+	tokenizer = BertTokenizer.from_pretrained(args.bert_model, do_lower_case=args.do_lower_case)
+	features = load_features(os.path.join(args.data_dir, "valid.tsv"), "dev",
+							 lambda: processor.get_dev_examples(args.data_dir),
+							 processor.get_labels(), tokenizer, args, output_mode)
+	all_input_ids, all_input_mask, all_segment_ids, all_label_ids = (
+		torch.from_numpy(features[name]) for name in FEATURE_FIELDS)
+	eval_data = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids)
+	eval_dataloader = get_dataloader(eval_data, all_input_mask, args.eval_batch_size, False, args)
+
+	models = [('fp32', BertForSequenceClassification.from_pretrained(args.bert_model, num_labels=num_labels))]
+	models.append(('int8', BertForSequenceClassification.from_pretrained(
+		args.bert_model, num_labels=num_labels).quantize()))
+
+	results = {}
+	for name, model in models:
+		model.eval()
+		start = time.perf_counter()
+		_, preds = evaluate(model, eval_dataloader, device, num_labels, output_mode)
+		eval_time = time.perf_counter() - start
+		p50, p99 = single_latency(model, features, args.latency_samples)
+		results[name] = {
+			'preds': preds,
+			'metrics': compute_metrics("semeval", preds, all_label_ids.numpy())['total'],
+			'size': checkpoint_size(model) / 2**20,
+			'eval_time': eval_time,
+			'p50': p50,
+			'p99': p99,
+		}
+
+	print("{:<6}{:>10}{:>10}{:>12}{:>10}{:>10}".format(
+		"model", "size MB", "eval s", "tweets/s", "p50 ms", "p99 ms"))
+	for name, _ in models:
+		r = results[name]
+		print("{:<6}{:>10.1f}{:>10.2f}{:>12.1f}{:>10.2f}{:>10.2f}".format(
+			name, r['size'], r['eval_time'], len(eval_data) / r['eval_time'], r['p50'], r['p99']))
+	print()
+	print("{:<6}".format("model") + "".join("{:>9} acc{:>9} f1".format(task, task) for task in SUBTASKS))
+	for name, _ in models:
+		print("{:<6}".format(name) + "".join(
+			"{:>13.4f}{:>12.4f}".format(m['acc'], m['f1']) for m in results[name]['metrics']))
+	print()
+	agreement = [np.mean(p32.argmax(axis=-1) == p8.argmax(axis=-1))
+				 for p32, p8 in zip(results['fp32']['preds'], results['int8']['preds'])]
+	print("prediction agreement " + "  ".join(
+		"{} {:.4f}".format(task, a) for task, a in zip(SUBTASKS, agreement)))
+
+	if args.int8_output_dir:
+		quantized = models[1][1]
+		if not os.path.exists(args.int8_output_dir):
+			os.makedirs(args.int8_output_dir)
+		torch.save(quantized.state_dict(), os.path.join(args.int8_output_dir, WEIGHTS_NAME))
+		quantized.config.to_json_file(os.path.join(args.int8_output_dir, CONFIG_NAME))
+		tokenizer.save_vocabulary(args.int8_output_dir)
+		reloaded = BertForSequenceClassification.from_pretrained(args.int8_output_dir, num_labels=num_labels)
+		_, preds = evaluate(reloaded, eval_dataloader, device, num_labels, output_mode)
+		max_diff = max(np.abs(a - b).max() for a, b in zip(preds, results['int8']['preds']))
+		print("saved the int8 checkpoint to {}, reloaded logits differ by at most {:g}".format(
+			args.int8_output_dir, max_diff))
+
+
+if __name__ == "__main__":
+	main()
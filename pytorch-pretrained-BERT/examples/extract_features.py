@@ -20,14 +20,17 @@ from __future__ import print_function
 
 import argparse
 import collections
+import functools
 import logging
 import json
 import re
 
+import numpy as np
 import torch
 from torch.utils.data import TensorDataset, DataLoader, SequentialSampler
 from torch.utils.data.distributed import DistributedSampler
 
+from pytorch_pretrained_bert.data_utils import concatenate_arrays, features_to_arrays, parallel_convert
 from pytorch_pretrained_bert.tokenization import BertTokenizer
 from pytorch_pretrained_bert.modeling import BertModel
 
@@ -147,6 +150,19 @@ def convert_examples_to_features(examples, seq_length, tokenizer):
     return features
 
 
+def convert_examples_to_arrays(examples, shard_start, seq_length, tokenizer):
+    """Runs `convert_examples_to_features` on one shard of a `parallel_convert`
+    run. The model inputs come back as numpy arrays, the wordpieces (needed
+    for the output file) as a list under "tokens"."""
+    features = convert_examples_to_features(
+        examples=examples, seq_length=seq_length, tokenizer=tokenizer)
+    arrays = features_to_arrays(features, {'unique_id': np.int64,
+                                           'input_ids': np.int64,
+                                           'input_mask': np.int64})
+    arrays['tokens'] = [f.tokens for f in features]
+    return arrays
+
+
 def _truncate_seq_pair(tokens_a, tokens_b, max_length):
     """Truncates a sequence pair in place to the maximum length."""
 
@@ -205,6 +221,8 @@ def main():
                         help="The maximum total input sequence length after WordPiece tokenization. Sequences longer "
                             "than this will be truncated, and sequences shorter than this will be padded.")
     parser.add_argument("--batch_size", default=32, type=int, help="Batch size for predictions.")
+    parser.add_argument("--preprocessing_num_workers", default=1, type=int,
+                        help="Number of processes used to convert the examples into features.")
     parser.add_argument("--local_rank",
                         type=int,
                         default=-1,
@@ -231,12 +249,11 @@ def main():
 
     examples = read_examples(args.input_file)
 
-    features = convert_examples_to_features(
-        examples=examples, seq_length=args.max_seq_length, tokenizer=tokenizer)
-
-    unique_id_to_feature = {}
-    for feature in features:
-        unique_id_to_feature[feature.unique_id] = feature
+    convert_fn = functools.partial(convert_examples_to_arrays,
+                                   seq_length=args.max_seq_length, tokenizer=tokenizer)
+    shards = parallel_convert(convert_fn, examples, args.preprocessing_num_workers)
+    all_tokens = [tokens for shard in shards for tokens in shard.pop('tokens')]
+    features = concatenate_arrays(shards)
 
     model = BertModel.from_pretrained(args.bert_model)
     model.to(device)
@@ -247,8 +264,8 @@ def main():
     elif n_gpu > 1:
         model = torch.nn.DataParallel(model)
 
-    all_input_ids = torch.tensor([f.input_ids for f in features], dtype=torch.long)
-    all_input_mask = torch.tensor([f.input_mask for f in features], dtype=torch.long)
+    all_input_ids = torch.from_numpy(features['input_ids'])
+    all_input_mask = torch.from_numpy(features['input_mask'])
     all_example_index = torch.arange(all_input_ids.size(0), dtype=torch.long)
 
     eval_data = TensorDataset(all_input_ids, all_input_mask, all_example_index)
@@ -268,13 +285,11 @@ def main():
             all_encoder_layers = all_encoder_layers
 
             for b, example_index in enumerate(example_indices):
-                feature = features[example_index.item()]
-                unique_id = int(feature.unique_id)
-                # feature = unique_id_to_feature[unique_id]
+                unique_id = int(features['unique_id'][example_index.item()])
                 output_json = collections.OrderedDict()
                 output_json["linex_index"] = unique_id
                 all_out_features = []
-                for (i, token) in enumerate(feature.tokens):
+                for (i, token) in enumerate(all_tokens[example_index.item()]):
                     all_layers = []
                     for (j, layer_index) in enumerate(layer_indexes):
                         layer_output = all_encoder_layers[int(layer_index)].detach().cpu().numpy()
@@ -19,6 +19,7 @@ from __future__ import absolute_import, division, print_function
 
 import argparse
 import csv
+import functools
 import logging
 import os
 import random
@@ -35,6 +36,8 @@ from torch.nn import CrossEntropyLoss, MSELoss
 from scipy.stats import pearsonr, spearmanr
 from sklearn.metrics import matthews_corrcoef, f1_score
 
+from pytorch_pretrained_bert.data_utils import (ArrayAccumulator, concatenate_arrays, features_to_arrays,
+                                                parallel_convert)
 from pytorch_pretrained_bert.file_utils import PYTORCH_PRETRAINED_BERT_CACHE, WEIGHTS_NAME, CONFIG_NAME
 from pytorch_pretrained_bert.modeling import BertForSequenceClassification, BertConfig
 from pytorch_pretrained_bert.tokenization import BertTokenizer
@@ -494,6 +497,31 @@ def convert_examples_to_features(examples, label_list, max_seq_length,
     return features
 
 
+def convert_examples_to_arrays(examples, shard_start, label_list, max_seq_length,
+                               tokenizer, output_mode):
+    """Runs `convert_examples_to_features` on one shard of a `parallel_convert`
+    run and packs the features into numpy arrays."""
+    features = convert_examples_to_features(examples, label_list, max_seq_length,
+                                            tokenizer, output_mode)
+    label_dtype = np.float32 if output_mode == "regression" else np.int64
+    return features_to_arrays(features, {'input_ids': np.int64,
+                                         'input_mask': np.int64,
+                                         'segment_ids': np.int64,
+                                         'label_id': label_dtype})
+
+
+def convert_examples_to_tensors(examples, label_list, max_seq_length,
+                                tokenizer, output_mode, num_workers=1):
+    """Converts `examples` into (input_ids, input_mask, segment_ids, label_ids)
+    tensors, sharding the work over `num_workers` processes."""
+    convert_fn = functools.partial(convert_examples_to_arrays, label_list=label_list,
+                                   max_seq_length=max_seq_length, tokenizer=tokenizer,
+                                   output_mode=output_mode)
+    arrays = concatenate_arrays(parallel_convert(convert_fn, examples, num_workers))
+    return tuple(torch.from_numpy(arrays[name])
+                 for name in ('input_ids', 'input_mask', 'segment_ids', 'label_id'))
+
+
 def _truncate_seq_pair(tokens_a, tokens_b, max_length):
     """Truncates a sequence pair in place to the maximum length."""
 
@@ -605,6 +633,10 @@ def main():
     parser.add_argument("--do_lower_case",
                         action='store_true',
                         help="Set this flag if you are using an uncased model.")
+    parser.add_argument("--preprocessing_num_workers",
+                        default=1,
+                        type=int,
+                        help="Number of processes used to convert the examples into features.")
     parser.add_argument("--train_batch_size",
                         default=32,
                         type=int,
@@ -795,20 +827,13 @@ def main():
     nb_tr_steps = 0
     tr_loss = 0
     if args.do_train:
-        train_features = convert_examples_to_features(
-            train_examples, label_list, args.max_seq_length, tokenizer, output_mode)
+        all_input_ids, all_input_mask, all_segment_ids, all_label_ids = convert_examples_to_tensors(
+            train_examples, label_list, args.max_seq_length, tokenizer, output_mode,
+            args.preprocessing_num_workers)
         logger.info("***** Running training *****")
         logger.info("  Num examples = %d", len(train_examples))
         logger.info("  Batch size = %d", args.train_batch_size)
         logger.info("  Num steps = %d", num_train_optimization_steps)
-        all_input_ids = torch.tensor([f.input_ids for f in train_features], dtype=torch.long)
-        all_input_mask = torch.tensor([f.input_mask for f in train_features], dtype=torch.long)
-        all_segment_ids = torch.tensor([f.segment_ids for f in train_features], dtype=torch.long)
-
-        if output_mode == "classification":
-            all_label_ids = torch.tensor([f.label_id for f in train_features], dtype=torch.long)
-        elif output_mode == "regression":
-            all_label_ids = torch.tensor([f.label_id for f in train_features], dtype=torch.float)
 
         train_data = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids)
         if args.local_rank == -1:
@@ -880,19 +905,12 @@ def main():
 
     if args.do_eval and (args.local_rank == -1 or torch.distributed.get_rank() == 0):
         eval_examples = processor.get_dev_examples(args.data_dir)
-        eval_features = convert_examples_to_features(
-            eval_examples, label_list, args.max_seq_length, tokenizer, output_mode)
+        all_input_ids, all_input_mask, all_segment_ids, all_label_ids = convert_examples_to_tensors(
+            eval_examples, label_list, args.max_seq_length, tokenizer, output_mode,
+            args.preprocessing_num_workers)
         logger.info("***** Running evaluation *****")
         logger.info("  Num examples = %d", len(eval_examples))
         logger.info("  Batch size = %d", args.eval_batch_size)
-        all_input_ids = torch.tensor([f.input_ids for f in eval_features], dtype=torch.long)
-        all_input_mask = torch.tensor([f.input_mask for f in eval_features], dtype=torch.long)
-        all_segment_ids = torch.tensor([f.segment_ids for f in eval_features], dtype=torch.long)
-
-        if output_mode == "classification":
-            all_label_ids = torch.tensor([f.label_id for f in eval_features], dtype=torch.long)
-        elif output_mode == "regression":
-            all_label_ids = torch.tensor([f.label_id for f in eval_features], dtype=torch.float)
 
         eval_data = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids)
         # Run prediction for full data
@@ -902,7 +920,7 @@ def main():
         model.eval()
         eval_loss = 0
         nb_eval_steps = 0
-        preds = []
+        preds = ArrayAccumulator(len(eval_data))
 
         for input_ids, input_mask, segment_ids, label_ids in tqdm(eval_dataloader, desc="Evaluating"):
             input_ids = input_ids.to(device)
@@ -923,14 +941,10 @@ def main():
             
             eval_loss += tmp_eval_loss.mean().item()
             nb_eval_steps += 1
-            if len(preds) == 0:
-                preds.append(logits.detach().cpu().numpy())
-            else:
-                preds[0] = np.append(
-                    preds[0], logits.detach().cpu().numpy(), axis=0)
+            preds.add(logits)
 
         eval_loss = eval_loss / nb_eval_steps
-        preds = preds[0]
+        preds = preds.result()
         if output_mode == "classification":
             preds = np.argmax(preds, axis=1)
         elif output_mode == "regression":
@@ -960,15 +974,12 @@ def main():
                 os.makedirs(args.output_dir + '-MM')
 
             eval_examples = processor.get_dev_examples(args.data_dir)
-            eval_features = convert_examples_to_features(
-                eval_examples, label_list, args.max_seq_length, tokenizer, output_mode)
+            all_input_ids, all_input_mask, all_segment_ids, all_label_ids = convert_examples_to_tensors(
+                eval_examples, label_list, args.max_seq_length, tokenizer, output_mode,
+                args.preprocessing_num_workers)
             logger.info("***** Running evaluation *****")
             logger.info("  Num examples = %d", len(eval_examples))
             logger.info("  Batch size = %d", args.eval_batch_size)
-            all_input_ids = torch.tensor([f.input_ids for f in eval_features], dtype=torch.long)
-            all_input_mask = torch.tensor([f.input_mask for f in eval_features], dtype=torch.long)
-            all_segment_ids = torch.tensor([f.segment_ids for f in eval_features], dtype=torch.long)
-            all_label_ids = torch.tensor([f.label_id for f in eval_features], dtype=torch.long)
 
             eval_data = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids)
             # Run prediction for full data
@@ -978,7 +989,7 @@ def main():
             model.eval()
             eval_loss = 0
             nb_eval_steps = 0
-            preds = []
+            preds = ArrayAccumulator(len(eval_data))
 
             for input_ids, input_mask, segment_ids, label_ids in tqdm(eval_dataloader, desc="Evaluating"):
                 input_ids = input_ids.to(device)
@@ -994,14 +1005,10 @@ def main():
             
                 eval_loss += tmp_eval_loss.mean().item()
                 nb_eval_steps += 1
-                if len(preds) == 0:
-                    preds.append(logits.detach().cpu().numpy())
-                else:
-                    preds[0] = np.append(
-                        preds[0], logits.detach().cpu().numpy(), axis=0)
+                preds.add(logits)
 
             eval_loss = eval_loss / nb_eval_steps
-            preds = preds[0]
+            preds = preds.result()
             preds = np.argmax(preds, axis=1)
             result = compute_metrics(task_name, preds, all_label_ids.numpy())
             loss = tr_loss/nb_tr_steps if args.do_train else None
@@ -19,6 +19,7 @@ from __future__ import absolute_import, division, print_function
 
 import argparse
 import collections
+import functools
 import json
 import logging
 import math
@@ -34,6 +35,7 @@ from torch.utils.data import (DataLoader, RandomSampler, SequentialSampler,
 from torch.utils.data.distributed import DistributedSampler
 from tqdm import tqdm, trange
 
+from pytorch_pretrained_bert.data_utils import concatenate_arrays, features_to_arrays, parallel_convert
 from pytorch_pretrained_bert.file_utils import PYTORCH_PRETRAINED_BERT_CACHE, WEIGHTS_NAME, CONFIG_NAME
 from pytorch_pretrained_bert.modeling import BertForQuestionAnswering, BertConfig
 from pytorch_pretrained_bert.optimization import BertAdam, warmup_linear
@@ -360,6 +362,33 @@ def convert_examples_to_features(examples, tokenizer, max_seq_length,
     return features
 
 
+TRAIN_FEATURE_FIELDS = ('input_ids', 'input_mask', 'segment_ids', 'start_position', 'end_position')
+
+
+def convert_examples_to_train_arrays(examples, shard_start, tokenizer, max_seq_length,
+                                     doc_stride, max_query_length):
+    """Runs `convert_examples_to_features` on one shard of a `parallel_convert`
+    run and keeps only what training needs, as numpy arrays."""
+    features = convert_examples_to_features(
+        examples=examples,
+        tokenizer=tokenizer,
+        max_seq_length=max_seq_length,
+        doc_stride=doc_stride,
+        max_query_length=max_query_length,
+        is_training=True)
+    return features_to_arrays(features, dict((name, np.int64) for name in TRAIN_FEATURE_FIELDS))
+
+
+def convert_examples_to_features_shard(examples, shard_start, **kwargs):
+    """Runs `convert_examples_to_features` on one shard of a `parallel_convert`
+    run. `example_index` is shifted to index the full list of examples; the
+    `unique_id`s are renumbered once all shards are back."""
+    features = convert_examples_to_features(examples, **kwargs)
+    for feature in features:
+        feature.example_index += shard_start
+    return features
+
+
 def _improve_answer_span(doc_tokens, input_start, input_end, tokenizer,
                          orig_answer_text):
     """Returns tokenized answer spans that better match the annotated answer."""
@@ -816,6 +845,10 @@ def main():
     parser.add_argument("--do_lower_case",
                         action='store_true',
                         help="Whether to lower case the input text. True for uncased models, False for cased models.")
+    parser.add_argument("--preprocessing_num_workers",
+                        default=1,
+                        type=int,
+                        help="Number of processes used to convert the examples into features.")
     parser.add_argument("--local_rank",
                         type=int,
                         default=-1,
@@ -959,32 +992,33 @@ def main():
     if args.do_train:
         cached_train_features_file = args.train_file+'_{0}_{1}_{2}_{3}'.format(
             list(filter(None, args.bert_model.split('/'))).pop(), str(args.max_seq_length), str(args.doc_stride), str(args.max_query_length))
-        train_features = None
+        train_arrays = None
         try:
             with open(cached_train_features_file, "rb") as reader:
-                train_features = pickle.load(reader)
+                train_arrays = pickle.load(reader)
+            if isinstance(train_arrays, list):
+                # cache written as a list of InputFeatures by an older version of this script
+                train_arrays = features_to_arrays(
+                    train_arrays, dict((name, np.int64) for name in TRAIN_FEATURE_FIELDS))
         except:
-            train_features = convert_examples_to_features(
-                examples=train_examples,
-                tokenizer=tokenizer,
-                max_seq_length=args.max_seq_length,
-                doc_stride=args.doc_stride,
-                max_query_length=args.max_query_length,
-                is_training=True)
+            convert_fn = functools.partial(convert_examples_to_train_arrays,
+                                           tokenizer=tokenizer,
+                                           max_seq_length=args.max_seq_length,
+                                           doc_stride=args.doc_stride,
+                                           max_query_length=args.max_query_length)
+            train_arrays = concatenate_arrays(
+                parallel_convert(convert_fn, train_examples, args.preprocessing_num_workers))
             if args.local_rank == -1 or torch.distributed.get_rank() == 0:
                 logger.info("  Saving train features into cached file %s", cached_train_features_file)
                 with open(cached_train_features_file, "wb") as writer:
-                    pickle.dump(train_features, writer)
+                    pickle.dump(train_arrays, writer)
         logger.info("***** Running training *****")
         logger.info("  Num orig examples = %d", len(train_examples))
-        logger.info("  Num split examples = %d", len(train_features))
+        logger.info("  Num split examples = %d", len(train_arrays['input_ids']))
         logger.info("  Batch size = %d", args.train_batch_size)
         logger.info("  Num steps = %d", num_train_optimization_steps)
-        all_input_ids = torch.tensor([f.input_ids for f in train_features], dtype=torch.long)
-        all_input_mask = torch.tensor([f.input_mask for f in train_features], dtype=torch.long)
-        all_segment_ids = torch.tensor([f.segment_ids for f in train_features], dtype=torch.long)
-        all_start_positions = torch.tensor([f.start_position for f in train_features], dtype=torch.long)
-        all_end_positions = torch.tensor([f.end_position for f in train_features], dtype=torch.long)
+        all_input_ids, all_input_mask, all_segment_ids, all_start_positions, all_end_positions = (
+            torch.from_numpy(train_arrays[name]) for name in TRAIN_FEATURE_FIELDS)
         train_data = TensorDataset(all_input_ids, all_input_mask, all_segment_ids,
                                    all_start_positions, all_end_positions)
         if args.local_rank == -1:
@@ -1043,13 +1077,16 @@ def main():
     if args.do_predict and (args.local_rank == -1 or torch.distributed.get_rank() == 0):
         eval_examples = read_squad_examples(
             input_file=args.predict_file, is_training=False, version_2_with_negative=args.version_2_with_negative)
-        eval_features = convert_examples_to_features(
-            examples=eval_examples,
-            tokenizer=tokenizer,
-            max_seq_length=args.max_seq_length,
-            doc_stride=args.doc_stride,
-            max_query_length=args.max_query_length,
-            is_training=False)
+        convert_fn = functools.partial(convert_examples_to_features_shard,
+                                       tokenizer=tokenizer,
+                                       max_seq_length=args.max_seq_length,
+                                       doc_stride=args.doc_stride,
+                                       max_query_length=args.max_query_length,
+                                       is_training=False)
+        eval_features = [feature for shard in parallel_convert(convert_fn, eval_examples, args.preprocessing_num_workers)
+                         for feature in shard]
+        for (unique_id, feature) in enumerate(eval_features, 1000000000):
+            feature.unique_id = unique_id
 
         logger.info("***** Running predictions *****")
         logger.info("  Num orig examples = %d", len(eval_examples))
@@ -0,0 +1,136 @@
+"""ONNX export of a fine-tuned OffensEval model, checked against PyTorch on the test set.
+
+Writes the `BertForSequenceClassification` of --bert_model, with its three
+classifier heads, to --output_file (batch and sequence axes dynamic). With
+--test_data the test set is then run through the PyTorch model and the ONNX
+Runtime session the same way as `test_semeval.py --do_test`: the largest logit
+difference of every head and the prediction agreement are checked against
+--atol, and the CPU throughput of both backends is reported.
+
+python export_onnx.py --bert_model {model dir} --output_file {model dir}/model.onnx
+python export_onnx.py --bert_model {model dir} --output_file {model dir}/model.onnx --test_data {folder to data}/testset-levela.tsv --do_lower_case
+python test_semeval.py --task_name semeval --do_test --backend onnxruntime --onnx_model {model dir}/model.onnx ...
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import logging
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import TensorDataset
+
+from pytorch_pretrained_bert.data_utils import ArrayAccumulator
+from pytorch_pretrained_bert.modeling import BertForSequenceClassification
+from pytorch_pretrained_bert.onnx_utils import OnnxSequenceClassifier, export_onnx
+from pytorch_pretrained_bert.tokenization import BertTokenizer
+from test_semeval import (FEATURE_FIELDS, SUBTASK_LABELS, SUBTASKS, SemevalProcessor, get_dataloader,
+						  load_features, restore_order)
+
+logger = logging.getLogger(__name__)
+
+
+def predict(model, dataloader):
+	"""Logits of every head in the order of the dataset, and the seconds it took."""
+	preds = [ArrayAccumulator(len(dataloader.dataset)) for _ in SUBTASK_LABELS]
+	start = time.perf_counter()
+	for input_ids, input_mask, segment_ids in dataloader:
+		with torch.no_grad():
+			logits = model(input_ids, segment_ids, input_mask)
+		for pred, logit in zip(preds, logits):
+			pred.add(logit)
+	elapsed = time.perf_counter() - start
+	return [restore_order(pred.result(), dataloader) for pred in preds], elapsed
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--bert_model", default=None, type=str, required=True,
+						help="Folder of the model fine-tuned by test_semeval.py.")
+	parser.add_argument("--output_file", default=None, type=str, required=True,
+						help="Where to write the ONNX graph.")
+	parser.add_argument("--opset_version", default=14, type=int,
+						help="ONNX opset of the export.")
+	parser.add_argument("--fused_qkv", action='store_true',
+						help="Export with one fused query/key/value projection per layer.")
+	parser.add_argument("--test_data", default=None, type=str,
+						help="A test tsv (id and tweet) to check the export on and time both backends with.")
+	parser.add_argument("--do_lower_case", action='store_true',
+						help="Set this flag if you are using an uncased model.")
+	parser.add_argument("--max_seq_length", default=80, type=int,
+						help="The maximum total input sequence length after WordPiece tokenization, as in training.")
+	parser.add_argument("--eval_batch_size", default=64, type=int,
+						help="Total batch size for the test set.")
+	parser.add_argument("--atol", default=1e-4, type=float,
+						help="Largest logit difference allowed between PyTorch and ONNX Runtime.")
+	parser.add_argument("--num_threads", default=0, type=int,
+						help="Threads of both backends, 0 keeps their defaults.")
+	parser.add_argument("--features_cache_dir", default=None, type=str,
+						help="See test_semeval.py.")
+	parser.add_argument("--no_features_cache", action='store_true',
+						help="See test_semeval.py.")
+	parser.add_argument("--preprocessing_num_workers", default=1, type=int,
+						help="See test_semeval.py.")
+	parser.add_argument("--no_bucketing", action='store_true',
+						help="See test_semeval.py.")
+	parser.add_argument('--seed', type=int, default=42,
+						help="random seed for initialization")
+	parser.set_defaults(local_rank=-1)
+	args = parser.parse_args()
+
+	logging.basicConfig(format = '%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+						datefmt = '%m/%d/%Y %H:%M:%S',
+						level = logging.INFO)
+	if args.num_threads > 0:
+		torch.set_num_threads(args.num_threads)
+
+	model_kwargs = {'fused_qkv': True} if args.fused_qkv else {}
+	model = BertForSequenceClassification.from_pretrained(
+		args.bert_model, num_labels=[len(labels) for labels in SUBTASK_LABELS], **model_kwargs)
+	model.eval()
+	export_onnx(model, args.output_file, args.opset_version)
+	if args.test_data is None:
+		return
+
+	processor = SemevalProcessor()
+	tokenizer = BertTokenizer.from_pretrained(args.bert_model, do_lower_case=args.do_lower_case)
+	features = load_features(args.test_data, "test", lambda: processor.get_test_examples(args.test_data),
+							 processor.get_labels(), tokenizer, args, "multi_classification")
+	all_input_ids, all_input_mask, all_segment_ids = (
+		torch.from_numpy(features[name]) for name in FEATURE_FIELDS[:3])
+	test_data = TensorDataset(all_input_ids, all_input_mask, all_segment_ids)
+	test_dataloader = get_dataloader(test_data, all_input_mask, args.eval_batch_size, False, args)
+
+	backends = [('pytorch', model), ('onnxruntime', OnnxSequenceClassifier(args.output_file, args.num_threads))]
+	results = {}
+	for name, backend in backends:
+		# the first batches pay for the allocations and the graph optimizations
+		for i, batch in enumerate(test_dataloader):
+			if i == 2:
+				break
+			with torch.no_grad():
+				backend(batch[0], batch[2], batch[1])
+		results[name] = predict(backend, test_dataloader)
+
+	print("{} tweets, batch size {}".format(len(test_data), args.eval_batch_size))
+	print("{:<12}{:>10}{:>12}".format("backend", "test s", "tweets/s"))
+	for name, _ in backends:
+		elapsed = results[name][1]
+		print("{:<12}{:>10.2f}{:>12.1f}".format(name, elapsed, len(test_data) / elapsed))
+	print()
+	max_diffs = [np.abs(a - b).max() for a, b in zip(results['pytorch'][0], results['onnxruntime'][0])]
+	agreement = [np.mean(a.argmax(axis=-1) == b.argmax(axis=-1))
+				 for a, b in zip(results['pytorch'][0], results['onnxruntime'][0])]
+	print("max |logit difference| " + "  ".join(
+		"{} {:.2e}".format(task, diff) for task, diff in zip(SUBTASKS, max_diffs)))
+	print("prediction agreement " + "  ".join(
+		"{} {:.4f}".format(task, a) for task, a in zip(SUBTASKS, agreement)))
+	if max(max_diffs) > args.atol:
+		raise ValueError("ONNX Runtime differs from PyTorch by {:g}, more than --atol {:g}.".format(
+			max(max_diffs), args.atol))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,162 @@
+"""Streaming OffensEval predictions with a model fine-tuned by test_semeval.py.
+
+Reads a tsv with `id` and `tweet` columns from a file or stdin, `--chunk_size`
+rows at a time, and writes the subtask a, b and c predictions of every tweet
+together with the probabilities of each head, in one pass over the input. Only
+one chunk is held in memory, so the memory use does not grow with the input.
+The b and c columns are what those heads predict for the tweet, whatever the
+prediction of subtask a.
+
+python predict_semeval.py --bert_model {model dir} --do_lower_case --input_file {input file} --output_file {output file}
+zcat tweets.tsv.gz | python predict_semeval.py --bert_model {model dir} --do_lower_case > preds.tsv
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import logging
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+
+from pytorch_pretrained_bert.data_utils import features_to_arrays
+from pytorch_pretrained_bert.modeling import BertForSequenceClassification
+from pytorch_pretrained_bert.tokenization import BertTokenizer
+from test_semeval import FEATURE_DTYPES, SUBTASK_LABELS, SemevalProcessor, convert_examples_to_features
+
+logger = logging.getLogger(__name__)
+
+
+def predict_chunk(model, arrays, batch_size, device):
+	"""Returns the probabilities of every head for the feature `arrays` of one chunk.
+
+	The rows are run shortest first, in batches trimmed to their longest
+	sequence, and the probabilities are written back in the input order.
+	"""
+	lengths = arrays['input_mask'].sum(axis=1)
+	order = np.argsort(lengths, kind='mergesort')
+	probs = [np.empty((len(order), len(labels)), dtype=np.float32) for labels in SUBTASK_LABELS]
+	for start in range(0, len(order), batch_size):
+		index = order[start:start + batch_size]
+		max_len = int(lengths[index].max())
+		input_ids, input_mask, segment_ids = (
+			torch.from_numpy(arrays[name][index, :max_len]).long().to(device)
+			for name in ('input_ids', 'input_mask', 'segment_ids'))
+		with torch.no_grad():
+			logits = model(input_ids, segment_ids, input_mask)
+		for prob, logit in zip(probs, logits):
+			prob[index] = F.softmax(logit.float(), dim=-1).cpu().numpy()
+	return probs
+
+
+class SemevalPredictor(object):
+	"""The tokenizer and the fine-tuned model, loaded once, for predictions a few tweets at a time.
+
+	`predict_frame` takes a frame of `id` and `tweet` columns and runs it through the same
+	`remove_emoji` and WordPiece tokenization as test_semeval.py. It returns the probabilities of
+	the three heads, in the order of the rows. NN/serve.py uses this class as its BERT backend.
+	"""
+	def __init__(self, bert_model, do_lower_case, max_seq_length=80, batch_size=64,
+				 no_cuda=False, int8=False, **model_kwargs):
+		# convert_examples_to_features logs a few examples of every call
+		logging.getLogger('test_semeval').setLevel(logging.WARNING)
+		self.processor = SemevalProcessor()
+		self.label_list = self.processor.get_labels()
+		self.max_seq_length = max_seq_length
+		self.batch_size = batch_size
+		self.tokenizer = BertTokenizer.from_pretrained(bert_model, do_lower_case=do_lower_case)
+		self.model = BertForSequenceClassification.from_pretrained(
+			bert_model, num_labels=[len(labels) for labels in SUBTASK_LABELS], **model_kwargs)
+		if int8 and not getattr(self.model.config, 'quantized', False):
+			self.model.quantize()
+		# quantized Linear layers only run on the CPU
+		use_cuda = torch.cuda.is_available() and not no_cuda and not getattr(self.model.config, 'quantized', False)
+		self.device = torch.device("cuda" if use_cuda else "cpu")
+		self.model.to(self.device)
+		self.model.eval()
+
+	def predict_frame(self, data):
+		examples = self.processor.create_test_examples(data)
+		features = convert_examples_to_features(examples, self.label_list, self.max_seq_length,
+												self.tokenizer, "multi_classification")
+		return predict_chunk(self.model, features_to_arrays(features, FEATURE_DTYPES), self.batch_size, self.device)
+
+	def predict(self, tweets):
+		"""Probabilities of the three heads for a list of raw tweets."""
+		return self.predict_frame(pd.DataFrame({'id': range(len(tweets)), 'tweet': tweets}))
+
+
+def write_chunk(writer, ids, probs):
+	preds = [prob.argmax(axis=-1) for prob in probs]
+	for i, guid in enumerate(ids):
+		columns = [str(guid)]
+		columns.extend(labels[pred[i]] for labels, pred in zip(SUBTASK_LABELS, preds))
+		columns.extend('{:.6f}'.format(p) for prob in probs for p in prob[i])
+		writer.write('\t'.join(columns) + '\n')
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--bert_model", default=None, type=str, required=True,
+						help="Folder of the model fine-tuned by test_semeval.py (weights, config and vocab).")
+	parser.add_argument("--input_file", default='-', type=str,
+						help="tsv file with `id` and `tweet` columns, `-` for stdin.")
+	parser.add_argument("--output_file", default='-', type=str,
+						help="Where to write the predictions, `-` for stdout.")
+	parser.add_argument("--do_lower_case", action='store_true',
+						help="Set this flag if you are using an uncased model.")
+	parser.add_argument("--max_seq_length", default=80, type=int,
+						help="The maximum total input sequence length after WordPiece tokenization, as in training.")
+	parser.add_argument("--batch_size", default=64, type=int,
+						help="Number of tweets per forward pass.")
+	parser.add_argument("--chunk_size", default=10000, type=int,
+						help="Number of tweets read, tokenized and written at a time.")
+	parser.add_argument("--no_cuda", action='store_true',
+						help="Whether not to use CUDA when available")
+	parser.add_argument("--fused_qkv", action='store_true',
+						help="Compute query, key and value with one fused projection per layer.")
+	parser.add_argument("--unpad", action='store_true',
+						help="Run the dense layers of the encoder on the real tokens only, without the padding.")
+	parser.add_argument("--int8", action='store_true',
+						help="Dynamically quantize the Linear layers to int8 (CPU only).")
+	args = parser.parse_args()
+
+	logging.basicConfig(format = '%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+						datefmt = '%m/%d/%Y %H:%M:%S',
+						level = logging.INFO)
+
+	model_kwargs = {}
+	if args.fused_qkv:
+		model_kwargs['fused_qkv'] = True
+	if args.unpad:
+		model_kwargs['unpad_input'] = True
+	predictor = SemevalPredictor(args.bert_model, args.do_lower_case, args.max_seq_length, args.batch_size,
+								 no_cuda=args.no_cuda, int8=args.int8, **model_kwargs)
+
+	reader = pd.read_csv(sys.stdin if args.input_file == '-' else args.input_file,
+						 sep='\t', chunksize=args.chunk_size)
+	writer = sys.stdout if args.output_file == '-' else open(args.output_file, 'w', encoding='utf-8')
+	try:
+		header = ['id', 'subtask_a', 'subtask_b', 'subtask_c']
+		header.extend('p_' + label for labels in SUBTASK_LABELS for label in labels)
+		writer.write('\t'.join(header) + '\n')
+
+		n_rows = 0
+		start = time.time()
+		for chunk in reader:
+			probs = predictor.predict_frame(chunk)
+			write_chunk(writer, chunk['id'].tolist(), probs)
+			writer.flush()
+			n_rows += len(chunk)
+			logger.info("%d tweets done, %.1f tweets/s", n_rows, n_rows / (time.time() - start))
+	finally:
+		if writer is not sys.stdout:
+			writer.close()
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,124 @@
+# coding=utf-8
+# Copyright 2018 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Helpers shared by the example scripts to turn examples into model inputs."""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+import multiprocessing
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_worker_convert_fn = None
+
+
+def _init_worker(convert_fn):
+    global _worker_convert_fn
+    _worker_convert_fn = convert_fn
+
+
+def _convert_shard(shard_and_start):
+    shard, shard_start = shard_and_start
+    return _worker_convert_fn(shard, shard_start)
+
+
+def parallel_convert(convert_fn, examples, num_workers, shard_size=None):
+    """Runs `convert_fn` over consecutive shards of `examples` in a process pool.
+
+    `convert_fn(shard, shard_start)` gets a slice of `examples` and the index of
+    its first example; it must be picklable (a module level function or a
+    `functools.partial` of one) and should return compact objects such as numpy
+    arrays, since its result is sent back to the main process. The shard results
+    are returned as a list, in the order of the shards, so the output does not
+    depend on which worker finished first.
+
+    With `num_workers` <= 1 the conversion runs in-process as a single shard.
+    """
+    if num_workers <= 1 or len(examples) == 0:
+        return [convert_fn(examples, 0)]
+    if shard_size is None:
+        # a few shards per worker keeps the pool busy when shards take uneven time
+        shard_size = max(1, -(-len(examples) // (num_workers * 4)))
+    shards = [(examples[start:start + shard_size], start)
+              for start in range(0, len(examples), shard_size)]
+    logger.info("Converting %d examples in %d shards with %d workers",
+                len(examples), len(shards), num_workers)
+    pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(convert_fn,))
+    try:
+        return pool.map(_convert_shard, shards, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def features_to_arrays(features, fields):
+    """Packs the attributes of a list of feature objects into numpy arrays.
+
+    `fields` maps each attribute name to the numpy dtype of its array.
+    """
+    return dict((name, np.array([getattr(f, name) for f in features], dtype=dtype))
+                for name, dtype in fields.items())
+
+
+def concatenate_arrays(shards):
+    """Concatenates a list of dicts of arrays (as produced per shard) field by field."""
+    return dict((name, np.concatenate([shard[name] for shard in shards], axis=0))
+                for name in shards[0])
+
+
+class ArrayAccumulator(object):
+    """Collects the per-batch outputs of an eval loop into one array.
+
+    Each call to `add` takes a batch of rows, as a numpy array or a torch tensor
+    (moved to the CPU here). When the total number of rows `size` is known the
+    result is preallocated on the first batch and every batch is copied into
+    place; otherwise the batches are kept and concatenated once in `result`.
+    Either way each row is copied a bounded number of times, unlike growing an
+    array with `np.append`, which copies everything gathered so far on every batch.
+    """
+
+    def __init__(self, size=None):
+        self.size = size
+        self.array = None
+        self.chunks = []
+        self.offset = 0
+
+    def add(self, batch):
+        if hasattr(batch, 'detach'):
+            batch = batch.detach().cpu().numpy()
+        if self.size is None:
+            self.chunks.append(batch)
+        else:
+            if self.array is None:
+                self.array = np.empty((self.size,) + batch.shape[1:], dtype=batch.dtype)
+            if self.offset + len(batch) > self.size:
+                raise ValueError("More than {} rows added to the accumulator".format(self.size))
+            self.array[self.offset:self.offset + len(batch)] = batch
+        self.offset += len(batch)
+
+    def __len__(self):
+        return self.offset
+
+    def result(self):
+        """Returns the rows added so far as one array."""
+        if self.size is None:
+            if len(self.chunks) > 1:
+                self.chunks = [np.concatenate(self.chunks, axis=0)]
+            return self.chunks[0] if self.chunks else np.empty((0,))
+        if self.array is None:
+            return np.empty((0,))
+        return self.array[:self.offset]
@@ -131,6 +131,41 @@ def swish(x):
 ACT2FN = {"gelu": gelu, "relu": torch.nn.functional.relu, "swish": swish}
 
 
+def convert_qkv_weights(state_dict, fused_qkv):
+	""" Rewrites the attention projections of a state dict in place for a model
+		built with `fused_qkv` (or without): concatenates the query, key and value
+		weights and biases of every layer into `qkv`, or splits `qkv` back into three.
+	"""
+	projections = ('query', 'key', 'value')
+	for key in list(state_dict.keys()):
+		for param in ('weight', 'bias'):
+			if fused_qkv and key.endswith('.query.' + param):
+				prefix = key[:-len('query.' + param)]
+				parts = [state_dict.pop(prefix + name + '.' + param) for name in projections]
+				state_dict[prefix + 'qkv.' + param] = torch.cat(parts, dim=0)
+			elif not fused_qkv and key.endswith('.qkv.' + param):
+				prefix = key[:-len('qkv.' + param)]
+				for name, part in zip(projections, state_dict.pop(key).chunk(3, dim=0)):
+					state_dict[prefix + name + '.' + param] = part.contiguous()
+	return state_dict
+
+
+def unpad_tokens(hidden_states, token_indices):
+	""" Packs the rows of `hidden_states` [batch_size, seq_length, width] selected by
+		`token_indices` (flat positions) into [num_tokens, width].
+	"""
+	return hidden_states.reshape(-1, hidden_states.size(-1)).index_select(0, token_indices)
+
+
+def pad_tokens(tokens, token_indices, batch_size, seq_length):
+	""" Inverse of `unpad_tokens`: scatters `tokens` [num_tokens, width] back into a
+		[batch_size, seq_length, width] tensor, with zeros at the padded positions.
+	"""
+	padded = tokens.new_zeros(batch_size * seq_length, tokens.size(-1))
+	padded = padded.index_copy(0, token_indices, tokens)
+	return padded.view(batch_size, seq_length, tokens.size(-1))
+
+
 class BertConfig(object):
 	"""Configuration class to store the configuration of a `BertModel`.
 	"""
@@ -145,7 +180,10 @@ class BertConfig(object):
 				 attention_probs_dropout_prob=0.1,
 				 max_position_embeddings=512,
 				 type_vocab_size=2,
-				 initializer_range=0.02):
+				 initializer_range=0.02,
+				 fused_qkv=False,
+				 unpad_input=False,
+				 early_exit=False):
 		"""Constructs BertConfig.
 
 		Args:
@@ -169,6 +207,12 @@ class BertConfig(object):
 				`BertModel`.
 			initializer_range: The sttdev of the truncated_normal_initializer for
 				initializing all weight matrices.
+			fused_qkv: compute the query, key and value projections of each attention
+				layer with a single nn.Linear (`qkv`) instead of three.
+			unpad_input: run the dense layers of the encoder on the real tokens of the
+				batch only, packed into one sequence (see `BertEncoder`).
+			early_exit: give `BertForSequenceClassification` an exit classifier after
+				every encoder layer but the last one.
 		"""
 		if isinstance(vocab_size_or_config_json_file, str) or (sys.version_info[0] == 2
 						and isinstance(vocab_size_or_config_json_file, unicode)):
@@ -188,6 +232,9 @@ class BertConfig(object):
 			self.max_position_embeddings = max_position_embeddings
 			self.type_vocab_size = type_vocab_size
 			self.initializer_range = initializer_range
+			self.fused_qkv = fused_qkv
+			self.unpad_input = unpad_input
+			self.early_exit = early_exit
 		else:
 			raise ValueError("First argument must be either a vocabulary size (int)"
 							 "or the path to a pretrained model config file (str)")
@@ -285,9 +332,14 @@ class BertSelfAttention(nn.Module):
 		self.attention_head_size = int(config.hidden_size / config.num_attention_heads)
 		self.all_head_size = self.num_attention_heads * self.attention_head_size
 
-		self.query = nn.Linear(config.hidden_size, self.all_head_size)
-		self.key = nn.Linear(config.hidden_size, self.all_head_size)
-		self.value = nn.Linear(config.hidden_size, self.all_head_size)
+		self.fused_qkv = getattr(config, 'fused_qkv', False)
+		if self.fused_qkv:
+			# rows [0, all_head_size) are the query, then the key, then the value
+			self.qkv = nn.Linear(config.hidden_size, 3 * self.all_head_size)
+		else:
+			self.query = nn.Linear(config.hidden_size, self.all_head_size)
+			self.key = nn.Linear(config.hidden_size, self.all_head_size)
+			self.value = nn.Linear(config.hidden_size, self.all_head_size)
 
 		self.dropout = nn.Dropout(config.attention_probs_dropout_prob)
 
@@ -296,14 +348,26 @@ class BertSelfAttention(nn.Module):
 		x = x.view(*new_x_shape)
 		return x.permute(0, 2, 1, 3)
 
-	def forward(self, hidden_states, attention_mask):
-		mixed_query_layer = self.query(hidden_states)
-		mixed_key_layer = self.key(hidden_states)
-		mixed_value_layer = self.value(hidden_states)
-
-		query_layer = self.transpose_for_scores(mixed_query_layer)
-		key_layer = self.transpose_for_scores(mixed_key_layer)
-		value_layer = self.transpose_for_scores(mixed_value_layer)
+	def forward(self, hidden_states, attention_mask, packing=None):
+		if self.fused_qkv:
+			mixed_qkv_layer = self.qkv(hidden_states)
+			if packing is not None:
+				mixed_qkv_layer = pad_tokens(mixed_qkv_layer, *packing)
+			new_x_shape = mixed_qkv_layer.size()[:-1] + (3, self.num_attention_heads, self.attention_head_size)
+			# one permute to [3, batch, heads, seq, head_size] for the three of them
+			query_layer, key_layer, value_layer = mixed_qkv_layer.view(*new_x_shape).permute(2, 0, 3, 1, 4)
+		else:
+			mixed_query_layer = self.query(hidden_states)
+			mixed_key_layer = self.key(hidden_states)
+			mixed_value_layer = self.value(hidden_states)
+			if packing is not None:
+				mixed_query_layer = pad_tokens(mixed_query_layer, *packing)
+				mixed_key_layer = pad_tokens(mixed_key_layer, *packing)
+				mixed_value_layer = pad_tokens(mixed_value_layer, *packing)
+
+			query_layer = self.transpose_for_scores(mixed_query_layer)
+			key_layer = self.transpose_for_scores(mixed_key_layer)
+			value_layer = self.transpose_for_scores(mixed_value_layer)
 
 		# Take the dot product between "query" and "key" to get the raw attention scores.
 		attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
@@ -322,6 +386,8 @@ class BertSelfAttention(nn.Module):
 		context_layer = context_layer.permute(0, 2, 1, 3).contiguous()
 		new_context_layer_shape = context_layer.size()[:-2] + (self.all_head_size,)
 		context_layer = context_layer.view(*new_context_layer_shape)
+		if packing is not None:
+			context_layer = unpad_tokens(context_layer, packing[0])
 		return context_layer
 
 
@@ -345,8 +411,8 @@ class BertAttention(nn.Module):
 		self.self = BertSelfAttention(config)
 		self.output = BertSelfOutput(config)
 
-	def forward(self, input_tensor, attention_mask):
-		self_output = self.self(input_tensor, attention_mask)
+	def forward(self, input_tensor, attention_mask, packing=None):
+		self_output = self.self(input_tensor, attention_mask, packing)
 		attention_output = self.output(self_output, input_tensor)
 		return attention_output
 
@@ -387,27 +453,47 @@ class BertLayer(nn.Module):
 		self.intermediate = BertIntermediate(config)
 		self.output = BertOutput(config)
 
-	def forward(self, hidden_states, attention_mask):
-		attention_output = self.attention(hidden_states, attention_mask)
+	def forward(self, hidden_states, attention_mask, packing=None):
+		attention_output = self.attention(hidden_states, attention_mask, packing)
 		intermediate_output = self.intermediate(attention_output)
 		layer_output = self.output(intermediate_output, attention_output)
 		return layer_output
 
 
 class BertEncoder(nn.Module):
+	"""Stack of `BertLayer`s.
+
+	When `token_mask` ([batch_size, seq_length], 1 for real tokens) is given, the
+	real tokens of the batch are packed into one [num_tokens, hidden_size] sequence
+	and the dense layers (query/key/value, `BertSelfOutput`, `BertIntermediate`,
+	`BertOutput`) and the LayerNorms only run on those. The projections are
+	scattered back to [batch_size, seq_length] for the attention scores and the
+	context is packed again right after. The returned layers are padded back, with
+	zeros instead of the (masked, unused) values of the padded positions.
+	"""
 	def __init__(self, config):
 		super(BertEncoder, self).__init__()
 		layer = BertLayer(config)
 		self.layer = nn.ModuleList([copy.deepcopy(layer) for _ in range(config.num_hidden_layers)])
 
-	def forward(self, hidden_states, attention_mask, output_all_encoded_layers=True):
+	def forward(self, hidden_states, attention_mask, output_all_encoded_layers=True, token_mask=None):
+		packing = None
+		if token_mask is not None:
+			batch_size, seq_length = token_mask.size()
+			token_indices = token_mask.reshape(-1).nonzero().squeeze(1)
+			packing = (token_indices, batch_size, seq_length)
+			hidden_states = unpad_tokens(hidden_states, token_indices)
+
+		def output(hidden_states):
+			return hidden_states if packing is None else pad_tokens(hidden_states, *packing)
+
 		all_encoder_layers = []
 		for layer_module in self.layer:
-			hidden_states = layer_module(hidden_states, attention_mask)
+			hidden_states = layer_module(hidden_states, attention_mask, packing)
 			if output_all_encoded_layers:
-				all_encoder_layers.append(hidden_states)
+				all_encoder_layers.append(output(hidden_states))
 		if not output_all_encoded_layers:
-			all_encoder_layers.append(hidden_states)
+			all_encoder_layers.append(output(hidden_states))
 		return all_encoder_layers
 
 
@@ -426,6 +512,19 @@ class BertPooler(nn.Module):
 		return pooled_output
 
 
+class BertExitClassifier(nn.Module):
+	"""Pooler and classifier heads reading the output of an intermediate encoder layer."""
+	def __init__(self, config, num_labels):
+		super(BertExitClassifier, self).__init__()
+		self.pooler = BertPooler(config)
+		self.dropout = nn.Dropout(config.hidden_dropout_prob)
+		self.classifier = nn.ModuleList(nn.Linear(config.hidden_size, num_label) for num_label in num_labels)
+
+	def forward(self, hidden_states):
+		pooled_output = self.dropout(self.pooler(hidden_states))
+		return [classifier(pooled_output) for classifier in self.classifier]
+
+
 class BertPredictionHeadTransform(nn.Module):
 	def __init__(self, config):
 		super(BertPredictionHeadTransform, self).__init__()
@@ -548,9 +647,14 @@ class BertPreTrainedModel(nn.Module):
 			from_tf: should we load the weights from a locally saved TensorFlow checkpoint
 			cache_dir: an optional path to a folder in which the pre-trained models will be cached.
 			state_dict: an optional state dictionnary (collections.OrderedDict object) to use instead of Google pre-trained models
+			fused_qkv, unpad_input, early_exit: (keyword arguments) override these options of the model config.
+				The query/key/value weights of the checkpoint are concatenated (or split) to match
+				`fused_qkv` at load time.
 			*inputs, **kwargs: additional input for the specific Bert class
 				(ex: num_labels for BertForSequenceClassification)
 		"""
+		config_overrides = dict((name, kwargs.pop(name)) for name in ('fused_qkv', 'unpad_input', 'early_exit')
+								if name in kwargs)
 		if pretrained_model_name_or_path in PRETRAINED_MODEL_ARCHIVE_MAP:
 			archive_file = PRETRAINED_MODEL_ARCHIVE_MAP[pretrained_model_name_or_path]
 		else:
@@ -581,26 +685,20 @@ class BertPreTrainedModel(nn.Module):
 			logger.info("extracting archive file {} to temp dir {}".format(
 				resolved_archive_file, tempdir))
 			with tarfile.open(resolved_archive_file, 'r:gz') as archive:
-	def is_within_directory(directory, target):
-		
-		abs_directory = os.path.abspath(directory)
-		abs_target = os.path.abspath(target)
-	
-		prefix = os.path.commonprefix([abs_directory, abs_target])
-		
-		return prefix == abs_directory
-	
-	def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-	
-		for member in tar.getmembers():
-			member_path = os.path.join(path, member.name)
-			if not is_within_directory(path, member_path):
-				raise Exception("Attempted Path Traversal in Tar File")
-	
-		tar.extractall(path, members, numeric_owner=numeric_owner) 
-		
-	
-	safe_extract(archive, tempdir)
+				def is_within_directory(directory, target):
+					abs_directory = os.path.abspath(directory)
+					abs_target = os.path.abspath(target)
+					prefix = os.path.commonprefix([abs_directory, abs_target])
+					return prefix == abs_directory
+
+				def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
+					for member in tar.getmembers():
+						member_path = os.path.join(path, member.name)
+						if not is_within_directory(path, member_path):
+							raise Exception("Attempted Path Traversal in Tar File")
+					tar.extractall(path, members, numeric_owner=numeric_owner)
+
+				safe_extract(archive, tempdir)
 			serialization_dir = tempdir
 		# Load config
 		config_file = os.path.join(serialization_dir, CONFIG_NAME)
@@ -608,9 +706,14 @@ class BertPreTrainedModel(nn.Module):
 			# Backward compatibility with old naming format
 			config_file = os.path.join(serialization_dir, BERT_CONFIG_NAME)
 		config = BertConfig.from_json_file(config_file)
+		for name, value in config_overrides.items():
+			setattr(config, name, value)
 		logger.info("Model config {}".format(config))
 		# Instantiate model.
 		model = cls(config, *inputs, **kwargs)
+		if getattr(config, 'quantized', False):
+			# a checkpoint saved after `quantize()` holds packed int8 weights
+			model.quantize()
 		if state_dict is None and not from_tf:
 			weights_path = os.path.join(serialization_dir, WEIGHTS_NAME)
 			state_dict = torch.load(weights_path, map_location='cpu')
@@ -635,6 +738,7 @@ class BertPreTrainedModel(nn.Module):
 				new_keys.append(new_key)
 		for old_key, new_key in zip(old_keys, new_keys):
 			state_dict[new_key] = state_dict.pop(old_key)
+		convert_qkv_weights(state_dict, getattr(config, 'fused_qkv', False))
 
 		missing_keys = []
 		unexpected_keys = []
@@ -743,7 +847,8 @@ class BertModel(BertPreTrainedModel):
 		embedding_output = self.embeddings(input_ids, token_type_ids)
 		encoded_layers = self.encoder(embedding_output,
 									  extended_attention_mask,
-									  output_all_encoded_layers=output_all_encoded_layers)
+									  output_all_encoded_layers=output_all_encoded_layers,
+									  token_mask=attention_mask if getattr(self.config, 'unpad_input', False) else None)
 		sequence_output = encoded_layers[-1]
 		pooled_output = self.pooler(sequence_output)
 		if not output_all_encoded_layers:
@@ -989,6 +1094,19 @@ class BertForSequenceClassification(BertPreTrainedModel):
 	model = BertForSequenceClassification(config, num_labels)
 	logits = model(input_ids, token_type_ids, input_mask)
 	```
+
+	For CPU inference, `model.quantize()` converts the Linear layers of the encoder
+	and of the classifier heads to dynamic int8 (see `quantize`). Saving the
+	quantized model's state_dict and config gives a checkpoint that
+	`from_pretrained` loads back as a quantized model.
+
+	With `config.early_exit`, a `BertExitClassifier` reads the output of each encoder
+	layer but the last one. `output_all_exits=True` returns the logits of all the exits,
+	the last one being the regular classifier, to train them together. In eval mode,
+	setting `model.exit_threshold` makes every sample of a batch stop at the first exit
+	where the entropy of its first classifier head is below the threshold; the samples
+	still running go on to the next layer. `model.exit_counts[i]` counts the samples
+	that stopped after layer i + 1.
 	"""
 	def __init__(self, config, num_labels):
 		super(BertForSequenceClassification, self).__init__(config)
@@ -998,9 +1116,27 @@ class BertForSequenceClassification(BertPreTrainedModel):
 		
 		self.classifier = nn.ModuleList( nn.Linear(config.hidden_size, num_label) for num_label in num_labels ) 
 		
+		if getattr(config, 'early_exit', False):
+			self.exit_classifiers = nn.ModuleList(
+				BertExitClassifier(config, num_labels) for _ in range(config.num_hidden_layers - 1))
+			self.exit_threshold = None
+			self.exit_counts = [0] * config.num_hidden_layers
+
 		self.apply(self.init_bert_weights)
 
-	def forward(self, input_ids, token_type_ids=None, attention_mask=None, labels=None):
+	def forward(self, input_ids, token_type_ids=None, attention_mask=None, labels=None, output_all_exits=False):
+		if (output_all_exits or getattr(self, 'exit_threshold', None) is not None) and not hasattr(self, 'exit_classifiers'):
+			raise ValueError("output_all_exits and exit_threshold need a model built with config.early_exit.")
+		if output_all_exits:
+			encoded_layers, pooled_output = self.bert(input_ids, token_type_ids, attention_mask)
+			all_logits = [exit_classifier(hidden_states)
+						  for exit_classifier, hidden_states in zip(self.exit_classifiers, encoded_layers)]
+			pooled_output = self.dropout(pooled_output)
+			all_logits.append([classifier(pooled_output) for classifier in self.classifier])
+			return all_logits
+		if not self.training and getattr(self, 'exit_threshold', None) is not None:
+			return self._early_exit_forward(input_ids, token_type_ids, attention_mask)
+
 		_, pooled_output = self.bert(input_ids, token_type_ids, attention_mask, output_all_encoded_layers=False)
 		pooled_output = self.dropout(pooled_output)
 		
@@ -1009,6 +1145,60 @@ class BertForSequenceClassification(BertPreTrainedModel):
 			logits.append( self.classifier[i](pooled_output) )
 		return logits
 
+	def quantize(self):
+		""" Converts the model in place for int8 CPU inference.
+
+		The nn.Linear layers of the encoder (query/key/value, attention output,
+		intermediate and output dense layers) and of the `classifier` heads are
+		replaced by dynamically quantized ones: int8 weights, with the activations
+		quantized on the fly for each batch. Embeddings, LayerNorm and the pooler
+		stay in float32. The model must be on the CPU and is meant for inference only.
+		Sets `config.quantized` so that a saved checkpoint is loaded back quantized.
+		"""
+		modules = [self.bert.encoder, self.classifier]
+		if hasattr(self, 'exit_classifiers'):
+			modules.append(self.exit_classifiers)
+		for module in modules:
+			torch.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=True)
+		self.config.quantized = True
+		return self
+
+	def _early_exit_forward(self, input_ids, token_type_ids=None, attention_mask=None):
+		if attention_mask is None:
+			attention_mask = torch.ones_like(input_ids)
+		if token_type_ids is None:
+			token_type_ids = torch.zeros_like(input_ids)
+		extended_attention_mask = attention_mask.unsqueeze(1).unsqueeze(2)
+		extended_attention_mask = extended_attention_mask.to(dtype=next(self.parameters()).dtype)
+		extended_attention_mask = (1.0 - extended_attention_mask) * -10000.0
+
+		hidden_states = self.bert.embeddings(input_ids, token_type_ids)
+		logits = [hidden_states.new_zeros(input_ids.size(0), num_label) for num_label in self.num_labels]
+		# positions in the batch of the samples still running
+		running = torch.arange(input_ids.size(0), device=input_ids.device)
+		layers = self.bert.encoder.layer
+		for i, layer_module in enumerate(layers):
+			hidden_states = layer_module(hidden_states, extended_attention_mask)
+			if i == len(layers) - 1:
+				pooled_output = self.dropout(self.bert.pooler(hidden_states))
+				exit_logits = [classifier(pooled_output) for classifier in self.classifier]
+				done = torch.ones_like(running, dtype=torch.bool)
+			else:
+				exit_logits = self.exit_classifiers[i](hidden_states)
+				log_probs = nn.functional.log_softmax(exit_logits[0], dim=-1)
+				entropy = -(log_probs.exp() * log_probs).sum(dim=-1)
+				done = entropy < self.exit_threshold
+			if done.any():
+				for output, exit_logit in zip(logits, exit_logits):
+					output[running[done]] = exit_logit[done].to(output.dtype)
+				self.exit_counts[i] += int(done.sum())
+			if done.all():
+				break
+			running = running[~done]
+			hidden_states = hidden_states[~done]
+			extended_attention_mask = extended_attention_mask[~done]
+		return logits
+
 
 class BertForMultipleChoice(BertPreTrainedModel):
 	"""BERT model for multiple choice tasks.
@@ -0,0 +1,107 @@
+# coding=utf-8
+# Copyright 2018 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""ONNX export of `BertForSequenceClassification` and an ONNX Runtime model with the same call."""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import inspect
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+INPUT_NAMES = ['input_ids', 'token_type_ids', 'attention_mask']
+
+
+def output_names(num_heads):
+    return ['logits_{}'.format(i) for i in range(num_heads)]
+
+
+def export_onnx(model, output_file, opset_version=14):
+    """Writes `model`, a `BertForSequenceClassification`, to `output_file` as an ONNX graph.
+
+    The graph takes the int64 `input_ids`, `token_type_ids` and `attention_mask`
+    of shape [batch_size, sequence_length], both axes dynamic, and returns the
+    logits of every classifier head (`logits_0`, `logits_1`, ...) in the order of
+    `model.classifier`. The padded path of the encoder is exported: `unpad_input`
+    and `exit_threshold` are set aside during the export, the outputs are the same.
+    Quantized models are not supported.
+    """
+    if getattr(model.config, 'quantized', False):
+        raise ValueError("The int8 model can not be exported to ONNX, export the float32 one.")
+    device = next(model.parameters()).device
+    input_ids = torch.ones(2, 8, dtype=torch.long, device=device)
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[1, 4:] = 0
+    token_type_ids = torch.zeros_like(input_ids)
+
+    names = output_names(len(model.classifier))
+    dynamic_axes = dict((name, {0: 'batch_size', 1: 'sequence_length'}) for name in INPUT_NAMES)
+    dynamic_axes.update((name, {0: 'batch_size'}) for name in names)
+    kwargs = dict(input_names=INPUT_NAMES, output_names=names, dynamic_axes=dynamic_axes,
+                  opset_version=opset_version, do_constant_folding=True)
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript based exporter, the one that takes dynamic_axes
+        kwargs['dynamo'] = False
+
+    training = model.training
+    unpad_input = getattr(model.config, 'unpad_input', False)
+    exit_threshold = getattr(model, 'exit_threshold', None)
+    model.eval()
+    model.config.unpad_input = False
+    if exit_threshold is not None:
+        model.exit_threshold = None
+    try:
+        with torch.no_grad():
+            torch.onnx.export(model, (input_ids, token_type_ids, attention_mask), output_file, **kwargs)
+    finally:
+        model.train(training)
+        model.config.unpad_input = unpad_input
+        if exit_threshold is not None:
+            model.exit_threshold = exit_threshold
+    logger.info("Exported the model to %s", output_file)
+
+
+class OnnxSequenceClassifier(object):
+    """An ONNX graph written by `export_onnx`, run by ONNX Runtime on the CPU.
+
+    Called like `BertForSequenceClassification` in eval mode: the input ids,
+    token type ids and attention mask as tensors in, the list of the logits of
+    every head out, as float32 CPU tensors.
+    """
+
+    def __init__(self, onnx_file, num_threads=0):
+        try:
+            import onnxruntime
+        except ImportError:
+            logger.error("Running the model with ONNX Runtime requires onnxruntime to be installed, "
+                         "pip install onnxruntime.")
+            raise
+        options = onnxruntime.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(onnx_file, options, providers=['CPUExecutionProvider'])
+        self.output_names = [output.name for output in self.session.get_outputs()]
+
+    def __call__(self, input_ids, token_type_ids=None, attention_mask=None):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+        inputs = dict((name, tensor.detach().cpu().long().numpy())
+                      for name, tensor in zip(INPUT_NAMES, (input_ids, token_type_ids, attention_mask)))
+        return [torch.from_numpy(logits) for logits in self.session.run(self.output_names, inputs)]
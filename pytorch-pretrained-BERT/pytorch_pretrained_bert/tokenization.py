@@ -114,6 +114,30 @@ class BertTokenizer(object):
             split_tokens = self.wordpiece_tokenizer.tokenize(text)
         return split_tokens
 
+    def tokenize_batch(self, texts):
+        """Tokenizes a list of texts.
+
+        Gives the same result as `[self.tokenize(text) for text in texts]`, but
+        every distinct whitespace-separated word of the batch goes through
+        punctuation splitting and WordPiece only once.
+        """
+        if not self.do_basic_tokenize:
+            return [self.wordpiece_tokenizer.tokenize(text) for text in texts]
+        word_pieces = {}
+        batch_tokens = []
+        for text in texts:
+            split_tokens = []
+            for word in self.basic_tokenizer._split_words(text):
+                pieces = word_pieces.get(word)
+                if pieces is None:
+                    pieces = []
+                    for token in self.basic_tokenizer._tokenize_word(word):
+                        pieces.extend(self.wordpiece_tokenizer.tokenize(token))
+                    word_pieces[word] = pieces
+                split_tokens.extend(pieces)
+            batch_tokens.append(split_tokens)
+        return batch_tokens
+
     def convert_tokens_to_ids(self, tokens):
         """Converts a sequence of tokens into ids using the vocab."""
         ids = []
@@ -214,6 +238,13 @@ class BasicTokenizer(object):
 
     def tokenize(self, text):
         """Tokenizes a piece of text."""
+        output_tokens = []
+        for token in self._split_words(text):
+            output_tokens.extend(self._tokenize_word(token))
+        return output_tokens
+
+    def _split_words(self, text):
+        """Cleans up a piece of text and splits it on whitespace."""
         text = self._clean_text(text)
         # This was added on November 1st, 2018 for the multilingual and Chinese
         # models. This is also applied to the English models now, but it doesn't
@@ -222,16 +253,14 @@ class BasicTokenizer(object):
         # characters in the vocabulary because Wikipedia does have some Chinese
         # words in the English Wikipedia.).
         text = self._tokenize_chinese_chars(text)
-        orig_tokens = whitespace_tokenize(text)
-        split_tokens = []
-        for token in orig_tokens:
-            if self.do_lower_case and token not in self.never_split:
-                token = token.lower()
-                token = self._run_strip_accents(token)
-            split_tokens.extend(self._run_split_on_punc(token))
+        return whitespace_tokenize(text)
 
-        output_tokens = whitespace_tokenize(" ".join(split_tokens))
-        return output_tokens
+    def _tokenize_word(self, token):
+        """Lower cases and splits a single whitespace-free word on punctuation."""
+        if self.do_lower_case and token not in self.never_split:
+            token = token.lower()
+            token = self._run_strip_accents(token)
+        return whitespace_tokenize(" ".join(self._run_split_on_punc(token)))
 
     def _run_strip_accents(self, text):
         """Strips accents from a piece of text."""
@@ -318,10 +347,37 @@ class BasicTokenizer(object):
 class WordpieceTokenizer(object):
     """Runs WordPiece tokenization."""
 
-    def __init__(self, vocab, unk_token="[UNK]", max_input_chars_per_word=100):
+    def __init__(self, vocab, unk_token="[UNK]", max_input_chars_per_word=100, cache_size=50000):
+        """Constructs a WordpieceTokenizer.
+
+        Args:
+          vocab: Mapping from wordpiece to id.
+          unk_token: Token used for words that can't be split into wordpieces.
+          max_input_chars_per_word: Longer words are mapped to `unk_token`.
+          cache_size: Number of words whose wordpieces are memoized (least
+                      recently used words are dropped first). 0 disables the cache.
+        """
         self.vocab = vocab
         self.unk_token = unk_token
         self.max_input_chars_per_word = max_input_chars_per_word
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+
+        # Every prefix of a vocabulary entry, for pieces starting a word and for
+        # "##" continuation pieces, so the greedy match can stop extending as soon
+        # as no longer piece exists instead of trying every end position.
+        self.start_pieces = set(vocab)
+        self.start_prefixes = set()
+        self.continuation_pieces = set()
+        self.continuation_prefixes = set()
+        for piece in vocab:
+            for end in range(1, len(piece) + 1):
+                self.start_prefixes.add(piece[:end])
+            if piece.startswith("##") and len(piece) > 2:
+                piece = piece[2:]
+                self.continuation_pieces.add(piece)
+                for end in range(1, len(piece) + 1):
+                    self.continuation_prefixes.add(piece[:end])
 
     def tokenize(self, text):
         """Tokenizes a piece of text into its word pieces.
@@ -343,36 +399,41 @@ class WordpieceTokenizer(object):
 
         output_tokens = []
         for token in whitespace_tokenize(text):
-            chars = list(token)
-            if len(chars) > self.max_input_chars_per_word:
-                output_tokens.append(self.unk_token)
-                continue
+            sub_tokens = self.cache.pop(token, None)
+            if sub_tokens is None:
+                sub_tokens = self._tokenize_word(token)
+            if self.cache_size > 0:
+                # re-inserting moves the word to the most recently used end
+                self.cache[token] = sub_tokens
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            output_tokens.extend(sub_tokens)
+        return output_tokens
 
-            is_bad = False
-            start = 0
-            sub_tokens = []
-            while start < len(chars):
-                end = len(chars)
-                cur_substr = None
-                while start < end:
-                    substr = "".join(chars[start:end])
-                    if start > 0:
-                        substr = "##" + substr
-                    if substr in self.vocab:
-                        cur_substr = substr
-                        break
-                    end -= 1
-                if cur_substr is None:
-                    is_bad = True
+    def _tokenize_word(self, token):
+        """Greedy longest-match-first split of a single word, as a tuple."""
+        if len(token) > self.max_input_chars_per_word:
+            return (self.unk_token,)
+
+        start = 0
+        sub_tokens = []
+        pieces, prefixes = self.start_pieces, self.start_prefixes
+        while start < len(token):
+            end = start + 1
+            cur_end = None
+            while end <= len(token):
+                substr = token[start:end]
+                if substr not in prefixes:
                     break
-                sub_tokens.append(cur_substr)
-                start = end
-
-            if is_bad:
-                output_tokens.append(self.unk_token)
-            else:
-                output_tokens.extend(sub_tokens)
-        return output_tokens
+                if substr in pieces:
+                    cur_end = end
+                end += 1
+            if cur_end is None:
+                return (self.unk_token,)
+            sub_tokens.append(token[start:cur_end] if start == 0 else "##" + token[start:cur_end])
+            start = cur_end
+            pieces, prefixes = self.continuation_pieces, self.continuation_prefixes
+        return tuple(sub_tokens)
 
 
 def _is_whitespace(char):
@@ -19,15 +19,20 @@ from __future__ import absolute_import, division, print_function
 
 import argparse
 import csv
+import functools
+import hashlib
 import logging
 import os
 import random
+import shutil
 import sys
 import re
+import tempfile
+import time
 import pandas as pd
 import numpy as np
 import torch
-from torch.utils.data import (DataLoader, RandomSampler, SequentialSampler,
+from torch.utils.data import (DataLoader, RandomSampler, Sampler, SequentialSampler,
 							  TensorDataset)
 from torch.utils.data.distributed import DistributedSampler
 from tqdm import tqdm, trange
@@ -36,8 +41,10 @@ from torch.nn import CrossEntropyLoss, MSELoss, NLLLoss
 from scipy.stats import pearsonr, spearmanr
 from sklearn.metrics import matthews_corrcoef, f1_score
 
+from pytorch_pretrained_bert.data_utils import ArrayAccumulator, concatenate_arrays, features_to_arrays, parallel_convert
 from pytorch_pretrained_bert.file_utils import PYTORCH_PRETRAINED_BERT_CACHE, WEIGHTS_NAME, CONFIG_NAME
 from pytorch_pretrained_bert.modeling import BertForSequenceClassification, BertConfig
+from pytorch_pretrained_bert.onnx_utils import OnnxSequenceClassifier, export_onnx
 from pytorch_pretrained_bert.tokenization import BertTokenizer
 from pytorch_pretrained_bert.optimization import BertAdam, warmup_linear
 
@@ -149,6 +156,14 @@ def remove_emoji(sen):
 	
 	return sen
 
+# names of the classifier heads' outputs, in head order
+SUBTASKS = ['taska', 'taskb', 'taskc']
+SUBTASK_LABELS = [
+	['NOT', 'OFF'],
+	['UNT', 'TIN'],
+	['OTH', 'GRP', 'IND'],
+]
+
 class SemevalProcessor(DataProcessor):
 	"""Processor for the WNLI data set (GLUE version)."""
 	def get_train_examples(self, data_dir):
@@ -163,7 +178,10 @@ class SemevalProcessor(DataProcessor):
 
 	def get_test_examples(self, file_name):
 		"""See base class."""
-		data = pd.read_csv(file_name, sep='\t')
+		return self.create_test_examples(pd.read_csv(file_name, sep='\t'))
+
+	def create_test_examples(self, data):
+		"""Creates unlabeled examples from a frame of `id` and `tweet` columns."""
 		#OFF	UNT	NULL
 		data['subtask_a'] = pd.Series(['OFF']*data.shape[0], index=data.index)
 		data['subtask_b'] = pd.Series(['UNT']*data.shape[0], index=data.index)
@@ -214,14 +232,16 @@ def convert_examples_to_features(examples, label_lists, max_seq_length,
 		label_map.append( {'NULL':0, 'OTH':0, 'GRP':1, 'IND':2} )
 
 	else:
-		label_map =  {label : i for i, label in enumerate(label_list)} 
+		label_map =  {label : i for i, label in enumerate(label_lists)} 
+
+	all_tokens_a = tokenizer.tokenize_batch([example.text_a for example in examples])
 
 	features = []
 	for (ex_index, example) in enumerate(examples):
 		if ex_index % 100000 == 0:
 			logger.info("Writing example %d of %d" % (ex_index, len(examples)))
 
-		tokens_a = tokenizer.tokenize(example.text_a)
+		tokens_a = all_tokens_a[ex_index]
 
 		tokens_b = None
 		if example.text_b:
@@ -308,6 +328,78 @@ def convert_examples_to_features(examples, label_lists, max_seq_length,
 	return features
 
 
+FEATURE_FIELDS = ('input_ids', 'input_mask', 'segment_ids', 'label_id')
+# the dtype of the array of every `InputFeatures` field, int32 on disk, widened per batch by TrimCollator;
+# convert_examples_to_arrays keeps the label_id of regression as float32
+FEATURE_DTYPES = dict((name, np.int32) for name in FEATURE_FIELDS)
+
+
+def convert_examples_to_arrays(examples, shard_start, label_list, max_seq_length, tokenizer, output_mode, with_guid):
+	"""`convert_examples_to_features` + `features_to_arrays`, one shard of a `parallel_convert` run."""
+	features = convert_examples_to_features(examples, label_list, max_seq_length, tokenizer, output_mode)
+	dtypes = dict(FEATURE_DTYPES)
+	if output_mode == "regression":
+		dtypes['label_id'] = np.float32
+	if with_guid:
+		dtypes['guid'] = np.int64
+	return features_to_arrays(features, dtypes)
+
+
+def features_cache_key(data_file, tokenizer, do_lower_case, max_seq_length, set_type, output_mode):
+	"""Hashes everything the features of `data_file` depend on."""
+	sha = hashlib.sha1()
+	with open(data_file, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			sha.update(chunk)
+	sha.update('\n'.join(tokenizer.vocab.keys()).encode('utf-8'))
+	sha.update('{} {} {} {}'.format(do_lower_case, max_seq_length, set_type, output_mode).encode('utf-8'))
+	sha.update(' '.join(FEATURE_FIELDS).encode('utf-8'))
+	return sha.hexdigest()
+
+
+def load_features(data_file, set_type, get_examples, label_list, tokenizer, args, output_mode):
+	"""Returns the feature arrays of `data_file`.
+
+	The first run reads and tokenizes the examples returned by `get_examples`
+	and saves the arrays as `.npy` files in the features cache directory. Later
+	runs with the same data file, vocab, casing, max_seq_length and output mode memory-map
+	those files instead, without touching pandas or the tokenizer.
+	"""
+	with_guid = set_type == 'test'
+
+	def convert():
+		convert_fn = functools.partial(convert_examples_to_arrays, label_list=label_list,
+									   max_seq_length=args.max_seq_length, tokenizer=tokenizer,
+									   output_mode=output_mode, with_guid=with_guid)
+		return concatenate_arrays(parallel_convert(convert_fn, get_examples(), args.preprocessing_num_workers))
+
+	if args.no_features_cache:
+		return convert()
+
+	cache_dir = args.features_cache_dir or os.path.join(os.path.dirname(os.path.abspath(data_file)), 'cached_features')
+	key = features_cache_key(data_file, tokenizer, args.do_lower_case, args.max_seq_length, set_type, output_mode)
+	cached_features_dir = os.path.join(cache_dir, '{0}_{1}'.format(set_type, key))
+	names = FEATURE_FIELDS + (('guid',) if with_guid else ())
+	if os.path.isdir(cached_features_dir):
+		logger.info("Loading features from cache %s", cached_features_dir)
+		# copy-on-write keeps the arrays writable for torch.from_numpy without reading them in
+		return {name: np.load(os.path.join(cached_features_dir, name + '.npy'), mmap_mode='c') for name in names}
+
+	arrays = convert()
+	if not os.path.exists(cache_dir):
+		os.makedirs(cache_dir)
+	tempdir = tempfile.mkdtemp(dir=cache_dir)
+	for name in names:
+		np.save(os.path.join(tempdir, name + '.npy'), arrays[name])
+	try:
+		os.rename(tempdir, cached_features_dir)
+		logger.info("Saved features to cache %s", cached_features_dir)
+	except OSError:
+		# another process filled the cache first
+		shutil.rmtree(tempdir)
+	return arrays
+
+
 def _truncate_seq_pair(tokens_a, tokens_b, max_length):
 	"""Truncates a sequence pair in place to the maximum length."""
 
@@ -328,6 +420,103 @@ def _truncate_seq_pair(tokens_a, tokens_b, max_length):
 	return tokens_a,tokens_b
 
 
+class BucketBatchSampler(Sampler):
+	"""Yields batches of indices that hold sequences of similar length.
+
+	With `shuffle`, the indices are shuffled, cut into pools of
+	`batch_size * bucket_size_multiplier` examples, sorted by length inside each
+	pool and the resulting batches are shuffled again. Without `shuffle` all the
+	indices are sorted by length once, which is what eval and test want.
+	The shuffling is driven by `seed` (and the epoch number), so two runs with the
+	same seed see exactly the same batches.
+	"""
+
+	def __init__(self, lengths, batch_size, shuffle=True, bucket_size_multiplier=100, seed=42):
+		self.lengths = np.asarray(lengths)
+		self.batch_size = batch_size
+		self.shuffle = shuffle
+		self.bucket_size_multiplier = bucket_size_multiplier
+		self.seed = seed
+		self.epoch = 0
+
+	def _split(self, indices):
+		return [indices[i:i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
+
+	def __iter__(self):
+		if self.shuffle:
+			rng = np.random.RandomState(self.seed + self.epoch)
+			self.epoch += 1
+			indices = rng.permutation(len(self.lengths))
+			pool_size = self.batch_size * self.bucket_size_multiplier
+			batches = []
+			for start in range(0, len(indices), pool_size):
+				pool = indices[start:start + pool_size]
+				pool = pool[np.argsort(self.lengths[pool], kind='mergesort')]
+				batches.extend(self._split(pool))
+			rng.shuffle(batches)
+		else:
+			batches = self._split(np.argsort(self.lengths, kind='mergesort'))
+		for batch in batches:
+			yield batch.tolist()
+
+	def __len__(self):
+		return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+
+class TrimCollator(object):
+	"""Stacks a batch of `TensorDataset` items and cuts the sequence tensors
+	(`seq_fields`) down to the longest real sequence of the batch, measured on
+	the input mask found at `mask_field`. The int32 fields of the cached
+	features are widened to int64 here, one batch at a time."""
+
+	def __init__(self, mask_field, seq_fields):
+		self.mask_field = mask_field
+		self.seq_fields = seq_fields
+
+	def __call__(self, batch):
+		fields = [torch.stack(field) for field in zip(*batch)]
+		fields = [field.long() if field.dtype == torch.int32 else field for field in fields]
+		max_len = int(fields[self.mask_field].sum(dim=1).max())
+		for i in self.seq_fields:
+			fields[i] = fields[i][:, :max_len]
+		return fields
+
+
+def get_dataloader(data, all_input_mask, batch_size, shuffle, args, mask_field=1):
+	"""Builds the DataLoader for `data`.
+
+	Unless `--no_bucketing` is set, batches are grouped by length and trimmed to
+	their longest sequence instead of being padded to `--max_seq_length`.
+	The input ids, mask and segment ids must be consecutive fields of `data`
+	with the mask in the middle, at `mask_field`.
+	"""
+	if shuffle and args.local_rank != -1:
+		sampler = DistributedSampler(data)
+	elif shuffle:
+		sampler = RandomSampler(data)
+	else:
+		sampler = SequentialSampler(data)
+
+	if args.no_bucketing:
+		return DataLoader(data, sampler=sampler, batch_size=batch_size, collate_fn=TrimCollator(mask_field, ()))
+
+	collate_fn = TrimCollator(mask_field, (mask_field - 1, mask_field, mask_field + 1))
+	if shuffle and args.local_rank != -1:
+		return DataLoader(data, sampler=sampler, batch_size=batch_size, collate_fn=collate_fn)
+	batch_sampler = BucketBatchSampler(all_input_mask.sum(dim=1).numpy(), batch_size,
+									   shuffle=shuffle, seed=args.seed)
+	return DataLoader(data, batch_sampler=batch_sampler, collate_fn=collate_fn)
+
+
+def restore_order(values, dataloader):
+	"""Puts `values`, collected batch after batch from a non-shuffling
+	`dataloader`, back into the order of its dataset."""
+	order = [i for batch in dataloader.batch_sampler for i in batch]
+	restored = np.empty_like(values)
+	restored[order] = values
+	return restored
+
+
 def simple_accuracy(preds, labels):
 	return (preds == labels).astype(int).mean()
 
@@ -335,7 +524,7 @@ def multi_acc_and_f1(preds, labels):
 	# convert pred to label
 	out = []
 
-	pred = np.array(preds[0][0]).argmax(axis=-1)
+	pred = np.array(preds[0]).argmax(axis=-1)
 	label=labels[:,0]
 
 	acc = simple_accuracy(	pred,label	)
@@ -347,7 +536,7 @@ def multi_acc_and_f1(preds, labels):
 
 	pred = []
 	label = []		
-	for p,l in zip( np.array(preds[1][0]),labels):
+	for p,l in zip( np.array(preds[1]),labels):
 		if(l[0]==0):
 			continue
 		pred.append(p.argmax(axis=-1))
@@ -363,7 +552,7 @@ def multi_acc_and_f1(preds, labels):
 	
 	pred = []
 	label = []		
-	for p,l in zip( np.array(preds[2][0]),labels):
+	for p,l in zip( np.array(preds[2]),labels):
 		if(l[1]==0):
 			continue
 		pred.append(p.argmax(axis=-1))
@@ -390,6 +579,76 @@ def compute_metrics(task_name, preds, labels):
 		raise KeyError(task_name)
 
 
+def multi_task_loss(logits, label_ids, num_labels):
+	"""Subtask a loss plus the b and c losses, which only count the tweets labeled OFF (resp. TIN)."""
+	loss_fct = CrossEntropyLoss()
+	loss = loss_fct( logits[0].view(-1, num_labels[0]), label_ids[:,0].view(-1) )
+	loss += 16*loss_fct( logits[1].view(-1, num_labels[1]), label_ids[:,1].view(-1) ) * (label_ids[:,0].float().view(-1)).mean()
+	loss += 16*loss_fct( logits[2].view(-1, num_labels[2]), label_ids[:,2].view(-1) ) * (label_ids[:,1].float().view(-1)).mean()
+	return loss
+
+
+def average_exit_layer(exit_counts):
+	"""Mean number of encoder layers run per sample, from `BertForSequenceClassification.exit_counts`."""
+	return sum((i + 1) * count for i, count in enumerate(exit_counts)) / max(sum(exit_counts), 1)
+
+
+def evaluate(model, eval_dataloader, device, num_labels, output_mode):
+	"""Runs `model` over `eval_dataloader`, returns the mean eval loss and the
+	predictions (the logits of every head for multi_classification) in the order
+	of the dataset."""
+	model.eval()
+	eval_loss = 0
+	nb_eval_steps = 0
+	
+	if(output_mode == "multi_classification"):
+		preds = [ArrayAccumulator(len(eval_dataloader.dataset)) for _ in num_labels]
+	else:
+		preds = ArrayAccumulator(len(eval_dataloader.dataset))
+
+	for batch in tqdm(eval_dataloader, desc="Evaluating"):
+		batch = tuple(t.to(device) for t in batch)
+
+		input_ids, input_mask, segment_ids, label_ids = batch
+
+		with torch.no_grad():
+			logits = model(input_ids, segment_ids, input_mask)
+
+		# create eval loss and other metric required by the task
+		if(output_mode == "multi_classification"): 
+			tmp_eval_loss = multi_task_loss(logits, label_ids, num_labels)
+		
+		elif output_mode == "classification":
+			loss_fct = CrossEntropyLoss()
+			tmp_eval_loss = loss_fct(logits.view(-1, num_labels), label_ids.view(-1))
+		elif output_mode == "regression":
+			loss_fct = MSELoss()
+			tmp_eval_loss = loss_fct(logits.view(-1), label_ids.view(-1))
+		
+
+		eval_loss += tmp_eval_loss.mean().item()
+		nb_eval_steps += 1
+
+		if(output_mode == "multi_classification"): 
+			for pred,logit in zip(preds,logits):
+				pred.add(logit)
+		else:
+			preds.add(logits)
+
+	eval_loss = eval_loss / nb_eval_steps
+
+	if(output_mode == "multi_classification"): 
+		preds = [restore_order(pred.result(), eval_dataloader) for pred in preds]
+	else:
+		preds = restore_order(preds.result(), eval_dataloader)
+		if output_mode == "classification":
+			preds = np.argmax(preds, axis=1)
+		elif output_mode == "regression":
+			preds = np.squeeze(preds)
+
+	return eval_loss, preds
+
+
 def main():
 	parser = argparse.ArgumentParser()
 
@@ -411,7 +670,12 @@ def main():
 	parser.add_argument("--test_task",
 						default='taska',
 						type=str,
+						choices=SUBTASKS,
 						help="The task to output.")
+	parser.add_argument("--dump_logits",
+						action='store_true',
+						help="With --do_test, also write the logits of the three heads of every tweet to "
+							 "{input name}_logits.tsv in the output dir, e.g. as soft targets for NN/train.py --teacher_logits.")
 	parser.add_argument("--output_dir",
 						default=None,
 						type=str,
@@ -445,6 +709,47 @@ def main():
 	parser.add_argument("--do_lower_case",
 						action='store_true',
 						help="Set this flag if you are using an uncased model.")
+	parser.add_argument("--features_cache_dir",
+						default="",
+						type=str,
+						help="Where to keep the tokenized features. Defaults to a `cached_features` folder next to each data file.")
+	parser.add_argument("--preprocessing_num_workers",
+						default=1,
+						type=int,
+						help="Number of processes used to tokenize the examples into features.")
+	parser.add_argument("--no_features_cache",
+						action='store_true',
+						help="Always re-tokenize the data files instead of reading/writing the features cache.")
+	parser.add_argument("--no_bucketing",
+						action='store_true',
+						help="Pad every batch to max_seq_length and use the plain random/sequential samplers "
+							 "instead of length-bucketed, trimmed batches. Reproduces the results of earlier runs.")
+	parser.add_argument("--fused_qkv",
+						action='store_true',
+						help="Compute query, key and value with one fused projection per layer. "
+							 "Checkpoints saved without it are converted when loaded.")
+	parser.add_argument("--unpad",
+						action='store_true',
+						help="Run the dense layers of the encoder on the real tokens only, without the padding.")
+	parser.add_argument("--early_exit",
+						action='store_true',
+						help="Add an exit classifier after every encoder layer and train them with the final one.")
+	parser.add_argument("--exit_threshold",
+						default=None,
+						type=float,
+						help="At eval/test, stop each tweet at the first exit whose subtask a entropy is below this.")
+	parser.add_argument("--int8",
+						action='store_true',
+						help="Run eval and test with the Linear layers dynamically quantized to int8 (CPU only).")
+	parser.add_argument("--backend",
+						default="pytorch",
+						choices=["pytorch", "onnxruntime"],
+						help="What runs the model of --do_test. onnxruntime runs the ONNX export of the model on the CPU.")
+	parser.add_argument("--onnx_model",
+						default="",
+						type=str,
+						help="With --backend onnxruntime, the ONNX file written by export_onnx.py, run as it is. "
+							 "Without it the model just loaded is exported to model.onnx in the output dir on every run.")
 	parser.add_argument("--train_batch_size",
 						default=128,
 						type=int,
@@ -517,6 +822,14 @@ def main():
 	logger.info("device: {} n_gpu: {}, distributed training: {}, 16-bits training: {}".format(
 		device, n_gpu, bool(args.local_rank != -1), args.fp16))
 
+	if args.int8 and device.type != "cpu":
+		raise ValueError("--int8 runs on the CPU only, add --no_cuda.")
+	if args.do_train and args.exit_threshold is not None and not args.early_exit:
+		raise ValueError("--exit_threshold needs the exit classifiers of --early_exit.")
+	if args.backend == "onnxruntime" and (args.int8 or args.exit_threshold is not None):
+		raise ValueError("--backend onnxruntime runs the float32 model without early exits, "
+						 "drop --int8 and --exit_threshold.")
+
 	if args.gradient_accumulation_steps < 1:
 		raise ValueError("Invalid gradient_accumulation_steps parameter: {}, should be >= 1".format(
 							args.gradient_accumulation_steps))
@@ -556,13 +869,22 @@ def main():
 		num_labels = len(label_list)
 
 	tokenizer = BertTokenizer.from_pretrained(args.bert_model, do_lower_case=args.do_lower_case)
-
-	train_examples = None
+	model_kwargs = {}
+	if args.fused_qkv:
+		model_kwargs['fused_qkv'] = True
+	if args.unpad:
+		model_kwargs['unpad_input'] = True
+	if args.early_exit:
+		model_kwargs['early_exit'] = True
+
+	train_features = None
 	num_train_optimization_steps = None
 	if args.do_train:
-		train_examples = processor.get_train_examples(args.data_dir)
+		train_features = load_features(os.path.join(args.data_dir, "train.tsv"), "train",
+									   lambda: processor.get_train_examples(args.data_dir),
+									   label_list, tokenizer, args, output_mode)
 		num_train_optimization_steps = int(
-			len(train_examples) / args.train_batch_size / args.gradient_accumulation_steps) * args.num_train_epochs
+			len(train_features['input_ids']) / args.train_batch_size / args.gradient_accumulation_steps) * args.num_train_epochs
 		if args.local_rank != -1:
 			num_train_optimization_steps = num_train_optimization_steps // torch.distributed.get_world_size()
 
@@ -570,7 +892,8 @@ def main():
 	cache_dir = args.cache_dir if args.cache_dir else os.path.join(str(PYTORCH_PRETRAINED_BERT_CACHE), 'distributed_{}'.format(args.local_rank))
 	model = BertForSequenceClassification.from_pretrained(args.bert_model,
 			  cache_dir=cache_dir,
-			  num_labels=num_labels)
+			  num_labels=num_labels,
+			  **model_kwargs)
 	if args.fp16:
 		model.half()
 	model.to(device)
@@ -617,28 +940,14 @@ def main():
 	nb_tr_steps = 0
 	tr_loss = 0
 	if args.do_train:
-		train_features = convert_examples_to_features(
-			train_examples, label_list, args.max_seq_length, tokenizer, output_mode)
 		logger.info("***** Running training *****")
-		logger.info("  Num examples = %d", len(train_examples))
+		logger.info("  Num examples = %d", len(train_features['input_ids']))
 		logger.info("  Batch size = %d", args.train_batch_size)
 		logger.info("  Num steps = %d", num_train_optimization_steps)
-		all_input_ids = torch.tensor([f.input_ids for f in train_features], dtype=torch.long)
-		all_input_mask = torch.tensor([f.input_mask for f in train_features], dtype=torch.long)
-		all_segment_ids = torch.tensor([f.segment_ids for f in train_features], dtype=torch.long)
-
-
-		if( output_mode == "classification" or output_mode == "multi_classification"):
-			all_label_ids = torch.tensor([f.label_id for f in train_features], dtype=torch.long)
-		elif( output_mode == "regression"):
-			all_label_ids = torch.tensor([f.label_id for f in train_features], dtype=torch.float)
+		all_input_ids, all_input_mask, all_segment_ids, all_label_ids = (
+			torch.from_numpy(train_features[name]) for name in FEATURE_FIELDS)
 		train_data = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids)
-
-		if args.local_rank == -1:
-			train_sampler = RandomSampler(train_data)
-		else:
-			train_sampler = DistributedSampler(train_data)
-		train_dataloader = DataLoader(train_data, sampler=train_sampler, batch_size=args.train_batch_size)
+		train_dataloader = get_dataloader(train_data, all_input_mask, args.train_batch_size, True, args)
 
 		model.train()
 		for _ in trange(int(args.num_train_epochs), desc="Epoch"):
@@ -650,14 +959,17 @@ def main():
 				input_ids, input_mask, segment_ids, label_ids = batch
 
 				# define a new function to compute loss values for both output_modes
-				logits = model(input_ids, segment_ids, input_mask)
+				if args.early_exit:
+					# the exit classifiers and the final one are trained together, equally weighted
+					all_logits = model(input_ids, segment_ids, input_mask, output_all_exits=True)
+				else:
+					logits = model(input_ids, segment_ids, input_mask)
 
 
-				if(output_mode == "multi_classification"):
-					loss_fct = CrossEntropyLoss()
-					loss = loss_fct( logits[0].view(-1, num_labels[0]), label_ids[:,0].view(-1) )
-					loss += 16*loss_fct( logits[1].view(-1, num_labels[1]), label_ids[:,1].view(-1) ) * (label_ids[:,0].float().view(-1)).mean()
-					loss += 16*loss_fct( logits[2].view(-1, num_labels[2]), label_ids[:,2].view(-1) ) * (label_ids[:,1].float().view(-1)).mean()
+				if args.early_exit:
+					loss = sum(multi_task_loss(logits, label_ids, num_labels) for logits in all_logits) / len(all_logits)
+				elif(output_mode == "multi_classification"):
+					loss = multi_task_loss(logits, label_ids, num_labels)
 					print(loss)
 				elif output_mode == "classification":
 					loss_fct = CrossEntropyLoss()
@@ -703,93 +1015,40 @@ def main():
 		tokenizer.save_vocabulary(args.output_dir)
 
 		# Load a trained model and vocabulary that you have fine-tuned
-		model = BertForSequenceClassification.from_pretrained(args.output_dir, num_labels=num_labels)
+		model = BertForSequenceClassification.from_pretrained(args.output_dir, num_labels=num_labels, **model_kwargs)
 		tokenizer = BertTokenizer.from_pretrained(args.output_dir, do_lower_case=args.do_lower_case)
 	else:
-		model = BertForSequenceClassification.from_pretrained(args.bert_model, num_labels=num_labels)
+		model = BertForSequenceClassification.from_pretrained(args.bert_model, num_labels=num_labels, **model_kwargs)
+	if args.int8 and not getattr(model.config, 'quantized', False):
+		model.quantize()
+	if args.exit_threshold is not None:
+		if not getattr(model.config, 'early_exit', False):
+			raise ValueError("--exit_threshold needs a model with exit classifiers, {} was not fine-tuned "
+							 "with --early_exit.".format(args.output_dir if args.do_train else args.bert_model))
+		model.exit_threshold = args.exit_threshold
 	model.to(device)
 
 	if args.do_eval and (args.local_rank == -1 or torch.distributed.get_rank() == 0):
-		eval_examples = processor.get_dev_examples(args.data_dir)
-		eval_features = convert_examples_to_features(
-			eval_examples, label_list, args.max_seq_length, tokenizer, output_mode)
+		eval_features = load_features(os.path.join(args.data_dir, "valid.tsv"), "dev",
+									  lambda: processor.get_dev_examples(args.data_dir),
+									  label_list, tokenizer, args, output_mode)
 		logger.info("***** Running evaluation *****")
-		logger.info("  Num examples = %d", len(eval_examples))
+		logger.info("  Num examples = %d", len(eval_features['input_ids']))
 		logger.info("  Batch size = %d", args.eval_batch_size)
-		all_input_ids = torch.tensor([f.input_ids for f in eval_features], dtype=torch.long)
-		all_input_mask = torch.tensor([f.input_mask for f in eval_features], dtype=torch.long)
-		all_segment_ids = torch.tensor([f.segment_ids for f in eval_features], dtype=torch.long)
-
-		if( output_mode == "classification" or output_mode == "multi_classification"):
-			all_label_ids = torch.tensor([f.label_id for f in eval_features], dtype=torch.long)
-		elif( output_mode == "regression"):
-			all_label_ids = torch.tensor([f.label_id for f in eval_features], dtype=torch.float)
+		all_input_ids, all_input_mask, all_segment_ids, all_label_ids = (
+			torch.from_numpy(eval_features[name]) for name in FEATURE_FIELDS)
 		eval_data = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids)
 
 		# Run prediction for full data
-		eval_sampler = SequentialSampler(eval_data)
-		eval_dataloader = DataLoader(eval_data, sampler=eval_sampler, batch_size=args.eval_batch_size)
+		eval_dataloader = get_dataloader(eval_data, all_input_mask, args.eval_batch_size, False, args)
 
-		model.eval()
-		eval_loss = 0
-		nb_eval_steps = 0
-		
-		preds = []
-		if(output_mode == "multi_classification"):
-			for i in range(len(label_list)):
-				preds.append([])
-
-		for batch in tqdm(eval_dataloader, desc="Evaluating"):
-			batch = tuple(t.to(device) for t in batch)
-
-			input_ids, input_mask, segment_ids, label_ids = batch
-
-			with torch.no_grad():
-				logits = model(input_ids, segment_ids, input_mask)
-
-			# create eval loss and other metric required by the task
-			if(output_mode == "multi_classification"): 
-				loss_fct = CrossEntropyLoss()
-				tmp_eval_loss = loss_fct( logits[0].view(-1, num_labels[0]), label_ids[:,0].view(-1) )
-				tmp_eval_loss += 16*loss_fct( logits[1].view(-1, num_labels[1]), label_ids[:,1].view(-1) ) * (label_ids[:,0].float().view(-1)).mean()
-				tmp_eval_loss += 16*loss_fct( logits[2].view(-1, num_labels[2]), label_ids[:,2].view(-1) ) * (label_ids[:,1].float().view(-1)).mean()
-			
-			elif output_mode == "classification":
-				loss_fct = CrossEntropyLoss()
-				tmp_eval_loss = loss_fct(logits.view(-1, num_labels), label_ids.view(-1))
-			elif output_mode == "regression":
-				loss_fct = MSELoss()
-				tmp_eval_loss = loss_fct(logits.view(-1), label_ids.view(-1))
-			
-
-			eval_loss += tmp_eval_loss.mean().item()
-			nb_eval_steps += 1
-
-			if(output_mode == "multi_classification"): 
-				for i,logit in enumerate(logits):
-					if(len(preds[i]) == 0):
-						preds[i].append(logit.detach().cpu().numpy())
-					else:
-						preds[i][0] = np.append(
-							preds[i][0], logit.detach().cpu().numpy(), axis=0)
-			else:
-				if len(preds) == 0:
-					preds.append(logits.detach().cpu().numpy())
-				else:
-					preds[0] = np.append(
-						preds[0], logits.detach().cpu().numpy(), axis=0)
-
-		eval_loss = eval_loss / nb_eval_steps
-
-		if(output_mode == "multi_classification"): 
-			pass
-		else:
-			if output_mode == "classification":
-				preds = np.argmax(preds, axis=1)
-			elif output_mode == "regression":
-				preds = np.squeeze(preds)
+		if args.exit_threshold is not None:
+			model.exit_counts = [0] * len(model.exit_counts)
+		eval_loss, preds = evaluate(model, eval_dataloader, device, num_labels, output_mode)
 
 		result = compute_metrics(task_name, preds, all_label_ids.numpy())
+		if args.exit_threshold is not None:
+			result['average_layers'] = average_exit_layer(model.exit_counts)
 		
 		loss = tr_loss/nb_tr_steps if args.do_train else None
 
@@ -805,65 +1064,84 @@ def main():
 				writer.write("%s = %s\n" % (key, str(result[key])))
 	
 	if args.do_test and (args.local_rank == -1 or torch.distributed.get_rank() == 0):
-		eval_examples = processor.get_test_examples(args.data_dir)
-		eval_features = convert_examples_to_features(eval_examples, label_list, args.max_seq_length, tokenizer, output_mode)
+		eval_features = load_features(args.data_dir, "test",
+									  lambda: processor.get_test_examples(args.data_dir),
+									  label_list, tokenizer, args, output_mode)
 		logger.info("***** Running evaluation *****")
-		logger.info("  Num examples = %d", len(eval_examples))
+		logger.info("  Num examples = %d", len(eval_features['input_ids']))
 		logger.info("  Batch size = %d", args.eval_batch_size)
-		all_index = torch.tensor([f.guid for f in eval_features], dtype=torch.long)
-		all_input_ids = torch.tensor([f.input_ids for f in eval_features], dtype=torch.long)
-		all_input_mask = torch.tensor([f.input_mask for f in eval_features], dtype=torch.long)
-		all_segment_ids = torch.tensor([f.segment_ids for f in eval_features], dtype=torch.long)
+		all_index = torch.from_numpy(eval_features['guid'])
+		all_input_ids, all_input_mask, all_segment_ids = (
+			torch.from_numpy(eval_features[name]) for name in FEATURE_FIELDS[:3])
 
 		test_data = TensorDataset(all_index,all_input_ids, all_input_mask, all_segment_ids)
 		# Run prediction for full data
-		test_sampler = SequentialSampler(test_data)
-		test_dataloader = DataLoader(test_data, sampler=test_sampler, batch_size=args.eval_batch_size)
+		test_dataloader = get_dataloader(test_data, all_input_mask, args.eval_batch_size, False, args, mask_field=2)
 
 		model.eval()
 		nb_eval_steps = 0
-		preds = []
+		if args.exit_threshold is not None:
+			model.exit_counts = [0] * len(model.exit_counts)
+		if args.backend == "onnxruntime":
+			onnx_model = args.onnx_model
+			if not onnx_model:
+				# a model.onnx left in the output dir may come from another --bert_model or other weights
+				onnx_model = os.path.join(args.output_dir, "model.onnx")
+				export_onnx(model, onnx_model)
+			predict = OnnxSequenceClassifier(onnx_model)
+			logger.info("  Backend = onnxruntime (%s)", onnx_model)
+		else:
+			predict = model
 		if(output_mode == "multi_classification"): 
-			preds = [[],[],[]]
-		total_index = []
+			preds = [ArrayAccumulator(len(test_data)) for _ in num_labels]
+		else:
+			preds = ArrayAccumulator(len(test_data))
+		total_index = ArrayAccumulator(len(test_data))
+		start = time.time()
 		for index,input_ids, input_mask, segment_ids in tqdm(test_dataloader, desc="Evaluating"):
-			total_index.extend(index.tolist())
+			total_index.add(index)
 
 			input_ids = input_ids.to(device)
 			input_mask = input_mask.to(device)
 			segment_ids = segment_ids.to(device)
 
 			with torch.no_grad():
-				logits = model(input_ids, segment_ids, input_mask)
+				logits = predict(input_ids, segment_ids, input_mask)
 
 			if(output_mode == "multi_classification"): 
-				for i,logit in enumerate(logits):
-					if(len(preds[i]) == 0):
-						preds[i].append(logit.detach().cpu().numpy())
-					else:
-						preds[i][0] = np.append(
-							preds[i][0], logit.detach().cpu().numpy(), axis=0)
+				for pred,logit in zip(preds,logits):
+					pred.add(logit)
 			else:
-				if len(preds) == 0:
-					preds.append(logits.detach().cpu().numpy())
-				else:
-					preds[0] = np.append(
-						preds[0], logits.detach().cpu().numpy(), axis=0)
+				preds.add(logits)
+
+		logger.info("  Throughput = %.1f tweets/s", len(test_data) / (time.time() - start))
+		if args.exit_threshold is not None:
+			logger.info("  Average layers = %.2f", average_exit_layer(model.exit_counts))
+		total_index = restore_order(total_index.result(), test_dataloader)
+		if(output_mode == "multi_classification"): 
+			preds = [restore_order(pred.result(), test_dataloader) for pred in preds]
+		else:
+			preds = restore_order(preds.result(), test_dataloader)
+
+		if args.dump_logits:
+			if output_mode != "multi_classification":
+				raise ValueError("--dump_logits needs the three heads of the semeval task.")
+			name = os.path.splitext(os.path.basename(args.data_dir))[0]
+			output_logits_file = os.path.join(args.output_dir, "{0}_logits.tsv".format(name))
+			with open(output_logits_file, "w") as writer:
+				logger.info("***** Writing logits to %s *****", output_logits_file)
+				writer.write("\t".join(["id"] + [label for labels in SUBTASK_LABELS for label in labels]) + "\n")
+				logits = np.concatenate(preds, axis=1)
+				for i in range(logits.shape[0]):
+					writer.write("\t".join([str(total_index[i])] + ["{:.6f}".format(x) for x in logits[i]]) + "\n")
 
 		if(output_mode == "multi_classification"): 
-			if(args.test_task == 'taska'):
-				preds = preds[0][0]
-				label_map= ['NOT','OFF']
-			elif(args.test_task == 'taskb'):
-				preds = preds[1][0]
-				label_map= ['UNT', 'TIN']
-			elif(args.test_task == 'taskc'):
-				preds = preds[2][0]
-				label_map= ['OTH', 'GRP', 'IND']
+			head = SUBTASKS.index(args.test_task)
+			preds = preds[head]
+			label_map = SUBTASK_LABELS[head]
 				
 			preds = np.argmax(preds, axis=-1)
 		else:
-			preds = preds[0]
 			if output_mode == "classification":
 				preds = np.argmax(preds, axis=1)
 			elif output_mode == "regression":
@@ -0,0 +1,82 @@
+# coding=utf-8
+# Copyright 2018 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import unittest
+
+import numpy as np
+
+import torch
+
+from pytorch_pretrained_bert.data_utils import (ArrayAccumulator, concatenate_arrays,
+                                                features_to_arrays, parallel_convert)
+
+
+class Feature(object):
+    def __init__(self, input_ids, label_id):
+        self.input_ids = input_ids
+        self.label_id = label_id
+
+
+def convert_shard(examples, shard_start):
+    features = [Feature([x, x + 1], shard_start + i) for i, x in enumerate(examples)]
+    return features_to_arrays(features, {'input_ids': np.int32, 'label_id': np.int64})
+
+
+class DataUtilsTest(unittest.TestCase):
+
+    def test_features_to_arrays(self):
+        arrays = features_to_arrays([Feature([1, 2], 0), Feature([3, 4], 1)],
+                                    {'input_ids': np.int32, 'label_id': np.float32})
+        self.assertEqual(arrays['input_ids'].dtype, np.int32)
+        self.assertListEqual(arrays['input_ids'].tolist(), [[1, 2], [3, 4]])
+        self.assertEqual(arrays['label_id'].dtype, np.float32)
+        self.assertListEqual(arrays['label_id'].tolist(), [0.0, 1.0])
+
+    def test_parallel_convert(self):
+        examples = list(range(0, 230, 10))
+        serial = parallel_convert(convert_shard, examples, num_workers=1)
+        self.assertEqual(len(serial), 1)
+
+        shards = parallel_convert(convert_shard, examples, num_workers=3, shard_size=4)
+        self.assertEqual(len(shards), 6)
+        parallel = concatenate_arrays(shards)
+        for name in ('input_ids', 'label_id'):
+            self.assertEqual(parallel[name].dtype, serial[0][name].dtype)
+            self.assertListEqual(parallel[name].tolist(), serial[0][name].tolist())
+        self.assertListEqual(parallel['label_id'].tolist(), list(range(len(examples))))
+
+    def test_array_accumulator(self):
+        batches = [np.arange(i, i + 6, dtype=np.float32).reshape(3, 2) for i in range(0, 30, 6)]
+        expected = np.concatenate(batches)
+        for size in (None, 15):
+            accumulator = ArrayAccumulator(size)
+            for batch in batches[:2]:
+                accumulator.add(batch)
+            for batch in batches[2:]:
+                accumulator.add(torch.from_numpy(batch))
+            self.assertEqual(len(accumulator), 15)
+            result = accumulator.result()
+            self.assertEqual(result.dtype, np.float32)
+            self.assertListEqual(result.tolist(), expected.tolist())
+
+        accumulator = ArrayAccumulator(4)
+        accumulator.add(batches[0])
+        with self.assertRaises(ValueError):
+            accumulator.add(batches[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -29,7 +29,8 @@ from pytorch_pretrained_bert import (BertConfig, BertModel, BertForMaskedLM,
                                      BertForNextSentencePrediction, BertForPreTraining,
                                      BertForQuestionAnswering, BertForSequenceClassification,
                                      BertForTokenClassification)
-from pytorch_pretrained_bert.modeling import PRETRAINED_MODEL_ARCHIVE_MAP
+from pytorch_pretrained_bert.file_utils import CONFIG_NAME, WEIGHTS_NAME
+from pytorch_pretrained_bert.modeling import PRETRAINED_MODEL_ARCHIVE_MAP, convert_qkv_weights
 
 
 class BertModelTest(unittest.TestCase):
@@ -263,6 +264,123 @@ class BertModelTest(unittest.TestCase):
         os.remove(json_file_path)
         self.assertEqual(config_second.to_dict(), config_first.to_dict())
 
+    def test_fused_qkv(self):
+        config = BertConfig(vocab_size_or_config_json_file=99, hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=4, intermediate_size=37)
+        model = BertModel(config)
+        model.eval()
+        state_dict = model.state_dict()
+        fused_config = BertConfig.from_dict(config.to_dict())
+        fused_config.fused_qkv = True
+        fused_model = BertModel(fused_config)
+        fused_model.eval()
+        fused_state_dict = convert_qkv_weights(model.state_dict(), fused_qkv=True)
+        self.assertNotIn("encoder.layer.0.attention.self.query.weight", fused_state_dict)
+        self.assertListEqual(list(fused_state_dict["encoder.layer.0.attention.self.qkv.weight"].size()), [96, 32])
+        fused_model.load_state_dict(fused_state_dict)
+
+        input_ids = BertModelTest.ids_tensor([3, 7], 99)
+        input_mask = torch.ones_like(input_ids)
+        input_mask[0, 5:] = 0
+        with torch.no_grad():
+            _, pooled_output = model(input_ids, None, input_mask)
+            _, fused_pooled_output = fused_model(input_ids, None, input_mask)
+        self.assertLess((pooled_output - fused_pooled_output).abs().max().item(), 1e-5)
+
+        split_state_dict = convert_qkv_weights(fused_model.state_dict(), fused_qkv=False)
+        for key, value in state_dict.items():
+            self.assertTrue(torch.equal(value, split_state_dict[key]))
+
+    def test_unpad_input(self):
+        config = BertConfig(vocab_size_or_config_json_file=99, hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=4, intermediate_size=37)
+        model = BertModel(config)
+        model.eval()
+        input_ids = BertModelTest.ids_tensor([3, 7], 99)
+        input_mask = torch.ones_like(input_ids)
+        input_mask[0, 5:] = 0
+        input_mask[2, 2:] = 0
+        with torch.no_grad():
+            encoded_layers, pooled_output = model(input_ids, None, input_mask)
+            config.unpad_input = True
+            unpadded_layers, unpadded_pooled_output = model(input_ids, None, input_mask)
+        self.assertEqual(len(unpadded_layers), len(encoded_layers))
+        token_mask = input_mask.unsqueeze(-1).float()
+        for layer, unpadded_layer in zip(encoded_layers, unpadded_layers):
+            self.assertEqual(layer.shape, unpadded_layer.shape)
+            self.assertLess(((layer - unpadded_layer) * token_mask).abs().max().item(), 1e-5)
+            self.assertEqual((unpadded_layer * (1 - token_mask)).abs().max().item(), 0)
+        self.assertLess((pooled_output - unpadded_pooled_output).abs().max().item(), 1e-5)
+
+    def test_early_exit(self):
+        config = BertConfig(vocab_size_or_config_json_file=99, hidden_size=32, num_hidden_layers=3,
+                            num_attention_heads=4, intermediate_size=37, early_exit=True)
+        model = BertForSequenceClassification(config, num_labels=[2, 2, 3])
+        model.eval()
+        input_ids = BertModelTest.ids_tensor([5, 7], 99)
+        input_mask = torch.ones_like(input_ids)
+        input_mask[1, 4:] = 0
+        with torch.no_grad():
+            all_logits = model(input_ids, None, input_mask, output_all_exits=True)
+            self.assertEqual(len(all_logits), 3)
+            logits = model(input_ids, None, input_mask)
+            for logit, final_logit in zip(logits, all_logits[-1]):
+                self.assertLess((logit - final_logit).abs().max().item(), 1e-6)
+
+            # nothing exits before the last layer, then everything exits after the first one
+            for threshold, layer in ((0.0, 2), (float('inf'), 0)):
+                model.exit_threshold = threshold
+                model.exit_counts = [0, 0, 0]
+                logits = model(input_ids, None, input_mask)
+                self.assertEqual(model.exit_counts[layer], 5)
+                for logit, exit_logit in zip(logits, all_logits[layer]):
+                    self.assertLess((logit - exit_logit).abs().max().item(), 1e-5)
+
+    def test_exit_threshold_without_exits(self):
+        config = BertConfig(vocab_size_or_config_json_file=99, hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=4, intermediate_size=37)
+        model = BertForSequenceClassification(config, num_labels=[2, 2, 3])
+        model.eval()
+        input_ids = BertModelTest.ids_tensor([2, 5], 99)
+        with torch.no_grad():
+            with self.assertRaises(ValueError):
+                model(input_ids, output_all_exits=True)
+            model.exit_threshold = 0.5
+            with self.assertRaises(ValueError):
+                model(input_ids)
+
+    def test_quantize_sequence_classification(self):
+        config = BertConfig(vocab_size_or_config_json_file=99, hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=4, intermediate_size=37)
+        model = BertForSequenceClassification(config, num_labels=[2, 2, 3])
+        model.eval()
+        input_ids = BertModelTest.ids_tensor([3, 7], 99)
+        input_mask = torch.ones_like(input_ids)
+        with torch.no_grad():
+            logits = model(input_ids, None, input_mask)
+            model.quantize()
+            quantized_logits = model(input_ids, None, input_mask)
+        self.assertTrue(config.quantized)
+        self.assertNotIsInstance(model.bert.encoder.layer[0].attention.self.query, torch.nn.Linear)
+        self.assertNotIsInstance(model.classifier[2], torch.nn.Linear)
+        for logit, quantized_logit in zip(logits, quantized_logits):
+            self.assertEqual(logit.shape, quantized_logit.shape)
+            self.assertLess((logit - quantized_logit).abs().max().item(), 0.1)
+
+        serialization_dir = "/tmp/pytorch_pretrained_bert_test_int8/"
+        os.makedirs(serialization_dir)
+        try:
+            torch.save(model.state_dict(), os.path.join(serialization_dir, WEIGHTS_NAME))
+            config.to_json_file(os.path.join(serialization_dir, CONFIG_NAME))
+            reloaded = BertForSequenceClassification.from_pretrained(serialization_dir, num_labels=[2, 2, 3])
+        finally:
+            shutil.rmtree(serialization_dir)
+        reloaded.eval()
+        with torch.no_grad():
+            reloaded_logits = reloaded(input_ids, None, input_mask)
+        for quantized_logit, reloaded_logit in zip(quantized_logits, reloaded_logits):
+            self.assertTrue(torch.equal(quantized_logit, reloaded_logit))
+
     @pytest.mark.slow
     def test_model_from_pretrained(self):
         cache_dir = "/tmp/pytorch_pretrained_bert_test/"
@@ -0,0 +1,84 @@
+# coding=utf-8
+# Copyright 2018 The HuggingFace Inc. team.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import torch
+
+from pytorch_pretrained_bert import BertConfig, BertForSequenceClassification
+from pytorch_pretrained_bert.onnx_utils import OnnxSequenceClassifier, export_onnx
+
+try:
+    import onnx
+    import onnxruntime
+    _onnx_available = True
+except ImportError:
+    _onnx_available = False
+
+
+@unittest.skipUnless(_onnx_available, "onnx and onnxruntime are not installed")
+class OnnxUtilsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_export(self, **config_kwargs):
+        config = BertConfig(vocab_size_or_config_json_file=99, hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=4, intermediate_size=37, **config_kwargs)
+        model = BertForSequenceClassification(config, num_labels=[2, 2, 3])
+        model.eval()
+        onnx_file = os.path.join(self.tmp_dir, "model.onnx")
+        export_onnx(model, onnx_file)
+        onnx.checker.check_model(onnx_file)
+        self.assertEqual(config.unpad_input, config_kwargs.get('unpad_input', False))
+        session = OnnxSequenceClassifier(onnx_file)
+
+        # other batch and sequence sizes than the ones of the export
+        for batch_size, seq_length in ((1, 3), (5, 11)):
+            input_ids = torch.randint(0, 99, (batch_size, seq_length))
+            input_mask = torch.ones_like(input_ids)
+            input_mask[-1, 2:] = 0
+            segment_ids = torch.zeros_like(input_ids)
+            with torch.no_grad():
+                logits = model(input_ids, segment_ids, input_mask)
+            onnx_logits = session(input_ids, segment_ids, input_mask)
+            self.assertEqual(len(onnx_logits), 3)
+            for logit, onnx_logit in zip(logits, onnx_logits):
+                self.assertEqual(logit.shape, onnx_logit.shape)
+                self.assertLess((logit - onnx_logit).abs().max().item(), 1e-5)
+
+    def test_export(self):
+        self.check_export()
+
+    def test_export_fused_qkv_unpad(self):
+        self.check_export(fused_qkv=True, unpad_input=True)
+
+    def test_export_quantized(self):
+        config = BertConfig(vocab_size_or_config_json_file=99, hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=4, intermediate_size=37)
+        model = BertForSequenceClassification(config, num_labels=[2, 2, 3]).quantize()
+        with self.assertRaises(ValueError):
+            export_onnx(model, os.path.join(self.tmp_dir, "model.onnx"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -108,6 +108,48 @@ class TokenizationTest(unittest.TestCase):
         self.assertListEqual(
             tokenizer.tokenize("unwantedX running"), ["[UNK]", "runn", "##ing"])
 
+    def test_wordpiece_tokenizer_cache(self):
+        vocab_tokens = [
+            "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+            "##ing"
+        ]
+
+        vocab = {}
+        for (i, token) in enumerate(vocab_tokens):
+            vocab[token] = i
+        tokenizer = WordpieceTokenizer(vocab=vocab, cache_size=2)
+
+        self.assertListEqual(
+            tokenizer.tokenize("unwanted running unwanted"),
+            ["un", "##want", "##ed", "runn", "##ing", "un", "##want", "##ed"])
+        self.assertListEqual(list(tokenizer.cache.keys()), ["running", "unwanted"])
+
+        self.assertListEqual(tokenizer.tokenize("wa unwantedX"), ["wa", "[UNK]"])
+        self.assertListEqual(list(tokenizer.cache.keys()), ["wa", "unwantedX"])
+
+        tokenizer = WordpieceTokenizer(vocab=vocab, cache_size=0)
+        self.assertListEqual(tokenizer.tokenize("runn running"), ["runn", "runn", "##ing"])
+        self.assertEqual(len(tokenizer.cache), 0)
+
+    def test_tokenize_batch(self):
+        vocab_tokens = [
+            "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+            "##ing", ","
+        ]
+        with open("/tmp/bert_tokenizer_test.txt", "w", encoding='utf-8') as vocab_writer:
+            vocab_writer.write("".join([x + "\n" for x in vocab_tokens]))
+
+            vocab_file = vocab_writer.name
+
+        tokenizer = BertTokenizer(vocab_file)
+        os.remove(vocab_file)
+
+        texts = [u"UNwant\u00E9d,running", u"", u"UNwant\u00E9d,running"]
+        batch_tokens = tokenizer.tokenize_batch(texts)
+        self.assertListEqual(batch_tokens, [tokenizer.tokenize(text) for text in texts])
+        batch_tokens[0].append("[SEP]")
+        self.assertListEqual(batch_tokens[2], ["un", "##want", "##ed", ",", "runn", "##ing"])
+
     def test_is_whitespace(self):
         self.assertTrue(_is_whitespace(u" "))
         self.assertTrue(_is_whitespace(u"\t"))